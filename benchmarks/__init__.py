@@ -0,0 +1,6 @@
+"""Offline benchmarks for sosbot.
+
+The real cogs are driven against in-process fakes of Google Sheets and Discord (see fakes.py), so
+command latency, API call counts and memory use can be measured at scale without network access
+or credentials. Run with: python -m benchmarks.run --help
+"""
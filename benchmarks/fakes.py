@@ -0,0 +1,549 @@
+"""In-process stand-ins for the gspread and disnake objects the cogs use.
+
+They implement just the parts of each API sosbot calls, keep their data in memory, and sleep for
+a configurable latency on every call that would be a network round-trip, counting those calls.
+Google calls block (gspread is synchronous, and runs in SheetsAccess's worker threads); Discord
+calls are coroutines.
+"""
+import asyncio
+import io
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import gspread
+from disnake import File, MessageReference, Thread
+from disnake.utils import snowflake_time, time_snowflake
+
+from sosbot.sheets import values_to_records
+
+# one minute, in snowflake units
+MESSAGE_SPACING = 60000 << 22
+
+
+class Latency:
+    """Simulated network delay, with random jitter of up to the given fraction either way."""
+
+    def __init__(self, seconds: float = 0.0, jitter: float = 0.2):
+        """Setup the delay."""
+
+        self.seconds = seconds
+        self.jitter = jitter
+
+    def delay(self) -> float:
+        """Pick the delay for one call."""
+
+        if self.seconds <= 0:
+            return 0.0
+
+        return self.seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def block(self):
+        """Sleep through one call's delay, blocking the calling thread."""
+
+        time.sleep(self.delay())
+
+    async def wait(self):
+        """Sleep through one call's delay, without blocking the event loop."""
+
+        await asyncio.sleep(self.delay())
+
+
+class CallLog:
+    """Thread-safe count of API calls, by name."""
+
+    def __init__(self):
+        """Start with no calls counted."""
+
+        self._lock = threading.Lock()
+        self.counts: Counter = Counter()
+
+    def record(self, name: str):
+        """Count a call."""
+
+        with self._lock:
+            self.counts[name] += 1
+
+    def total(self) -> int:
+        """Count all calls."""
+
+        with self._lock:
+            return sum(self.counts.values())
+
+
+# Google Sheets
+
+
+class FakeWorksheet:
+    """A worksheet: a header row and data rows, all strings."""
+
+    def __init__(self, spreadsheet: "FakeSpreadsheet", sheet_id: int, title: str,
+                 values: List[List[str]]):
+        """Setup the worksheet with its values (header row first)."""
+
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id  # pylint: disable=invalid-name
+        self.title = title
+        self.values = values
+
+    def get_all_records(self) -> List[Dict[str, Any]]:
+        """Read all rows, keyed by the header."""
+
+        self.spreadsheet.call("get_all_records")
+        return values_to_records(self.values)
+
+    def get_all_values(self) -> List[List[str]]:
+        """Read all values, including the header."""
+
+        self.spreadsheet.call("get_all_values")
+        return [list(row) for row in self.values]
+
+    def get_values(self, range_name: str) -> List[List[str]]:
+        """Read whole columns, given as a range like A:B, including the header."""
+
+        self.spreadsheet.call("get_values")
+        first, last = (
+            sum((ord(letter) - ord("A") + 1) * 26 ** idx
+                for idx, letter in enumerate(reversed(col)))
+            for col in range_name.split(":")
+        )
+        return [list(row[first - 1:last]) for row in self.values]
+
+    def col_values(self, col: int) -> List[str]:
+        """Read one (1-based) column, including the header."""
+
+        self.spreadsheet.call("col_values")
+        return [row[col - 1] if len(row) >= col else "" for row in self.values]
+
+
+class FakeSpreadsheet:
+    """A spreadsheet of worksheets, applying the batchUpdate requests the write-behind sends."""
+
+    def __init__(self, spreadsheet_id: str, worksheets: Dict[str, List[List[str]]],
+                 latency: Latency, calls: CallLog):
+        """Setup the spreadsheet with {title: values} worksheets."""
+
+        self.id = spreadsheet_id  # pylint: disable=invalid-name
+        self.latency = latency
+        self.calls = calls
+        self.modified = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+        self.tabs = {
+            title: FakeWorksheet(self, sheet_id, title, values)
+            for sheet_id, (title, values) in enumerate(worksheets.items())
+        }
+
+    def call(self, name: str):
+        """Count a call, and wait out its latency."""
+
+        self.calls.record(name)
+        self.latency.block()
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        """Open a worksheet by title."""
+
+        self.call("worksheet")
+        if title not in self.tabs:
+            raise gspread.exceptions.WorksheetNotFound(title)
+
+        return self.tabs[title]
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        """List the worksheets."""
+
+        self.call("worksheets")
+        return list(self.tabs.values())
+
+    def values_batch_get(self, ranges: Iterable[str]) -> dict:
+        """Read several worksheets (named by absolute range) at once."""
+
+        self.call("values_batch_get")
+        return {"valueRanges": [
+            {"values": [list(row) for row in self.tabs[name.strip("'")].values]}
+            for name in ranges
+        ]}
+
+    def get_lastUpdateTime(self) -> str:  # pylint: disable=invalid-name
+        """Read the Drive modifiedTime."""
+
+        self.call("get_lastUpdateTime")
+        return self.modified.isoformat()
+
+    def batch_update(self, body: dict) -> dict:
+        """Apply addSheet, deleteDimension, insertDimension, updateCells and appendCells
+        requests to row data."""
+
+        self.call("batch_update")
+        by_id = {sheet.id: sheet for sheet in self.tabs.values()}
+        with self._lock:
+            for request in body.get("requests", []):
+                if "addSheet" in request:
+                    properties = request["addSheet"]["properties"]
+                    if properties["title"] in self.tabs or properties["sheetId"] in by_id:
+                        raise ValueError(f"Worksheet {properties['title']} already exists")
+
+                    sheet = FakeWorksheet(self, properties["sheetId"], properties["title"], [])
+                    self.tabs[sheet.title] = by_id[sheet.id] = sheet
+                elif "deleteDimension" in request:
+                    span = request["deleteDimension"]["range"]
+                    del by_id[span["sheetId"]].values[span["startIndex"]:span["endIndex"]]
+                elif "insertDimension" in request:
+                    span = request["insertDimension"]["range"]
+                    values = by_id[span["sheetId"]].values
+                    for _ in range(span["endIndex"] - span["startIndex"]):
+                        values.insert(span["startIndex"], [])
+                elif "appendCells" in request:
+                    append = request["appendCells"]
+                    by_id[append["sheetId"]].values.extend([
+                        [cell["userEnteredValue"]["stringValue"] for cell in row["values"]]
+                        for row in append["rows"]
+                    ])
+                elif "updateCells" in request:
+                    update = request["updateCells"]
+                    values = by_id[update["start"]["sheetId"]].values
+                    for offset, row in enumerate(update["rows"]):
+                        values[update["start"]["rowIndex"] + offset] = [
+                            cell["userEnteredValue"]["stringValue"] for cell in row["values"]
+                        ]
+
+            self.modified = datetime.now(timezone.utc)
+
+        return {}
+
+
+class FakeGspread:
+    """A gspread client, opening spreadsheets by key."""
+
+    def __init__(self, spreadsheets: Dict[str, FakeSpreadsheet]):
+        """Setup the client with the spreadsheets it can open."""
+
+        self.spreadsheets = spreadsheets
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        """Open a spreadsheet."""
+
+        spreadsheet = self.spreadsheets[key]
+        spreadsheet.call("open_by_key")
+        return spreadsheet
+
+
+# Discord
+
+
+class FakeUser:
+    """A Discord user."""
+
+    def __init__(self, user_id: int, name: str):
+        """Setup the user."""
+
+        self.id = user_id  # pylint: disable=invalid-name
+        self.display_name = name
+        self.name = name
+        self.bot = False
+
+
+class FakeAttachment:
+    """An attachment of the given size, downloaded as that many bytes."""
+
+    def __init__(self, discord: "FakeDiscord", filename: str, size: int):
+        """Setup the attachment."""
+
+        self.discord = discord
+        self.filename = filename
+        self.size = size
+
+    async def to_file(self) -> File:
+        """Download the attachment."""
+
+        await self.discord.call("attachment.to_file")
+        return File(io.BytesIO(b"\0" * self.size), filename=self.filename)
+
+
+# pylint: disable=too-many-instance-attributes
+class FakeMessage:
+    """A message in a fake channel."""
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, channel: "FakeChannel", message_id: int, author: FakeUser, content: str,
+                 parent_id: Optional[int] = None, attachments: Iterable[FakeAttachment] = ()):
+        """Setup the message; its creation time comes from its (snowflake) id."""
+
+        self.channel = channel
+        self.id = message_id  # pylint: disable=invalid-name
+        self.author = author
+        self.content = content
+        self.clean_content = content
+        self.created_at = snowflake_time(message_id)
+        self.attachments = list(attachments)
+        self.guild = channel.guild
+        self.reference = None if parent_id is None else MessageReference(
+            message_id=parent_id, channel_id=channel.id)
+
+    def to_reference(self) -> MessageReference:
+        """Reference this message, to reply to it."""
+
+        return MessageReference(message_id=self.id, channel_id=self.channel.id)
+
+    async def reply(self, content: Optional[str] = None, **kwargs) -> "FakeMessage":
+        """Post a reply to this message."""
+
+        return await self.channel.send(content, reference=self.to_reference(), **kwargs)
+
+    async def edit(self, content: Optional[str] = None, **_kwargs) -> "FakeMessage":
+        """Change the message's text."""
+
+        await self.channel.discord.call("message.edit")
+        self.content = self.clean_content = content
+        return self
+
+
+class FakeHistory:
+    """Async iterator over a channel's history, in pages of 100 like the real one."""
+
+    PAGE_SIZE = 100
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, channel: "FakeChannel", limit: Optional[int], after, before,
+                 oldest_first: Optional[bool]):
+        """Setup the iteration; after and before may be datetimes or objects with an id."""
+
+        messages = channel.messages
+        if after is not None:
+            messages = [msg for msg in messages if msg.id > as_snowflake(after)]
+        if before is not None:
+            messages = [msg for msg in messages if msg.id < as_snowflake(before)]
+        if not (oldest_first or (oldest_first is None and after is not None)):
+            messages = list(reversed(messages))
+        if limit is not None:
+            messages = messages[:limit]
+
+        self.channel = channel
+        self._messages = iter(messages)
+        self._served = 0
+
+    def __aiter__(self) -> "FakeHistory":
+        return self
+
+    async def __anext__(self) -> FakeMessage:
+        if self._served % self.PAGE_SIZE == 0:
+            await self.channel.discord.call("channel.history")
+
+        self._served += 1
+        try:
+            return next(self._messages)
+        except StopIteration as stop:
+            raise StopAsyncIteration from stop
+
+    async def flatten(self) -> List[FakeMessage]:
+        """Read the whole history into a list."""
+
+        return [message async for message in self]
+
+
+class FakeChannel:
+    """A text channel: an in-order list of messages."""
+
+    def __init__(self, discord: "FakeDiscord", channel_id: int, name: str, guild):
+        """Setup an empty channel."""
+
+        self.discord = discord
+        self.id = channel_id  # pylint: disable=invalid-name
+        self.name = name
+        self.guild = guild
+        self.messages: List[FakeMessage] = []
+        self._by_id: Dict[int, FakeMessage] = {}
+
+    def post(self, author: FakeUser, content: str, parent_id: Optional[int] = None,
+             attachments: Iterable[FakeAttachment] = ()) -> FakeMessage:
+        """Add a message directly (no API call), as if someone else had posted it."""
+
+        message = FakeMessage(self, self.discord.next_id(), author, content, parent_id,
+                              attachments)
+        self.messages.append(message)
+        self._by_id[message.id] = message
+        return message
+
+    async def send(self, content: Optional[str] = None, *, reference=None, **_kwargs) -> \
+            FakeMessage:
+        """Post a message as the bot."""
+
+        await self.discord.call("channel.send")
+        parent_id = reference.message_id if reference is not None else None
+        return self.post(self.discord.user, content or "", parent_id)
+
+    def find(self, message_id: int) -> Optional[FakeMessage]:
+        """Look a message up by id, without an API call."""
+
+        return self._by_id.get(message_id)
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        """Read one message by id."""
+
+        await self.discord.call("channel.fetch_message")
+        return self._by_id[message_id]
+
+    def history(self, limit: Optional[int] = 100, after=None, before=None,
+                oldest_first: Optional[bool] = None) -> FakeHistory:
+        """Iterate over the channel's messages."""
+
+        return FakeHistory(self, limit, after, before, oldest_first)
+
+    async def create_thread(self, name: str, message: FakeMessage) -> "FakeThread":
+        """Start a thread from a message."""
+
+        await self.discord.call("channel.create_thread")
+        return FakeThread(self.discord, self.discord.next_id(), name, self.guild, self,
+                          message)
+
+    def typing(self):
+        """Show the typing indicator (for `with` or `async with`)."""
+
+        return Typing()
+
+
+class Typing:
+    """No-op typing indicator usable with either `with` or `async with`."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+# pylint: disable=abstract-method,super-init-not-called
+class FakeThread(FakeChannel, Thread):
+    """A thread, recognizable with isinstance(channel, Thread) the way save_thread checks."""
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, discord: "FakeDiscord", channel_id: int, name: str, guild,
+                 parent: FakeChannel, starter: Optional[FakeMessage] = None):
+        """Setup an empty thread in the parent channel."""
+
+        FakeChannel.__init__(self, discord, channel_id, name, guild)
+        self._parent = parent
+        self.starter = starter
+
+    @property
+    def parent(self) -> FakeChannel:
+        """The channel the thread is in."""
+
+        return self._parent
+
+
+class FakeGuild:
+    """A server."""
+
+    def __init__(self, guild_id: int, name: str):
+        """Setup the server."""
+
+        self.id = guild_id  # pylint: disable=invalid-name
+        self.name = name
+
+
+class FakeCommand:
+    """The parts of a disnake Command that handlers read from the context."""
+
+    def __init__(self, name: str):
+        """Setup the command."""
+
+        self.name = name
+        self.qualified_name = name
+
+
+class FakeContext:
+    """A command invocation context."""
+
+    def __init__(self, message: FakeMessage, command: str):
+        """Setup the context for a command message."""
+
+        self.message = message
+        self.channel = message.channel
+        self.guild = message.guild
+        self.author = message.author
+        self.command = FakeCommand(command)
+
+    async def reply(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        """Reply to the command message."""
+
+        return await self.message.reply(content, **kwargs)
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        """Post in the command's channel."""
+
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        """Show the typing indicator (for `with` or `async with`)."""
+
+        return Typing()
+
+
+class FakeDiscord:
+    """A Discord client: the bot user, its message cache, and the API call log."""
+
+    def __init__(self, latency: Latency, calls: CallLog, cached_messages: int = 1000):
+        """Setup the client. Like the real one, it only caches the most recent messages."""
+
+        self.latency = latency
+        self.calls = calls
+        self.user = FakeUser(1, "sosbot")
+        self.cached_messages = cached_messages
+        self.channels: List[FakeChannel] = []
+        self._ids = itertools.count(
+            time_snowflake(datetime.now(timezone.utc) - timedelta(days=365)), MESSAGE_SPACING)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The running event loop."""
+
+        return asyncio.get_event_loop()
+
+    def next_id(self) -> int:
+        """Allocate a snowflake id, later than every one before it. Ids are a minute apart, so
+        messages posted in bulk are spread over many days."""
+
+        return next(self._ids)
+
+    async def call(self, name: str):
+        """Count a call, and wait out its latency."""
+
+        self.calls.record(name)
+        await self.latency.wait()
+
+    def get_message(self, message_id: int) -> Optional[FakeMessage]:
+        """Look a message up in the client cache (the latest messages of each channel)."""
+
+        for channel in self.channels:
+            message = channel.find(message_id)
+            recent = channel.messages[-self.cached_messages:]
+            if message is not None and len(recent) > 0 and message.id >= recent[0].id:
+                return message
+
+        return None
+
+    def channel(self, name: str, guild: FakeGuild) -> FakeChannel:
+        """Create a channel."""
+
+        channel = FakeChannel(self, self.next_id(), name, guild)
+        self.channels.append(channel)
+        return channel
+
+
+def as_snowflake(value) -> int:
+    """Turn a history bound (datetime, or anything with an id) into a snowflake id."""
+
+    if isinstance(value, datetime):
+        return time_snowflake(value, high=True)
+
+    return value.id
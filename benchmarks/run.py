@@ -0,0 +1,476 @@
+"""Drive the real cogs against the fakes at scale, and report on each command.
+
+For every scenario, this reports wall-clock latency, the Google and Discord API calls made, and
+the peak memory allocated while it ran. Results can be saved as JSON and compared against a
+previous run, failing if anything got slower (beyond a tolerance) or made more API calls.
+
+Usage: python -m benchmarks.run --rows 10000 --messages 50000 --latency 0.05
+"""
+import asyncio
+import json
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import join
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import click
+
+from benchmarks.fakes import (CallLog, FakeAttachment, FakeChannel, FakeContext, FakeDiscord,
+                              FakeGspread, FakeGuild, FakeSpreadsheet, FakeThread, FakeUser,
+                              Latency)
+from sosbot.bulk import Collection, import_rows
+from sosbot.bot import CONFIG_DEFINITION_GSHEET, CONFIG_DATASET_GSHEET, CONFIG_DISCORD_SAVEDIR
+from sosbot.cogs import datasets, definitions, threads
+from sosbot.cogs.datasets import DatasetCog
+from sosbot.cogs.definitions import DefinitionCog
+from sosbot.cogs.threads import Conversations
+from sosbot.index import fold
+from sosbot.journal import WriteBehind, WriteJournal
+from sosbot.metrics import Metrics
+from sosbot.partitions import PartitionMap, Partitions
+from sosbot.scheduler import Scheduler
+from sosbot.search import SearchIndex
+from sosbot.sheets import SheetsAccess
+
+DEFINITIONS_ID = "definitions"
+DATASETS_ID = "datasets"
+ENTRIES_PER_DATASET = 20
+REPLY_EVERY = 10
+LETTERS = string.ascii_uppercase
+ATTACHMENT_SIZE = 256 * 1024
+
+
+class Result(NamedTuple):
+    """Measurements for one scenario."""
+
+    name: str
+    seconds: float
+    google_calls: int
+    discord_calls: int
+    peak_kib: float
+
+
+class BenchGoogle:
+    """Stands in for GoogleAccess, serving the fake spreadsheets through the real access layer,
+    scheduler and write-behind queue."""
+
+    def __init__(self, gspread_client: FakeGspread, metrics: Metrics, workdir: str):
+        """Setup the access layer, with quotas high enough to never get in the way."""
+
+        self.config = {CONFIG_DEFINITION_GSHEET: DEFINITIONS_ID,
+                       CONFIG_DATASET_GSHEET: DATASETS_ID}
+        self.metrics = metrics
+        self._sheets = SheetsAccess(gspread_client, scheduler=Scheduler(1e9, 1e9),
+                                    metrics=metrics)
+        self._write_behind = WriteBehind(
+            WriteJournal(join(workdir, "write-journal.jsonl")), self._sheets, interval=3600)
+        self._partitions: Dict[str, Partitions] = {}
+
+    def get_sheets(self) -> SheetsAccess:
+        """Retrieve the access layer."""
+
+        return self._sheets
+
+    def get_write_behind(self) -> WriteBehind:
+        """Retrieve the write-behind queue."""
+
+        return self._write_behind
+
+    def get_partitions(self, spreadsheet_id: str) -> Partitions:
+        """Retrieve a spreadsheet's partition map."""
+
+        if spreadsheet_id not in self._partitions:
+            self._partitions[spreadsheet_id] = Partitions(self._sheets, spreadsheet_id)
+
+        return self._partitions[spreadsheet_id]
+
+    @staticmethod
+    def get_replica():
+        """No local replica."""
+
+        return None
+
+
+class BenchDiscord:
+    """Stands in for DiscordBot."""
+
+    def __init__(self, client: FakeDiscord, workdir: str):
+        """Setup the bot config, saving conversations under the working directory."""
+
+        self.bot = client
+        self.config = {CONFIG_DISCORD_SAVEDIR: join(workdir, "saved")}
+
+
+# pylint: disable=too-few-public-methods
+class BenchBot:
+    """Stands in for SOSBot."""
+
+    def __init__(self, discord: BenchDiscord, google: BenchGoogle, metrics: Metrics):
+        """Setup the bot from its parts."""
+
+        self.discord = discord
+        self.google = google
+        self.search = SearchIndex()
+        self.metrics = metrics
+
+
+# pylint: disable=too-many-instance-attributes
+class Environment:
+    """Fake spreadsheets and channels populated at the requested scale, with the real cogs."""
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, rows: int, messages: int, depth: int, latency: float, workdir: str):
+        """Generate the data, and setup the cogs over it."""
+
+        random.seed(497)
+        self.google_calls = CallLog()
+        self.discord_calls = CallLog()
+        google_latency = Latency(latency)
+        self.gspread = FakeGspread({
+            DEFINITIONS_ID: FakeSpreadsheet(
+                DEFINITIONS_ID, glossary_sheets(rows), google_latency, self.google_calls),
+            DATASETS_ID: FakeSpreadsheet(
+                DATASETS_ID, dataset_sheets(rows), google_latency, self.google_calls),
+        })
+        self.discord = FakeDiscord(Latency(latency), self.discord_calls)
+        self.metrics = Metrics()
+        self.bot = BenchBot(BenchDiscord(self.discord, workdir),
+                            BenchGoogle(self.gspread, self.metrics, workdir), self.metrics)
+
+        self.rows = rows
+        self.guild = FakeGuild(497, "SOS 497")
+        self.users = [FakeUser(100 + idx, f"user{idx}") for idx in range(50)]
+        self.channel = self.discord.channel("general", self.guild)
+        self.chain = populate_channel(self.channel, self.users, messages, depth)
+        self.thread = FakeThread(self.discord, self.discord.next_id(), "long-thread", self.guild,
+                                 self.channel)
+        self.discord.channels.append(self.thread)
+        for idx in range(messages):
+            self.thread.post(random.choice(self.users), f"thread message {idx} " + words(12))
+
+        self.old_reply: Optional[int] = None
+        self.definitions = DefinitionCog(self.bot)
+        self.datasets = DatasetCog(self.bot)
+        self.conversations = Conversations(self.bot)
+
+    def context(self, content: str, command: str, parent_id: Optional[int] = None,
+                channel: Optional[FakeChannel] = None) -> FakeContext:
+        """Post a command message (without an API call), and build its context."""
+
+        message = (channel or self.channel).post(self.users[0], content, parent_id)
+        return FakeContext(message, command)
+
+    def feed_reply_graph(self):
+        """Let the conversations cog see every message, as if it had been running all along."""
+
+        replies = self.conversations.replies
+        replies.started_at = self.channel.messages[0].id - 1
+        for message in self.channel.messages:
+            replies.add(self.channel.id, message.id,
+                        message.reference.message_id if message.reference else None)
+
+    def reply_to_old_message(self):
+        """Reply to a message long out of the client's message cache, so that the conversation
+        (the root and any older replies to it) has to be loaded from Discord."""
+
+        root = self.channel.messages[len(self.channel.messages) // 10]
+        reply = self.channel.post(self.users[2], words(10), root.id)
+        self.conversations.replies.add(self.channel.id, reply.id, root.id)
+        self.old_reply = reply.id
+
+
+def words(count: int) -> str:
+    """Generate filler text."""
+
+    return " ".join(random.choice(VOCABULARY) for _ in range(count))
+
+
+VOCABULARY = ("enrollment attendance budget district teacher student assessment curriculum "
+              "grant funding report survey board policy transport lunch graduation census "
+              "literacy math science staffing salary facility bond levy").split()
+
+
+def glossary_sheets(rows: int) -> Dict[str, List[List[str]]]:
+    """Generate the glossary's partitions, each sorted by term like the real Sheet."""
+
+    routes = PartitionMap()
+    partitions: Dict[str, List[List[str]]] = {key: [] for key in routes.titles}
+    for idx in range(rows):
+        term = f"{LETTERS[idx % 25]}{random.choice(VOCABULARY)}{idx}"
+        partitions[routes.route(term)].append([term, words(20), "someone", "01/01/24"])
+
+    return {
+        key: [list(definitions.COLUMNS)] + sorted(values, key=lambda row: fold(row[0]))
+        for key, values in partitions.items()
+    }
+
+
+def dataset_sheets(rows: int) -> Dict[str, List[List[str]]]:
+    """Generate the datasets' partitions: groups of entries under each dataset name."""
+
+    routes = PartitionMap()
+    partitions: Dict[str, List[List[str]]] = {key: [] for key in routes.titles}
+    for idx in range(rows):
+        group = idx // ENTRIES_PER_DATASET
+        dataset = f"{LETTERS[group % 25]}data{group}"
+        partitions[routes.route(dataset)].append(
+            [dataset, f"https://example.com/{dataset}/{idx}", words(10), "someone", "01/01/24"])
+
+    return {
+        key: [list(datasets.COLUMNS)] + sorted(values, key=lambda row: fold(row[0]))
+        for key, values in partitions.items()
+    }
+
+
+def populate_channel(channel: FakeChannel, users: List[FakeUser], messages: int,
+                     depth: int) -> List[int]:
+    """Fill a channel with chatter, some of it replies, with one deep reply chain running
+    through the most recent part of it. Returns the ids of the chain, root first."""
+
+    chain: List[int] = []
+    chain_start = max(0, messages - depth * REPLY_EVERY)
+    for idx in range(messages):
+        parent_id = None
+        if idx >= chain_start and (idx - chain_start) % REPLY_EVERY == 0 and len(chain) < depth:
+            parent_id = chain[-1] if len(chain) > 0 else None
+            message = channel.post(random.choice(users), words(15), parent_id)
+            chain.append(message.id)
+            continue
+
+        if idx > 0 and random.random() < 0.2:
+            parent_id = channel.messages[random.randrange(len(channel.messages))].id
+
+        channel.post(random.choice(users), words(15), parent_id)
+
+    return chain
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+async def measure(env: Environment, name: str, scenario: Callable[[], Awaitable],
+                  prepare: Optional[Callable[[], None]], trace_memory: bool) -> Result:
+    """Run one scenario (after its unmeasured preparation, if any), measuring it."""
+
+    if prepare is not None:
+        prepare()
+
+    google_before = env.google_calls.total()
+    discord_before = env.discord_calls.total()
+    if trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    await scenario()
+    seconds = time.perf_counter() - started
+
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return Result(name, seconds, env.google_calls.total() - google_before,
+                  env.discord_calls.total() - discord_before, peak / 1024)
+
+
+# pylint: disable=too-many-locals
+def scenarios(env: Environment) -> List[tuple]:
+    """List the (name, scenario, preparation) to run, in order: later ones rely on the indexes
+    the earlier ones load."""
+
+    term = env.gspread.spreadsheets[DEFINITIONS_ID].tabs["A-E"].values[1][0]
+    dataset = env.gspread.spreadsheets[DATASETS_ID].tabs["A-E"].values[1][0]
+    glossary, sets, convos = env.definitions, env.datasets, env.conversations
+
+    async def lookups(count: int):
+        for _ in range(count):
+            await glossary.lookup_definition.callback(
+                glossary, env.context(f"!whatis {term}", "whatis"), term)
+
+    async def completions(count: int):
+        for idx in range(count):
+            await glossary.complete_term(None, term[:1 + idx % 3])
+            await sets.complete_dataset(None, dataset[:1 + idx % 3])
+
+    async def define_and_flush():
+        for idx in range(25):
+            new_term = f"Bench{idx}"
+            await glossary.save_definition.callback(
+                glossary, env.context(f"!define {new_term} as test", "define"), new_term, "as",
+                definition="test")
+        await glossary.write_behind.flush()
+
+    async def set_datasets_and_flush():
+        for idx in range(25):
+            await sets.set_dataset.callback(sets, env.context(
+                f"!set-dataset {dataset} https://example.com/new/{idx} new entry",
+                "set-dataset"))
+        await sets.write_behind.flush()
+
+    async def clear_datasets_and_flush():
+        for idx in range(25):
+            await sets.remove_from_dataset.callback(sets, env.context(
+                f"!clear-dataset {dataset} https://example.com/new/{idx}", "clear-dataset"))
+        await sets.write_behind.flush()
+
+    async def save_convo(title: str, parent_id: Optional[int] = None):
+        ctx = env.context(f"!save-convo {title}", "save-convo", parent_id or env.chain[-1])
+        await convos.save_convo.callback(convos, ctx, title=title)
+
+    async def make_thread():
+        root = env.channel.post(env.users[1], "attachments root")
+        parent = root
+        for idx in range(50):
+            parent = env.channel.post(
+                env.users[idx % 5], words(10), parent.id,
+                [FakeAttachment(env.discord, f"image{idx}.png", ATTACHMENT_SIZE)])
+        ctx = env.context("!make-thread attachments", "make-thread", parent.id)
+        await convos.make_thread.callback(convos, ctx, title="attachments")
+
+    async def save_thread():
+        ctx = env.context("!save-thread", "save-thread", channel=env.thread)
+        await convos.save_thread.callback(convos, ctx)
+
+    async def read_burst(count: int):
+        # a class starting: everyone asking about the same partition at once
+        sheets = env.bot.google.get_sheets()
+        await asyncio.gather(
+            *(sheets.get_all_records(DEFINITIONS_ID, "K-O") for _ in range(count)))
+
+    async def bulk_import(count: int):
+        # half of the rows are already in the glossary, so they exercise the dedup
+        existing = [row[0] for tab in env.gspread.spreadsheets[DEFINITIONS_ID].tabs.values()
+                    for row in tab.values[1:]]
+        rows = [{"term": f"{LETTERS[idx % 26]}import{idx}", "definition": words(8)}
+                for idx in range(count // 2)]
+        rows += [{"term": random.choice(existing), "definition": "dup"}
+                 for _ in range(count - len(rows))]
+        await import_rows(
+            env.bot.google.get_partitions(DEFINITIONS_ID),
+            Collection(CONFIG_DEFINITION_GSHEET, definitions.COLUMNS, ("Term",)), rows, "bench")
+
+    async def rebalance():
+        # after the import, the glossary partitions are well past the default row limit
+        await glossary.refresh_index()
+
+    return [
+        ("whatis (cold index)", lambda: lookups(1), None),
+        ("whatis x100 (warm)", lambda: lookups(100), None),
+        ("whatis miss + suggestions", lambda: glossary.lookup_definition.callback(
+            glossary, env.context("!whatis enrolment", "whatis"), "enrolment"), None),
+        ("autocomplete x1000", lambda: completions(1000), None),
+        ("partition read burst x10", lambda: read_burst(10), None),
+        ("define x25 + flush", define_and_flush, None),
+        ("dataset (cold index)", lambda: sets.get_dataset.callback(
+            sets, env.context(f"!dataset {dataset}", "dataset")), None),
+        ("datasets", lambda: sets.list_datasets.callback(
+            sets, env.context("!datasets", "datasets")), None),
+        ("set-dataset x25 + flush", set_datasets_and_flush, None),
+        ("clear-dataset x25 + flush", clear_datasets_and_flush, None),
+        ("save-convo (history scan)", lambda: save_convo("deep chain"), None),
+        ("save-convo (reply graph)", lambda: save_convo("graph"), env.feed_reply_graph),
+        ("save-convo (re-save)", lambda: save_convo("graph"), None),
+        ("save-convo (uncached root)",
+         lambda: save_convo("old root", env.old_reply), env.reply_to_old_message),
+        ("make-thread (50 attachments)", make_thread, None),
+        ("save-thread", save_thread, None),
+        ("import 50k glossary rows", lambda: bulk_import(50000), None),
+        ("reload + split partitions", rebalance, None),
+    ]
+
+
+def report(results: List[Result]):
+    """Print the results as a table."""
+
+    print(f"{'scenario':<32} {'seconds':>10} {'google':>8} {'discord':>8} {'peak KiB':>10}")
+    for result in results:
+        print(f"{result.name:<32} {result.seconds:>10.3f} {result.google_calls:>8} "
+              f"{result.discord_calls:>8} {result.peak_kib:>10.0f}")
+
+
+def regressions(results: List[Result], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Compare results against a baseline run: anything slower by more than the tolerance, or
+    making more API calls, is a regression."""
+
+    found = []
+    for result in results:
+        before = baseline.get(result.name)
+        if before is None:
+            continue
+
+        if result.seconds > before["seconds"] * (1 + tolerance):
+            found.append(f"{result.name}: {before['seconds']:.3f}s -> {result.seconds:.3f}s")
+        for calls in ("google_calls", "discord_calls"):
+            if getattr(result, calls) > before[calls]:
+                found.append(f"{result.name}: {calls} {before[calls]} -> "
+                             f"{getattr(result, calls)}")
+
+    return found
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+async def run_all(rows: int, messages: int, depth: int, latency: float,
+                  trace_memory: bool, discord_pacing: bool) -> List[Result]:
+    """Setup the environment and run every scenario. Without Discord pacing, make-thread posts
+    as fast as it can, so the benchmark measures the bot rather than the rate limit."""
+
+    if not discord_pacing:
+        threads.SEND_RATE_PER_MINUTE = float("inf")
+        threads.SEND_BURST = sys.maxsize
+
+    with tempfile.TemporaryDirectory(prefix="sosbot-bench-") as workdir:
+        started = time.perf_counter()
+        env = Environment(rows, messages, depth, latency, workdir)
+        print(f"Generated {rows} rows per spreadsheet, {messages} messages per channel "
+              f"and a {depth}-deep reply chain in {time.perf_counter() - started:.1f}s")
+
+        results = [
+            await measure(env, name, scenario, prepare, trace_memory)
+            for name, scenario, prepare in scenarios(env)
+        ]
+        env.bot.google.get_sheets().shutdown()
+        env.conversations.archive_index.close()
+        return results
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+@click.command()
+@click.option("--rows", default=10000, help="Rows in each fake spreadsheet")
+@click.option("--messages", default=50000, help="Messages in the fake channel and thread")
+@click.option("--depth", default=200, help="Length of the reply chain to save")
+@click.option("--latency", default=0.0, help="Simulated seconds per API call")
+@click.option("--trace-memory/--no-trace-memory", default=True,
+              help="Measure peak memory (slows every scenario down)")
+@click.option("--discord-pacing/--no-discord-pacing", default=False,
+              help="Pace make-thread posts at Discord's real rate limit")
+@click.option("--output", default=None, help="Save the results as JSON")
+@click.option("--baseline", default=None, help="Fail on regressions against saved results")
+@click.option("--tolerance", default=0.25, help="Slowdown allowed against the baseline")
+def main(rows, messages, depth, latency, trace_memory, discord_pacing, output, baseline,
+         tolerance):
+    """Run the benchmarks"""
+
+    results = asyncio.run(
+        run_all(rows, messages, depth, latency, trace_memory, discord_pacing))
+    report(results)
+
+    if output:
+        with open(output, 'w', encoding="utf-8") as output_file:
+            json.dump({result.name: result._asdict() for result in results}, output_file,
+                      indent=2)
+
+    if baseline:
+        with open(baseline, 'r', encoding="utf-8") as baseline_file:
+            found = regressions(results, json.load(baseline_file), tolerance)
+
+        for regression in found:
+            print(f"REGRESSION {regression}")
+
+        if len(found) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -22,12 +22,12 @@ setup(
     author_email='jdcasey@commonjava.org',
     url='https://github.com/sos497/sosbot',
     license='APLv2',
-    packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+    packages=find_packages(exclude=['ez_setup', 'examples', 'tests', 'benchmarks']),
     install_requires=reqs,
     test_suite="tests",
     entry_points={
         'console_scripts': [
-            'sosbot = sosbot:start',
+            'sosbot = sosbot:cli',
         ],
     }
 )
@@ -1,4 +1,7 @@
 """Init section of sosbot"""
-from sosbot.command import start
+# Imported first, so the startup clock covers the time taken by every other import.
+# pylint: disable=unused-import
+from sosbot.startup import STARTUP
+from sosbot.command import cli, start
 
-__all__ = ["start"]
+__all__ = ["cli", "start"]
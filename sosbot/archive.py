@@ -0,0 +1,474 @@
+"""Checkpoints for saved conversations and threads.
+
+Each saved Markdown file gets a JSON sidecar recording the newest message archived in it, the date
+heading it ended on, and (for conversations) the ids of the messages in the reply set. Saving the
+same title again then only needs the messages posted after the checkpoint, which are appended to
+the existing file instead of rewriting it from scratch.
+
+ArchiveWriter formats messages into the Markdown file as they arrive, flushing it (and the
+checkpoint) in chunks, so arbitrarily long threads can be archived without holding them in memory.
+Each chunk is also added to an ArchiveIndex: a SQLite FTS5 index of every archived message, so
+saved conversations can be searched across a whole server without opening the files.
+
+Two more sidecars record where things start in the file: one lists the byte offset of each date
+heading, and the other holds the offset of every message as a fixed-width record. A range of dates
+can then be cut out of a large archive (see excerpt()) by reading only that part of it, and the
+message offsets are bisected in place, through a memory map, rather than read in full.
+"""
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import pytz
+from disnake import Message
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+OFFSETS_SUFFIX = ".offsets"
+MESSAGES_SUFFIX = ".messages"
+SIDECAR_SUFFIXES = (CHECKPOINT_SUFFIX, CHECKPOINT_SUFFIX + ".tmp", OFFSETS_SUFFIX,
+                    MESSAGES_SUFFIX)
+MESSAGE_RECORD = struct.Struct(">Q")
+CHUNK_SIZE = 500
+SNIPPET_WORDS = 12
+
+INDEX_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    content,
+    author,
+    guild UNINDEXED,
+    channel UNINDEXED,
+    title UNINDEXED,
+    timestamp UNINDEXED,
+    message_id UNINDEXED
+);
+"""
+
+
+class Offsets(NamedTuple):
+    """Where things start in a saved Markdown file: (offset, date) for each date heading, and
+    the offset of each message."""
+
+    headings: List[Tuple[int, date]]
+    messages: Sequence[int]
+
+
+class MessageOffsets(Sequence[int]):
+    """The message offsets of a saved Markdown file, read straight from their fixed-width
+    records through a memory map, so they can be bisected without reading them all. Use as a
+    context manager."""
+
+    def __init__(self, storage_path: str):
+        """Map the message offsets sidecar of the file at storage_path."""
+
+        self._file = open(messages_path(storage_path), 'rb')  # pylint: disable=consider-using-with
+        size = os.fstat(self._file.fileno()).st_size
+        self._count = size // MESSAGE_RECORD.size
+        self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self._count > 0 else None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[position] for position in range(*idx.indices(self._count))]
+
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError(idx)
+
+        return MESSAGE_RECORD.unpack_from(self._mapped, idx * MESSAGE_RECORD.size)[0]
+
+    def close(self):
+        """Unmap and close the sidecar."""
+
+        if self._mapped is not None:
+            self._mapped.close()
+        self._file.close()
+
+    def __enter__(self) -> "MessageOffsets":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArchiveHit(NamedTuple):
+    """An archived message matching a search, with the matching words highlighted."""
+
+    channel: str
+    title: str
+    timestamp: str
+    author: str
+    snippet: str
+
+
+class ArchiveIndex:
+    """Full-text index of archived messages, by server, channel and saved title."""
+
+    def __init__(self, path: str):
+        """Open (or create) the index database at the given path."""
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(INDEX_SCHEMA)
+
+    def clear(self, guild: str, channel: str, title: str):
+        """Drop the messages indexed for a saved conversation, before it's saved over."""
+
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM messages WHERE guild = ? AND channel = ? AND title = ?",
+                (guild, channel, title)
+            )
+
+    def add(self, guild: str, channel: str, title: str, messages: Iterable[Tuple]):
+        """Index (message id, timestamp, author, content) tuples for a saved conversation."""
+
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages (content, author, guild, channel, title, timestamp, "
+                "message_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (content, author, guild, channel, title, timestamp, message_id)
+                    for message_id, timestamp, author, content in messages
+                ]
+            )
+
+    def search(self, guild: str, query: str, limit: int = 10) -> List[ArchiveHit]:
+        """Rank the archived messages in a server against the words in the query (BM25)."""
+
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+        if len(match) < 1:
+            return []
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT channel, title, timestamp, author, "
+                f"snippet(messages, 0, '**', '**', '...', {SNIPPET_WORDS}) "
+                "FROM messages WHERE messages MATCH ? AND guild = ? ORDER BY rank LIMIT ?",
+                (match, guild, limit)
+            ).fetchall()
+
+        return [ArchiveHit(*row) for row in rows]
+
+    def close(self):
+        """Close the database."""
+
+        with self._lock:
+            self._db.close()
+
+
+class Checkpoint:
+    """Where a saved conversation or thread left off."""
+
+    def __init__(self, root_id: Optional[int] = None, last_id: Optional[int] = None,
+                 last_date: Optional[str] = None, members: Iterable[int] = ()):
+        """Setup a checkpoint. A fresh one (no last_id) means nothing has been archived yet."""
+
+        self.root_id = root_id
+        self.last_id = last_id
+        self.last_date = last_date
+        self.members: Set[int] = set(members)
+
+    @property
+    def empty(self) -> bool:
+        """Check whether anything has been archived yet."""
+
+        return self.last_id is None
+
+    def advance(self, message_id: int, datestr: str):
+        """Record a message as archived. Reply-set membership is only kept for conversations
+        (checkpoints with a root); threads don't need it, and can be very long."""
+
+        if self.root_id is not None:
+            self.members.add(message_id)
+        self.last_date = datestr
+        if self.last_id is None or message_id > self.last_id:
+            self.last_id = message_id
+
+    def save(self, storage_path: str):
+        """Write the sidecar for the Markdown file at storage_path."""
+
+        path = checkpoint_path(storage_path)
+        with open(path + ".tmp", 'w', encoding="utf-8") as checkpoint_file:
+            json.dump({
+                "root": self.root_id,
+                "last_id": self.last_id,
+                "last_date": self.last_date,
+                "members": sorted(self.members),
+            }, checkpoint_file)
+
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, storage_path: str, root_id: Optional[int] = None) -> "Checkpoint":
+        """Read the sidecar for the Markdown file at storage_path. If there isn't one, the file
+        itself is missing, or the checkpoint belongs to a different conversation (the title was
+        reused), a fresh checkpoint is returned and the file will be rewritten."""
+
+        path = checkpoint_path(storage_path)
+        if not os.path.exists(storage_path) or not os.path.exists(path):
+            return cls(root_id)
+
+        try:
+            with open(path, 'r', encoding="utf-8") as checkpoint_file:
+                data = json.load(checkpoint_file)
+        except ValueError as error:
+            print(f"Ignoring unreadable checkpoint {path}: {error}")
+            return cls(root_id)
+
+        if data.get("root") != root_id:
+            return cls(root_id)
+
+        return cls(root_id, data.get("last_id"), data.get("last_date"), data.get("members", []))
+
+
+# pylint: disable=too-many-instance-attributes
+class ArchiveWriter:
+    """Append messages to a saved Markdown file, writing out and checkpointing every chunk."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, storage_path: str, checkpoint: Checkpoint, chunk_size: int = CHUNK_SIZE,
+                 index: Optional[ArchiveIndex] = None,
+                 location: Optional[Tuple[str, str, str]] = None):
+        """Open the file: appending to it if the checkpoint says part of it was saved already,
+        otherwise starting it over. Given an index, the messages are also indexed under the
+        location: the (server, channel, title) the file is saved as."""
+
+        if not os.path.isdir(os.path.dirname(storage_path)):
+            os.makedirs(os.path.dirname(storage_path))
+
+        self.storage_path = storage_path
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size
+        self.written = 0
+        self._resumed = not checkpoint.empty
+        self._pending: List[str] = []
+        self._indexed: List[Tuple] = []
+        self._index = index if location is not None else None
+        self._location = location
+        if self._index is not None and not self._resumed:
+            self._index.clear(*location)
+
+        self._offsets: List[str] = []
+        self._messages: List[bytes] = []
+        self._position = 0
+        if self._resumed:
+            self._position = os.path.getsize(storage_path)
+            if not has_offsets(storage_path):
+                write_offsets(storage_path, scan_offsets(storage_path))
+
+        # pylint: disable=consider-using-with
+        self._file = open(storage_path, 'a' if self._resumed else 'w', encoding="utf-8")
+        # pylint: disable=consider-using-with
+        self._offsets_file = open(offsets_path(storage_path), 'a' if self._resumed else 'w',
+                                  encoding="utf-8")
+        # pylint: disable=consider-using-with
+        self._messages_file = open(messages_path(storage_path), 'ab' if self._resumed else 'wb')
+
+    def header(self, title: str, channel_name: str, server_name: str):
+        """Start a new file with its title and where it was recorded. Resumed files have one."""
+
+        if not self._resumed:
+            self._emit(
+                f"# {title}\n\n"
+                f"**NOTE:** This conversation was recorded in {channel_name}, "
+                f"on server {server_name}.\n"
+            )
+
+    def write(self, message: Message):
+        """Add a message, under a new date heading if it's from a different day."""
+
+        msg_date = message.created_at.replace(tzinfo=pytz.timezone("US/Central"))
+        datestr = msg_date.strftime("%x")
+        timestr = msg_date.strftime("%X")
+        if datestr != self.checkpoint.last_date:
+            self._emit("\n", None)
+            self._emit(f"## {datestr}\n", f"D {self._position} {msg_date.date().isoformat()}")
+
+        self._messages.append(MESSAGE_RECORD.pack(self._position))
+        self._emit(f"* {timestr} @{message.author.display_name}: {message.clean_content}\n")
+        if self._index is not None:
+            self._indexed.append((message.id, message.created_at.isoformat(),
+                                  message.author.display_name, message.clean_content))
+
+        self.checkpoint.advance(message.id, datestr)
+        self.written += 1
+        if self.written % self.chunk_size == 0:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered messages, then checkpoint them, so an interrupted save
+        resumes from here."""
+
+        self._file.write("".join(self._pending))
+        self._file.flush()
+        self._pending = []
+        self._offsets_file.write("".join(self._offsets))
+        self._offsets_file.flush()
+        self._offsets = []
+        self._messages_file.write(b"".join(self._messages))
+        self._messages_file.flush()
+        self._messages = []
+        if len(self._indexed) > 0:
+            self._index.add(*self._location, self._indexed)
+            self._indexed = []
+
+        self.checkpoint.save(self.storage_path)
+
+    def close(self):
+        """Flush what's left and close the file."""
+
+        self.flush()
+        self._file.close()
+        self._offsets_file.close()
+        self._messages_file.close()
+
+    def _emit(self, text: str, offset: Optional[str] = None):
+        """Buffer text for the file, and the heading index entry for it (if any)."""
+
+        if offset is not None:
+            self._offsets.append(offset + "\n")
+
+        self._pending.append(text)
+        self._position += len(text.encode("utf-8"))
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def checkpoint_path(storage_path: str) -> str:
+    """Format the path of the sidecar for a saved Markdown file."""
+
+    return os.path.splitext(storage_path)[0] + CHECKPOINT_SUFFIX
+
+
+def offsets_path(storage_path: str) -> str:
+    """Format the path of the date heading offsets for a saved Markdown file."""
+
+    return os.path.splitext(storage_path)[0] + OFFSETS_SUFFIX
+
+
+def messages_path(storage_path: str) -> str:
+    """Format the path of the message offsets for a saved Markdown file."""
+
+    return os.path.splitext(storage_path)[0] + MESSAGES_SUFFIX
+
+
+def has_offsets(storage_path: str) -> bool:
+    """Check whether a saved Markdown file has both of its offset sidecars. Files saved before
+    the message offsets were kept apart from the headings only have the first one."""
+
+    return os.path.exists(offsets_path(storage_path)) \
+        and os.path.exists(messages_path(storage_path))
+
+
+def is_sidecar(fname: str) -> bool:
+    """Check whether a file in a storage directory is a sidecar, not a saved conversation."""
+
+    return fname.endswith(SIDECAR_SUFFIXES)
+
+
+def read_headings(storage_path: str) -> List[Tuple[int, date]]:
+    """Read the (offset, date) of each date heading in a saved Markdown file, building its
+    offset sidecars if it doesn't have them."""
+
+    if not has_offsets(storage_path):
+        offsets = scan_offsets(storage_path)
+        write_offsets(storage_path, offsets)
+        return offsets.headings
+
+    headings = []
+    with open(offsets_path(storage_path), 'r', encoding="utf-8") as offsets_file:
+        for line in offsets_file:
+            fields = line.split()
+            if len(fields) == 3 and fields[0] == "D":
+                headings.append((int(fields[1]), date.fromisoformat(fields[2])))
+
+    return headings
+
+
+def scan_offsets(storage_path: str) -> Offsets:
+    """Find the date headings and messages in a saved Markdown file by reading all of it."""
+
+    offsets = Offsets([], [])
+    position = 0
+    with open(storage_path, 'rb') as filestore:
+        for line in filestore:
+            if line.startswith(b"## "):
+                try:
+                    heading = datetime.strptime(line[3:].decode("utf-8").strip(), "%x").date()
+                    offsets.headings.append((position, heading))
+                except ValueError:
+                    pass
+            elif line.startswith(b"* "):
+                offsets.messages.append(position)
+
+            position += len(line)
+
+    return offsets
+
+
+def write_offsets(storage_path: str, offsets: Offsets):
+    """Write the offset sidecars of a saved Markdown file."""
+
+    with open(offsets_path(storage_path), 'w', encoding="utf-8") as offsets_file:
+        offsets_file.write("".join(
+            f"D {offset} {heading.isoformat()}\n" for offset, heading in offsets.headings))
+    with open(messages_path(storage_path), 'wb') as messages_file:
+        messages_file.write(b"".join(MESSAGE_RECORD.pack(offset) for offset in offsets.messages))
+
+
+def excerpt(storage_path: str, start: Optional[date], end: Optional[date],
+            max_bytes: int) -> Tuple[bytes, bool]:
+    """Cut the messages from the start date through the end date (either may be open-ended) out
+    of a saved Markdown file. Only that range of the file is read, through a memory map. If it's
+    longer than max_bytes, it's trimmed at the last message that fits, or if not even the first
+    one does, that message is cut short; the second value says whether that happened."""
+
+    headings = read_headings(storage_path)
+    size = os.path.getsize(storage_path)
+    dates = [heading for _, heading in headings]
+    first = 0 if start is None else bisect_left(dates, start)
+    last = len(dates) if end is None else bisect_right(dates, end)
+    if first >= last or size < 1:
+        return b"", False
+
+    begin = headings[first][0]
+    finish = headings[last][0] if last < len(headings) else size
+    trimmed = finish - begin > max_bytes
+    if trimmed:
+        finish = trim_point(storage_path, begin, max_bytes)
+
+    with open(storage_path, 'rb') as filestore:
+        with mmap.mmap(filestore.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # don't cut a UTF-8 character in two
+            while begin < finish < size and mapped[finish] & 0xC0 == 0x80:
+                finish -= 1
+            return mapped[begin:finish], trimmed
+
+
+def trim_point(storage_path: str, begin: int, max_bytes: int) -> int:
+    """Find where to end an excerpt starting at a date heading so it fits in max_bytes: at the
+    start of the last message that does, or if not even the first one fits, at max_bytes."""
+
+    with MessageOffsets(storage_path) as messages:
+        cut = bisect_right(messages, begin + max_bytes) - 1
+        earliest = bisect_right(messages, begin)
+        return messages[cut] if cut > earliest else begin + max_bytes
@@ -1,19 +1,46 @@
-"""Bootstrap the bot by reading configuration and setting up the Bot + Google access."""
+"""Bootstrap the bot by reading configuration and setting up the Bot + Google access.
+
+The Google client libraries are slow to import and the credentials are only needed once the Sheets
+are first used, so both are loaded on first use rather than at startup.
+"""
+from __future__ import annotations
+
+import threading
+import time
 from os import environ
 from os.path import join
+from typing import TYPE_CHECKING, Dict, Optional
 
-import gspread
 from disnake.ext import commands
 from disnake.ext.commands import Context
-from google.oauth2 import service_account
-from googleapiclient import discovery
 from ruamel.yaml import YAML
 
+from sosbot.index import DEFAULT_REFRESH_INTERVAL
+from sosbot.replica import SheetReplica
+from sosbot.scheduler import (Scheduler, QuotaStore, DEFAULT_READ_QUOTA, DEFAULT_WRITE_QUOTA,
+                              DEFAULT_MAX_RETRIES)
+from sosbot.search import SearchIndex
+from sosbot.journal import WriteJournal, WriteBehind, DEFAULT_FLUSH_INTERVAL, KEY_COLUMN_TTL
+from sosbot.metrics import Metrics, COMMAND_SECONDS, instrument_http
+from sosbot.partitions import Partitions, DEFAULT_MAX_PARTITION_ROWS
+from sosbot.sheets import (SheetsAccess, DEFAULT_MAX_CONCURRENCY, DEFAULT_CALL_TIMEOUT,
+                           DEFAULT_READ_FRESHNESS)
+from sosbot.shards import Sharding
+from sosbot.startup import STARTUP
+
+if TYPE_CHECKING:
+    import gspread
+    from google.auth.transport.requests import AuthorizedSession
+    from google.oauth2.service_account import Credentials
+
 #######################################################################################
 # Important notes about authenticating gspread (used for Google Sheets access):
 #      https://docs.gspread.org/en/latest/oauth2.html#for-bots-using-service-account
 #######################################################################################
 DEFAULT_CONFIG = join(environ["HOME"], ".config/sosbot/config.yaml")
+DEFAULT_WRITE_JOURNAL = join(environ["HOME"], ".config/sosbot/write-journal.jsonl")
+DEFAULT_SHARED_REPLICA = join(environ["HOME"], ".config/sosbot/replica.db")
+DEFAULT_QUOTA_DB = join(environ["HOME"], ".config/sosbot/quota.db")
 GOOGLE_SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive',
@@ -26,29 +53,64 @@ CONFIG_GOOGLE_SECTION = "google"
 CONFIG_DISCORD_TOKEN = "token"
 CONFIG_DISCORD_TEST_GUILDS = "test-guilds"
 CONFIG_DISCORD_SAVEDIR = "save-dir"
+CONFIG_DISCORD_REPLY_GRAPH_SIZE = "reply-graph-size"
+CONFIG_DISCORD_REPLY_GRAPH_FILE = "reply-graph-file"
+CONFIG_DISCORD_ARCHIVE_INDEX = "archive-index"
+CONFIG_DISCORD_METRICS_HOST = "metrics-host"
+CONFIG_DISCORD_METRICS_PORT = "metrics-port"
+CONFIG_DISCORD_SHARD_COUNT = "shard-count"
 
 CONFIG_DEFINITION_GSHEET = "definitions-sheet"
 CONFIG_DATASET_GSHEET = "datasets-sheet"
 CONFIG_GOOGLE_SERVICE_CREDS = "creds-json"
+CONFIG_GOOGLE_MAX_CONCURRENCY = "max-concurrency"
+CONFIG_GOOGLE_CALL_TIMEOUT = "call-timeout"
+CONFIG_GOOGLE_REFRESH_INTERVAL = "refresh-interval"
+CONFIG_GOOGLE_WRITE_JOURNAL = "write-journal"
+CONFIG_GOOGLE_FLUSH_INTERVAL = "flush-interval"
+CONFIG_GOOGLE_REPLICA = "replica-db"
+CONFIG_GOOGLE_READ_QUOTA = "read-quota"
+CONFIG_GOOGLE_WRITE_QUOTA = "write-quota"
+CONFIG_GOOGLE_MAX_RETRIES = "max-retries"
+CONFIG_GOOGLE_QUOTA_DB = "quota-db"
+CONFIG_GOOGLE_MAX_PARTITION_ROWS = "max-partition-rows"
+CONFIG_GOOGLE_READ_FRESHNESS = "read-freshness"
 
 
 class DiscordBot:
     """Bot class used to house Discord bot state and convenience logic."""
 
-    def __init__(self, data: dict):
-        """Setup Discord bot and save app-specific configuration for later reference."""
+    def __init__(self, data: dict, metrics: Optional[Metrics] = None,
+                 sharding: Sharding = Sharding()):
+        """Setup Discord bot and save app-specific configuration for later reference. Command
+        latency and Discord REST calls are recorded in the metrics. When sharded, the bot runs
+        the given shards (or all of them) over as many gateway connections."""
 
         self._token = data.pop(CONFIG_DISCORD_TOKEN, None)
         self.config = data
-        self.bot = commands.Bot(
+        self.metrics = metrics or Metrics()
+        self.sharding = sharding
+        self._commands_started: Dict[int, float] = {}
+        bot_class, options = commands.Bot, {}
+        if sharding.enabled:
+            bot_class = commands.AutoShardedBot
+            options = {"shard_count": sharding.shard_count, "shard_ids": sharding.shard_ids}
+
+        self.bot = bot_class(
             command_prefix='!',
             # test_guilds=data.pop(CONFIG_DISCORD_TEST_GUILDS, None),
             # sync_commands_debug=True,
             # sync_commands=False,
-            description="SOS bot -> type `!help` to get started!"
+            description="SOS bot -> type `!help` to get started!",
+            **options
         )
 
         self.bot.add_listener(self.on_command_error, "on_command_error")
+        self.bot.add_listener(self._command_started, "on_command")
+        self.bot.add_listener(self._command_completed, "on_command_completion")
+        self.bot.add_listener(self._command_failed, "on_command_error")
+        self.bot.add_listener(self._ready, "on_ready")
+        instrument_http(self.bot.http, self.metrics)
 
     @staticmethod
     async def on_command_error(ctx: Context, error):
@@ -56,6 +118,36 @@ class DiscordBot:
 
         await ctx.send(f"Sorry, I don't understand ({error})")
 
+    async def _command_started(self, ctx: Context):
+        """Note when a command started running."""
+
+        self._commands_started[ctx.message.id] = time.monotonic()
+
+    async def _command_completed(self, ctx: Context):
+        """Record how long a command took."""
+
+        self._record_command(ctx, "ok")
+
+    async def _command_failed(self, ctx: Context, _error):
+        """Record how long a command took to fail."""
+
+        self._record_command(ctx, "error")
+
+    @staticmethod
+    async def _ready():
+        """Report how long startup took, the first time we're connected to the gateway."""
+
+        if not STARTUP.reported:
+            STARTUP.mark("gateway")
+            print(STARTUP.report())
+
+    def _record_command(self, ctx: Context, status: str):
+        """Record a command's latency, if we saw it start (failures to parse never do)."""
+
+        started = self._commands_started.pop(ctx.message.id, None)
+        if started is not None and ctx.command is not None:
+            self.metrics.observe(COMMAND_SECONDS, time.monotonic() - started,
+                                 command=ctx.command.qualified_name, status=status)
 
     def add_cog(self, cog: commands.Cog):
         """Register a new cog (suite of commands) to the bot"""
@@ -68,31 +160,193 @@ class DiscordBot:
         self.bot.run(self._token)
 
 
+# pylint: disable=too-many-instance-attributes
 class GoogleAccess:
     """
     Convenience class used to house configuration, state and logic related to accessing
     Google storage and such.
     """
 
-    def __init__(self, data: dict):
-        """Setup the credentials for use with Google services and save additional config for later
-        reference in the application."""
+    def __init__(self, data: dict, metrics: Optional[Metrics] = None,
+                 sharding: Sharding = Sharding()):
+        """Save the configuration for use with Google services for later reference in the
+        application; the credentials are loaded when first needed. Google calls are recorded in
+        the metrics. When this process runs only some of the shards, the Sheets quota and replica
+        are shared with the other processes, and the write journal is kept per process."""
 
-        creds_file = data.pop(CONFIG_GOOGLE_SERVICE_CREDS, None)
+        self._creds_file = data.pop(CONFIG_GOOGLE_SERVICE_CREDS, None)
         self.config = data
-
-        self._google_creds = service_account.Credentials.from_service_account_file(
-            creds_file, scopes=GOOGLE_SCOPES)
+        self.metrics = metrics or Metrics()
+        self.sharding = sharding
+
+        self._creds_lock = threading.Lock()
+        self._google_creds = None
+        self._session = None
+        self._gspread = None
+        self._scheduler = None
+        self._sheets = None
+        self._write_behind = None
+        self._replica = None
+        self._partitions: Dict[str, Partitions] = {}
+
+    def get_credentials(self) -> Credentials:
+        """Retrieve the service account credentials shared by all Google calls, loading them on
+        first use."""
+
+        # pylint: disable=import-outside-toplevel
+        from google.oauth2 import service_account
+
+        with self._creds_lock:
+            if self._google_creds is None:
+                started = time.monotonic()
+                self._google_creds = service_account.Credentials.from_service_account_file(
+                    self._creds_file, scopes=GOOGLE_SCOPES)
+                print(f"Loaded Google credentials in {time.monotonic() - started:.2f}s")
+
+            return self._google_creds
 
     def get_service(self, service_name: str, service_version: str):
         """Setup a Google APIs service using the credentials we have stored."""
 
-        return discovery.build(service_name, service_version, credentials=self._google_creds)
+        # pylint: disable=import-outside-toplevel
+        from googleapiclient import discovery
+
+        return discovery.build(service_name, service_version, credentials=self.get_credentials())
+
+    def get_session(self) -> AuthorizedSession:
+        """Retrieve the authorized HTTP session shared by all Google calls. It keeps connections
+        alive, with a pool large enough for every Sheets worker thread."""
+
+        # pylint: disable=import-outside-toplevel
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        if self._session is None:
+            pool_size = self._max_concurrency()
+            self._session = AuthorizedSession(self.get_credentials())
+            self._session.mount(
+                "https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+        return self._session
 
     def get_gspread(self) -> gspread.Client:
-        """Setup a gspread connection using the credentials we have stored."""
+        """Retrieve the gspread client shared by all cogs, setting it up on first use."""
+
+        # pylint: disable=import-outside-toplevel,redefined-outer-name
+        import gspread
+
+        if self._gspread is None:
+            self._gspread = gspread.Client(self.get_credentials(), session=self.get_session())
+
+        return self._gspread
+
+    def get_scheduler(self) -> Scheduler:
+        """Retrieve the scheduler that paces all Google calls against the configured per-minute
+        read and write quotas."""
+
+        if self._scheduler is None:
+            self._scheduler = Scheduler(
+                read_quota=float(self.config.get(CONFIG_GOOGLE_READ_QUOTA) or DEFAULT_READ_QUOTA),
+                write_quota=float(
+                    self.config.get(CONFIG_GOOGLE_WRITE_QUOTA) or DEFAULT_WRITE_QUOTA),
+                max_retries=int(self.config.get(CONFIG_GOOGLE_MAX_RETRIES) or DEFAULT_MAX_RETRIES),
+                store=self._quota_store()
+            )
+
+        return self._scheduler
+
+    def get_sheets(self) -> SheetsAccess:
+        """Retrieve the async Sheets access layer shared by all cogs, setting it up on first use.
+        The gspread client (and the credentials) are only set up when the first call is made.
+        Concurrent identical reads share one call, and its result for the read-freshness window.
+        """
+
+        if self._sheets is None:
+            self._sheets = SheetsAccess(
+                self.get_gspread,
+                max_concurrency=self._max_concurrency(),
+                timeout=float(self.config.get(CONFIG_GOOGLE_CALL_TIMEOUT) or DEFAULT_CALL_TIMEOUT),
+                scheduler=self.get_scheduler(),
+                metrics=self.metrics,
+                freshness=self._read_freshness()
+            )
+            self.metrics.gauge("sosbot_google_queue_depth", lambda: {
+                (("kind", kind),): depth for kind, depth in self._sheets.queue_depth().items()
+            })
 
-        return gspread.authorize(self._google_creds)
+        return self._sheets
+
+    def get_write_behind(self) -> WriteBehind:
+        """Retrieve the write-behind queue shared by all cogs, replaying any unflushed writes from
+        its journal on first use."""
+
+        if self._write_behind is None:
+            self._write_behind = WriteBehind(
+                WriteJournal(self.sharding.path(
+                    self.config.get(CONFIG_GOOGLE_WRITE_JOURNAL) or DEFAULT_WRITE_JOURNAL)),
+                self.get_sheets(),
+                interval=float(
+                    self.config.get(CONFIG_GOOGLE_FLUSH_INTERVAL) or DEFAULT_FLUSH_INTERVAL),
+                # processes running other shards insert rows too, so cached keys go stale
+                key_column_ttl=0 if self.sharding.partial else KEY_COLUMN_TTL
+            )
+
+        return self._write_behind
+
+    def get_replica(self) -> Optional[SheetReplica]:
+        """Retrieve the local SQLite replica of the spreadsheets, or None if it isn't configured.
+        Processes running only some of the shards always share one, and only one of them syncs
+        it in each refresh interval."""
+
+        replica_path = self.config.get(CONFIG_GOOGLE_REPLICA)
+        if self.sharding.partial:
+            replica_path = replica_path or DEFAULT_SHARED_REPLICA
+
+        if self._replica is None and replica_path:
+            max_age = 0.0
+            if self.sharding.partial:
+                max_age = float(self.config.get(CONFIG_GOOGLE_REFRESH_INTERVAL)
+                                or DEFAULT_REFRESH_INTERVAL) / 2
+
+            self._replica = SheetReplica(replica_path, max_age=max_age)
+
+        return self._replica
+
+    def get_partitions(self, spreadsheet_id: str) -> Partitions:
+        """Retrieve the partition map of a spreadsheet, which routes each row to its worksheet.
+        Partitions that grow too large are only split by a process running every shard: with
+        several processes, the others would keep routing rows by the old map."""
+
+        if spreadsheet_id not in self._partitions:
+            max_rows = self.config.get(CONFIG_GOOGLE_MAX_PARTITION_ROWS)
+            max_rows = int(DEFAULT_MAX_PARTITION_ROWS if max_rows is None else max_rows)
+            self._partitions[spreadsheet_id] = Partitions(
+                self.get_sheets(), spreadsheet_id,
+                max_rows=0 if self.sharding.partial else max_rows
+            )
+
+        return self._partitions[spreadsheet_id]
+
+    def _quota_store(self) -> Optional[QuotaStore]:
+        """Open the store through which processes share the Sheets quota, if one is configured,
+        or this process runs only some of the shards."""
+
+        quota_path = self.config.get(CONFIG_GOOGLE_QUOTA_DB)
+        if self.sharding.partial:
+            quota_path = quota_path or DEFAULT_QUOTA_DB
+
+        return QuotaStore(quota_path) if quota_path else None
+
+    def _read_freshness(self) -> float:
+        """Read how long (in seconds) a Sheets read is reused for, which may be zero."""
+
+        freshness = self.config.get(CONFIG_GOOGLE_READ_FRESHNESS)
+        return float(DEFAULT_READ_FRESHNESS if freshness is None else freshness)
+
+    def _max_concurrency(self) -> int:
+        """Read the configured limit on concurrent Google calls."""
+
+        return int(self.config.get(CONFIG_GOOGLE_MAX_CONCURRENCY) or DEFAULT_MAX_CONCURRENCY)
 
 
 # pylint: disable=too-few-public-methods
@@ -102,16 +356,38 @@ class SOSBot:
     available to the application.
     """
 
-    def __init__(self, data: dict):
-        """Setup the Discord and Google connections using the related config sections."""
+    def __init__(self, data: dict, sharding: Sharding = Sharding()):
+        """Setup the Discord and Google connections using the related config sections, along with
+        the search index shared by the glossary and dataset cogs, and the metrics all of them
+        record to. Without a shard count, the one configured (if any) is used."""
 
-        self.discord = DiscordBot(data[CONFIG_DISCORD_SECTION])
-        self.google = GoogleAccess(data[CONFIG_GOOGLE_SECTION])
+        shard_count = data[CONFIG_DISCORD_SECTION].pop(CONFIG_DISCORD_SHARD_COUNT, None)
+        if sharding.shard_count is None and shard_count:
+            sharding = sharding._replace(shard_count=int(shard_count))
 
+        self.sharding = sharding
+        self.metrics = Metrics()
+        self.discord = DiscordBot(data[CONFIG_DISCORD_SECTION], self.metrics, sharding)
+        self.google = GoogleAccess(data[CONFIG_GOOGLE_SECTION], self.metrics, sharding)
+        self.search = SearchIndex()
 
-def load_bot(config_yml: str = DEFAULT_CONFIG) -> SOSBot:
-    """Read configuration from disk and use it to start a new bot instance"""
+
+def read_config(config_yml: str = DEFAULT_CONFIG) -> dict:
+    """Read configuration from disk"""
 
     with open(config_yml, 'r', encoding='utf-8') as yaml_file:
-        data = YAML().load(yaml_file)
-        return SOSBot(data)
+        return YAML().load(yaml_file)
+
+
+def load_google(config_yml: str = DEFAULT_CONFIG) -> GoogleAccess:
+    """Read configuration from disk and use it to setup Google access alone (for the command
+    line tools, which don't connect to Discord)"""
+
+    return GoogleAccess(read_config(config_yml)[CONFIG_GOOGLE_SECTION])
+
+
+def load_bot(config_yml: str = DEFAULT_CONFIG, sharding: Sharding = Sharding()) -> SOSBot:
+    """Read configuration from disk and use it to start a new bot instance, running the given
+    shards"""
+
+    return SOSBot(read_config(config_yml), sharding)
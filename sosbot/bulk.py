@@ -0,0 +1,214 @@
+"""Bulk import and export of the glossary and datasets spreadsheets.
+
+An import reads every partition once, drops the rows that are already there (or repeated in the
+input), and inserts the rest straight into their places, keeping each partition sorted by its
+(case-folded) first column the way the write-behind expects. The insertions go out in batchUpdate
+calls of at most CHUNK_ROWS rows, each small enough to finish well within the call timeout, and
+each leaving every partition complete and sorted: if one fails, the import can simply be run
+again. An export reads every partition with one batch call. Rows are streamed from and to CSV or
+JSON lines.
+"""
+import csv
+import json
+from bisect import bisect_right
+from datetime import datetime as dt
+from typing import IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from sosbot.index import fold
+from sosbot.journal import cell
+from sosbot.partitions import Partitions
+from sosbot.sheets import values_to_records
+
+CHUNK_ROWS = 1000
+
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+FORMATS = (FORMAT_CSV, FORMAT_JSONL)
+
+Row = Dict[str, Any]
+
+
+class Collection(NamedTuple):
+    """One of the bot's spreadsheets: where it's configured, its columns, and the columns that
+    identify a row."""
+
+    config_key: str
+    columns: Tuple[str, ...]
+    keys: Tuple[str, ...]
+
+    def key(self, row: Row) -> tuple:
+        """Identify a row, ignoring case."""
+
+        return tuple(fold(row.get(column, "")) for column in self.keys)
+
+
+class ImportResult(NamedTuple):
+    """What an import did (or would have done)."""
+
+    added: Dict[str, int]
+    duplicates: int
+    rejected: int
+    calls: int
+
+
+def format_of(path: str) -> str:
+    """Guess the format of a file from its extension, defaulting to CSV."""
+
+    return FORMAT_JSONL if path.lower().endswith((".jsonl", ".ndjson")) else FORMAT_CSV
+
+
+def read_rows(stream: IO[str], fmt: str) -> Iterator[Row]:
+    """Read rows from CSV (with a header row) or JSON lines, one at a time."""
+
+    if fmt == FORMAT_JSONL:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(stream)
+
+
+def write_rows(stream: IO[str], fmt: str, columns: Iterable[str], rows: Iterable[Row]) -> int:
+    """Write rows as CSV (with a header row) or JSON lines, one at a time. Returns the number
+    of rows written."""
+
+    columns = list(columns)
+    count = 0
+    writer = None
+    if fmt == FORMAT_CSV:
+        writer = csv.DictWriter(stream, columns, extrasaction="ignore")
+        writer.writeheader()
+
+    for row in rows:
+        if writer is None:
+            stream.write(json.dumps({column: row.get(column, "") for column in columns}) + "\n")
+        else:
+            writer.writerow(row)
+        count += 1
+
+    return count
+
+
+async def export_rows(partitions: Partitions, collection: Collection) -> Iterator[Row]:
+    """Read every row of a collection, partition by partition, with a single batch call."""
+
+    await partitions.ensure(store=False)
+    titles = partitions.map.titles
+    fetched = await partitions.sheets.batch_get_records(partitions.spreadsheet_id, titles)
+    return (
+        row for partition in titles for row in fetched.get(partition, [])
+        if str(row.get(collection.columns[0], "")).strip()
+    )
+
+
+# pylint: disable=too-many-locals
+async def import_rows(partitions: Partitions, collection: Collection, rows: Iterable[Row],
+                      author: str, dry_run: bool = False) -> ImportResult:
+    """Add rows to a collection, routed by its partition map, skipping those it already has (or
+    that are repeated), and those with an empty first column. Column names are matched ignoring
+    case; a missing Author or Date is filled in with the given author and today's date."""
+
+    sheets, spreadsheet_id = partitions.sheets, partitions.spreadsheet_id
+    await partitions.ensure(store=not dry_run)
+    worksheets = await sheets.worksheets(spreadsheet_id)
+    existing = await sheets.batch_get_values(spreadsheet_id, partitions.map.titles)
+    seen = {
+        collection.key(row) for values in existing.values() for row in values_to_records(values)
+    }
+    defaults = {"Author": author, "Date": dt.now().strftime("%x")}
+
+    new: Dict[str, List[List[str]]] = {partition: [] for partition in partitions.map.titles}
+    duplicates = rejected = 0
+    for row in rows:
+        folded = {fold(column): value for column, value in row.items()}
+        values = {
+            column: str(folded.get(fold(column)) or defaults.get(column, "")).strip()
+            for column in collection.columns
+        }
+        if not values[collection.columns[0]]:
+            rejected += 1
+            continue
+
+        partition = partitions.route(values[collection.columns[0]])
+        key = collection.key(values)
+        if key in seen:
+            duplicates += 1
+            continue
+
+        seen.add(key)
+        new[partition].append([values[column] for column in collection.columns])
+
+    calls = batch_requests(worksheets, existing, new)
+    if not dry_run:
+        for requests in calls:
+            await sheets.update_spreadsheet(spreadsheet_id, requests)
+
+    return ImportResult(
+        {partition: len(values) for partition, values in new.items()}, duplicates, rejected,
+        len(calls))
+
+
+def batch_requests(worksheets: Dict[str, Any], existing: Dict[str, List[List[Any]]],
+                   new: Dict[str, List[List[str]]]) -> List[List[dict]]:
+    """Group the insertions of the new rows into their partitions (whose current values, header
+    first, are given) into batchUpdate calls of at most CHUNK_ROWS rows each. Each insertion
+    adds a run of rows between two existing ones, and the calls must be applied in order."""
+
+    calls: List[List[dict]] = []
+    batch: List[dict] = []
+    size = 0
+    for partition, values in new.items():
+        sheet_id = worksheets[partition].id
+        for position, run in insertions(existing.get(partition, [])[1:], values):
+            for start in range(0, len(run), CHUNK_ROWS):
+                chunk = run[start:start + CHUNK_ROWS]
+                if size + len(chunk) > CHUNK_ROWS and len(batch) > 0:
+                    calls.append(batch)
+                    batch, size = [], 0
+
+                batch.extend(insert_rows(sheet_id, 1 + position + start, chunk))
+                size += len(chunk)
+
+    if len(batch) > 0:
+        calls.append(batch)
+
+    return calls
+
+
+def insertions(rows: List[List[Any]], new: List[List[str]]) -> List[Tuple[int, List[List[str]]]]:
+    """Place new rows among a partition's existing ones, in order of their case-folded first
+    column (after any existing rows with the same one), the same way the write-behind does.
+    Returns runs of new rows that go together, with the (0-based, header excluded) index the
+    first of them will have once the runs before it are inserted."""
+
+    def key(row: List[Any]) -> str:
+        return fold(row[0]) if len(row) > 0 else ""
+
+    firsts = [key(row) for row in rows]
+    runs: List[Tuple[int, List[List[str]]]] = []
+    for idx, row in enumerate(sorted(new, key=key)):
+        # every new row before this one sorts at or before it, so it has been inserted already
+        position = bisect_right(firsts, key(row)) + idx
+        if len(runs) > 0 and runs[-1][0] + len(runs[-1][1]) == position:
+            runs[-1][1].append(row)
+        else:
+            runs.append((position, [row]))
+
+    return runs
+
+
+def insert_rows(sheet_id: int, row_index: int, rows: List[List[str]]) -> List[dict]:
+    """Build the batchUpdate requests inserting rows into a worksheet at the given (0-based)
+    row index."""
+
+    return [
+        {"insertDimension": {"range": {
+            "sheetId": sheet_id, "dimension": "ROWS",
+            "startIndex": row_index, "endIndex": row_index + len(rows),
+        }}},
+        {"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": row_index, "columnIndex": 0},
+            "rows": [{"values": [cell(value) for value in row]} for row in rows],
+            "fields": "userEnteredValue",
+        }},
+    ]
@@ -1,24 +1,32 @@
 """Commands to handle saving, retrieving, and maintaining items associated with different datasets
 into a Google Sheet"""
+import asyncio
 import logging
 import re
 from datetime import datetime as dt
-from math import floor
+from typing import List, Tuple, Union
 
 # pylint: disable=no-name-in-module
-from disnake.ext import commands
+from disnake import ApplicationCommandInteraction
+from disnake.ext import commands, tasks
 from disnake.message import Message
 
-from sosbot.bot import (SOSBot, CONFIG_DATASET_GSHEET)
+from sosbot.bot import (SOSBot, CONFIG_DATASET_GSHEET, CONFIG_GOOGLE_REFRESH_INTERVAL)
+from sosbot.index import (DatasetIndex, fold, DEFAULT_REFRESH_INTERVAL, MAX_COMPLETIONS,
+                          MAX_COMPLETION_LENGTH)
+from sosbot.interactions import respond
+from sosbot.pages import Pager
+from sosbot.journal import OP_APPEND
+from sosbot.replica import fetch_partitions
+from sosbot.scheduler import priority, PRIORITY_BACKGROUND
 
 logging.basicConfig(level=logging.INFO)
 
-ALPHAS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-SHEETS = [
-    "A-E", "F-J", "K-O", "P-T", "U-Z"
-]
+COLUMNS = ("Dataset", "URL", "Description", "Author", "Date")
+KEYS = ("Dataset", "URL")
 
 
+# pylint: disable=too-many-instance-attributes
 class DatasetCog(commands.Cog, name="\n\nDoc Collections / Datasets"):
     """Cog that collects commands related to managing and retrieving dataset information"""
 
@@ -26,7 +34,145 @@ class DatasetCog(commands.Cog, name="\n\nDoc Collections / Datasets"):
         """Initialize the cog, including the gspread service used to access the Sheet"""
         self.bot = bot.discord.bot
         self.datasets = bot.google.config.get(CONFIG_DATASET_GSHEET)
-        self.sheets_service = bot.google.get_gspread()
+        self.sheets = bot.google.get_sheets()
+        self.write_behind = bot.google.get_write_behind()
+        self.write_behind.set_key_columns(self.datasets, len(KEYS))
+        self.replica = bot.google.get_replica()
+        self.partitions = bot.google.get_partitions(self.datasets)
+        self.index = DatasetIndex(bot.search)
+        self._index_lock = asyncio.Lock()
+        self.refresh_index.change_interval(
+            seconds=float(bot.google.config.get(CONFIG_GOOGLE_REFRESH_INTERVAL)
+                          or DEFAULT_REFRESH_INTERVAL)
+        )
+
+    async def cog_load(self):
+        """Start the background refresh of the dataset index, which also warms it, along with
+        the flusher for queued Sheet writes."""
+
+        self.refresh_index.start()
+        self.write_behind.start()
+
+    def cog_unload(self):
+        """Stop the background refresh of the dataset index."""
+
+        self.refresh_index.cancel()
+
+    @tasks.loop(seconds=DEFAULT_REFRESH_INTERVAL)
+    async def refresh_index(self):
+        """Periodically reload the dataset index from the Sheet, to pick up edits made there, and
+        split any partitions that have grown too large."""
+
+        try:
+            with priority(PRIORITY_BACKGROUND):
+                oversized = await self._load_index()
+                if len(oversized) > 0:
+                    await self._rebalance(oversized)
+        # pylint: disable=broad-except
+        except Exception as error:
+            print(f"Dataset index refresh failed: {error}")
+
+    @refresh_index.before_loop
+    async def _before_refresh(self):
+        """Wait until we're connected before the first load of the dataset index, so reading
+        the Sheet (and loading the Google credentials) doesn't hold up connecting."""
+
+        await self.bot.wait_until_ready()
+
+    async def _load_index(self, force: bool = True) -> List[str]:
+        """Read every partition of the datasets Sheet (in one batch call, or via the local
+        replica), and rebuild the in-memory index from it. Unless forced, this is skipped when
+        the index has already been loaded. Returns the partitions that have grown too large."""
+
+        async with self._index_lock:
+            if not force and self.index.loaded:
+                return []
+
+            # writes still in the journal aren't in the Sheet yet, so lay them over what we read
+            pending = {entry["seq"]: entry for entry in self.write_behind.pending(self.datasets)}
+            await self.partitions.ensure()
+            partitions = self.partitions.load(await fetch_partitions(
+                self.sheets, self.replica, self.datasets, self.partitions.worksheets()))
+            self.index.load(partitions)
+            pending.update(
+                {entry["seq"]: entry for entry in self.write_behind.pending(self.datasets)})
+
+            for _, entry in sorted(pending.items()):
+                if entry["op"] == OP_APPEND:
+                    self.index.add(entry["worksheet"], dict(zip(COLUMNS, entry["values"])))
+                else:
+                    self.index.remove(entry["match"]["Dataset"], entry["match"]["URL"])
+
+            print(f"Dataset index loaded with {len(self.index)} datasets.")
+            return self.partitions.oversized(partitions)
+
+    async def _rebalance(self, titles: List[str]):
+        """Split the partitions that have grown too large, once every queued write has reached
+        the Sheet, and move any writes queued meanwhile to the partitions now holding their
+        datasets."""
+
+        async def split() -> Tuple[List[str], int]:
+            added = await self.partitions.rebalance(titles)
+            moved = 0
+            if len(added) > 0:
+                moved = self.write_behind.reroute(self.datasets, self.partitions.route)
+            return added, moved
+
+        added, moved = await self.write_behind.drained(self.datasets, split)
+        if len(added) > 0:
+            print(f"Split dataset partitions {', '.join(titles)} into {', '.join(added)} "
+                  f"(moving {moved} queued writes).")
+
+    async def _ensure_index(self):
+        """Make sure the dataset index has been loaded at least once."""
+
+        if not self.index.loaded:
+            await self._load_index(force=False)
+
+    async def _set_dataset(self, dataset: str, url: str, description: str, author: str) -> str:
+        """Associate a URL with a dataset, unless it already is, and describe the outcome."""
+
+        await self._ensure_index()
+        key = self.partitions.route(dataset)
+        values = [dataset, url, description, author, dt.now().strftime("%x")]
+        # queued rows count too, whether or not the index has caught up with them; rows already
+        # in the Sheet but not yet in the index are left for the flush to drop
+        if self.index.find(dataset, url) is not None \
+                or self.write_behind.queued(self.datasets, key, values):
+            return f"'{dataset}' already includes '{url}'"
+
+        self.write_behind.append(self.datasets, key, values)
+        self.index.add(key, dict(zip(COLUMNS, values)))
+
+        return f"'{dataset}' now includes '{url}'"
+
+    async def _clear_dataset(self, dataset: str, url: str) -> str:
+        """Clear a URL from a dataset, and describe the outcome."""
+
+        await self._ensure_index()
+        key = self.partitions.route(dataset)
+        if self.index.find(dataset, url) is not None:
+            self.write_behind.delete(self.datasets, key, {"Dataset": dataset, "URL": url})
+            self.index.remove(dataset, url)
+            return f"{url} has been removed from {dataset}."
+
+        return f"{url} was not found in {dataset}!"
+
+    async def _dataset(self, dataset: str, owner_id: int) -> Union[str, Pager]:
+        """Page through the links in a dataset, reading each page from the index as it's shown.
+        """
+
+        await self._ensure_index()
+        if self.index.size(dataset) < 1:
+            return f"'{dataset}' has no associated content!"
+
+        return Pager(
+            f"Dataset {dataset}",
+            lambda: self.index.size(dataset),
+            lambda start, count: self.index.page(dataset, start, count),
+            lambda row: f"{row['Description']} *({row['Author']}, {row['Date']})*\n{row['URL']}",
+            separator="\n\n", owner_id=owner_id
+        )
 
     @commands.command("set-dataset")
     async def set_dataset(self, ctx: commands.Context):
@@ -46,23 +192,9 @@ class DatasetCog(commands.Cog, name="\n\nDoc Collections / Datasets"):
                     await message.reply(f"Didn't understand: '{message.content}'")
                     return
 
-                dataset = match[1].strip()
-                url = match[2].strip()
-                description = match[3].strip()
-                async with ctx.typing():
-                    idx = ALPHAS.index(dataset[0].upper())
-                    key = SHEETS[floor(idx / 5)]
-                    spreadsheet = self.sheets_service.open_by_key(self.datasets)
-                    sheet = spreadsheet.worksheet(key)
-                    rows = sheet.get_all_records()
-
-                    sheet.append_row([
-                        dataset, url, description, message.author.display_name,
-                        dt.now().strftime("%x")
-                    ])
-                    sheet.sort((1, 'asc'), range=f"A2:E{len(rows) + 2}")
-
-                await message.reply(f"'{dataset}' now includes '{url}'")
+                await message.reply(await self._set_dataset(
+                    match[1].strip(), match[2].strip(), match[3].strip(),
+                    message.author.display_name))
             # pylint: disable=broad-except
             except Exception as error:
                 print(error)
@@ -90,28 +222,8 @@ class DatasetCog(commands.Cog, name="\n\nDoc Collections / Datasets"):
                     await message.reply(f"Didn't understand: '{message.content}'")
                     return
 
-                dataset = match[1].strip()
-                url = match[2].strip()
-                found_index = -1
-                async with ctx.typing():
-                    idx = ALPHAS.index(dataset[0].upper())
-                    key = SHEETS[floor(idx / 5)]
-                    spreadsheet = self.sheets_service.open_by_key(self.datasets)
-                    sheet = spreadsheet.worksheet(key)
-                    rows = sheet.get_all_records()
-
-                    for idx, row in enumerate(rows):
-                        if len(row) > 1 \
-                                and row["Dataset"].lower() == dataset.lower() \
-                                and row["URL"].lower() == url.lower():
-                            found_index = idx
-                            break
-
-                if found_index > -1:
-                    sheet.delete_row(found_index + 2)
-                    await message.reply(f"{url} has been removed from {dataset}.")
-                else:
-                    await message.reply(f"{url} was not found in {dataset}!")
+                await message.reply(
+                    await self._clear_dataset(match[1].strip(), match[2].strip()))
             # pylint: disable=broad-except
             except Exception as error:
                 print(error)
@@ -139,29 +251,13 @@ class DatasetCog(commands.Cog, name="\n\nDoc Collections / Datasets"):
                     await message.reply(f"Didn't understand: '{message.content}'")
                     return
 
-                dataset = match[1].strip()
-                ds_rows = []
                 async with ctx.typing():
-                    idx = ALPHAS.index(dataset[0].upper())
-                    key = SHEETS[floor(idx / 5)]
-                    spreadsheet = self.sheets_service.open_by_key(self.datasets)
-                    sheet = spreadsheet.worksheet(key)
-                    rows = sheet.get_all_records()
-
-                    for row in rows:
-                        if len(row) > 0 and row["Dataset"].lower() == dataset.lower():
-                            ds_rows.append(
-                                f"{row['Description']} *({row['Author']}, {row['Date']})*\n"
-                                f"{row['URL']}"
-                            )
-
-                if len(ds_rows) > 0:
-                    response = f"Dataset **{dataset}** contains {len(ds_rows)} entries:\n\n" + \
-                               "\n\n".join(ds_rows)
+                    response = await self._dataset(match[1].strip(), message.author.id)
 
-                    await message.reply(response)
+                if isinstance(response, Pager):
+                    await response.reply(message)
                 else:
-                    await message.reply(f"'{dataset}' has no associated content!")
+                    await message.reply(response)
             # pylint: disable=broad-except
             except Exception as error:
                 print(error)
@@ -182,28 +278,16 @@ class DatasetCog(commands.Cog, name="\n\nDoc Collections / Datasets"):
         message: Message = ctx.message
         if message.author.id != self.bot.user.id:
             try:
-                dss = {}
                 async with ctx.typing():
-                    for key in SHEETS:
-                        spreadsheet = self.sheets_service.open_by_key(self.datasets)
-                        sheet = spreadsheet.worksheet(key)
-                        rows = sheet.get_all_records()
-
-                        for row in rows:
-                            if len(row) > 0:
-                                dataset = row['Dataset']
-                                count = dss.get(dataset) or 0
-                                dss[dataset] = count + 1
-
-                response = []
-                for dataset, count in dss.items():
-                    response.append(f"* **{dataset}** ({count} items)")
-
-                await message.reply(
-                    f"{len(dss)} datasets found:\n\n" +
-                    "\n".join(dss) +
-                    "\n\nUse !dataset <name> for more information"
-                )
+                    await self._ensure_index()
+
+                await Pager(
+                    f"{len(self.index)} datasets found",
+                    lambda: len(self.index),
+                    self.index.datasets,
+                    lambda dataset: f"* **{dataset[0]}** ({dataset[1]} items)",
+                    footer="Use !dataset <name> for more information", owner_id=message.author.id
+                ).reply(message)
             # pylint: disable=broad-except
             except Exception as error:
                 print(error)
@@ -212,3 +296,66 @@ class DatasetCog(commands.Cog, name="\n\nDoc Collections / Datasets"):
                 # pylint: disable=broad-except
                 except Exception as safe_error:
                     print(safe_error)
+
+    @commands.slash_command(name="set-dataset")
+    async def slash_set_dataset(self, inter: ApplicationCommandInteraction, dataset: str,
+                                url: str, description: str = ""):
+        """
+        Associate a URL with a dataset
+
+        Parameters
+        ----------
+        dataset: The dataset's name (it can't contain spaces)
+        url: The link to add
+        description: What the link is about
+        """
+
+        await respond(
+            inter, self._set_dataset(dataset, url, description, inter.author.display_name),
+            slow=not self.index.loaded)
+
+    @commands.slash_command(name="clear-dataset")
+    async def slash_clear_dataset(self, inter: ApplicationCommandInteraction, dataset: str,
+                                  url: str):
+        """
+        Clear a URL from a dataset
+
+        Parameters
+        ----------
+        dataset: The dataset's name
+        url: The link to remove
+        """
+
+        await respond(inter, self._clear_dataset(dataset, url), slow=not self.index.loaded)
+
+    @commands.slash_command(name="dataset")
+    async def slash_dataset(self, inter: ApplicationCommandInteraction, dataset: str):
+        """
+        Retrieve the links in a dataset
+
+        Parameters
+        ----------
+        dataset: The dataset's name
+        """
+
+        await respond(inter, self._dataset(dataset, inter.author.id), slow=not self.index.loaded)
+
+    @slash_set_dataset.autocomplete("dataset")
+    @slash_clear_dataset.autocomplete("dataset")
+    @slash_dataset.autocomplete("dataset")
+    async def complete_dataset(self, _inter: ApplicationCommandInteraction, prefix: str):
+        """Suggest dataset names starting with what's been typed so far, from the in-memory
+        index (which is empty until the first load)."""
+
+        return self.index.complete(prefix)
+
+    @slash_clear_dataset.autocomplete("url")
+    async def complete_url(self, _inter: ApplicationCommandInteraction, prefix: str,
+                           dataset: str = ""):
+        """Suggest the URLs in the chosen dataset starting with what's been typed so far."""
+
+        return [
+            row["URL"] for row in self.index.entries(dataset)
+            if fold(row["URL"]).startswith(fold(prefix))
+            and len(row["URL"]) <= MAX_COMPLETION_LENGTH
+        ][:MAX_COMPLETIONS]
@@ -1,23 +1,28 @@
 """Commands to handle saving, retrieving, and maintaining term definitions into a Google Sheet"""
+import asyncio
 import logging
 from datetime import datetime as dt
 # pylint: disable=no-name-in-module
-from typing import Literal
-from math import floor
+from typing import List, Literal, Tuple
 
-from disnake import Message
-from disnake.ext import commands
+from disnake import ApplicationCommandInteraction, Message
+from disnake.ext import commands, tasks
 
-from sosbot.bot import (SOSBot, CONFIG_DEFINITION_GSHEET)
+from sosbot.bot import (SOSBot, CONFIG_DEFINITION_GSHEET, CONFIG_GOOGLE_REFRESH_INTERVAL)
+from sosbot.index import GlossaryIndex, DEFAULT_REFRESH_INTERVAL
+from sosbot.interactions import respond
+from sosbot.journal import OP_APPEND
+from sosbot.replica import fetch_partitions
+from sosbot.scheduler import priority, PRIORITY_BACKGROUND
+from sosbot.search import KIND_TERM
 
 logging.basicConfig(level=logging.INFO)
 
-ALPHAS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-SHEETS = [
-    "A-E", "F-J", "K-O", "P-T", "U-Z"
-]
+COLUMNS = ("Term", "Definition", "Author", "Date")
+KEYS = ("Term",)
 
 
+# pylint: disable=too-many-instance-attributes
 class DefinitionCog(commands.Cog, name="\n\nGlossary"):
     """Cog containing logic for managing and retrieving term definitions"""
 
@@ -26,7 +31,145 @@ class DefinitionCog(commands.Cog, name="\n\nGlossary"):
 
         self.bot = bot.discord.bot
         self.definitions = bot.google.config.get(CONFIG_DEFINITION_GSHEET)
-        self.sheets_service = bot.google.get_gspread()
+        self.sheets = bot.google.get_sheets()
+        self.write_behind = bot.google.get_write_behind()
+        self.write_behind.set_key_columns(self.definitions, len(KEYS))
+        self.replica = bot.google.get_replica()
+        self.partitions = bot.google.get_partitions(self.definitions)
+        self.index = GlossaryIndex(bot.search)
+        self._index_lock = asyncio.Lock()
+        self.refresh_index.change_interval(
+            seconds=float(bot.google.config.get(CONFIG_GOOGLE_REFRESH_INTERVAL)
+                          or DEFAULT_REFRESH_INTERVAL)
+        )
+
+    async def cog_load(self):
+        """Start the background refresh of the glossary index, which also warms it, along with
+        the flusher for queued Sheet writes."""
+
+        self.refresh_index.start()
+        self.write_behind.start()
+
+    def cog_unload(self):
+        """Stop the background refresh of the glossary index."""
+
+        self.refresh_index.cancel()
+
+    @tasks.loop(seconds=DEFAULT_REFRESH_INTERVAL)
+    async def refresh_index(self):
+        """Periodically reload the glossary index from the Sheet, to pick up edits made there, and
+        split any partitions that have grown too large."""
+
+        try:
+            with priority(PRIORITY_BACKGROUND):
+                oversized = await self._load_index()
+                if len(oversized) > 0:
+                    await self._rebalance(oversized)
+        # pylint: disable=broad-except
+        except Exception as error:
+            print(f"Glossary index refresh failed: {error}")
+
+    @refresh_index.before_loop
+    async def _before_refresh(self):
+        """Wait until we're connected before the first load of the glossary index, so reading
+        the Sheet (and loading the Google credentials) doesn't hold up connecting."""
+
+        await self.bot.wait_until_ready()
+
+    async def _load_index(self, force: bool = True) -> List[str]:
+        """Read every partition of the glossary (in one batch call, or via the local replica),
+        and rebuild the in-memory index from it. Unless forced, this is skipped when the index
+        has already been loaded. Returns the partitions that have grown too large."""
+
+        async with self._index_lock:
+            if not force and self.index.loaded:
+                return []
+
+            # writes still in the journal aren't in the Sheet yet, so lay them over what we read
+            pending = {entry["seq"]: entry for entry in self.write_behind.pending(self.definitions)}
+            await self.partitions.ensure()
+            partitions = self.partitions.load(await fetch_partitions(
+                self.sheets, self.replica, self.definitions, self.partitions.worksheets()))
+            self.index.load(partitions)
+            pending.update(
+                {entry["seq"]: entry for entry in self.write_behind.pending(self.definitions)})
+
+            for _, entry in sorted(pending.items()):
+                if entry["op"] == OP_APPEND:
+                    self.index.put(entry["worksheet"], dict(zip(COLUMNS, entry["values"])))
+                else:
+                    self.index.remove(entry["match"]["Term"])
+
+            print(f"Glossary index loaded with {len(self.index)} terms.")
+            return self.partitions.oversized(partitions)
+
+    async def _rebalance(self, titles: List[str]):
+        """Split the partitions that have grown too large, once every queued write has reached
+        the Sheet, and move any writes queued meanwhile to the partitions now holding their
+        terms."""
+
+        async def split() -> Tuple[List[str], int]:
+            added = await self.partitions.rebalance(titles)
+            moved = 0
+            if len(added) > 0:
+                moved = self.write_behind.reroute(self.definitions, self.partitions.route)
+            return added, moved
+
+        added, moved = await self.write_behind.drained(self.definitions, split)
+        if len(added) > 0:
+            print(f"Split glossary partitions {', '.join(titles)} into {', '.join(added)} "
+                  f"(moving {moved} queued writes).")
+
+    async def _ensure_index(self):
+        """Make sure the glossary index has been loaded at least once."""
+
+        if not self.index.loaded:
+            await self._load_index(force=False)
+
+    async def _define(self, term: str, definition: str, author: str) -> str:
+        """Set the definition of a term, unless it's already defined, and describe the outcome.
+        """
+
+        await self._ensure_index()
+        key = self.partitions.route(term)
+        values = [term, definition, author, dt.now().strftime("%x")]
+        # queued rows count too, whether or not the index has caught up with them; rows already
+        # in the Sheet but not yet in the index are left for the flush to drop
+        if term in self.index \
+                or self.write_behind.queued(self.definitions, key, values):
+            return f"{term} is already defined!"
+
+        self.write_behind.append(self.definitions, key, values)
+        self.index.put(key, dict(zip(COLUMNS, values)))
+
+        return f"'{term}' is now defined as '{definition}'"
+
+    async def _undefine(self, term: str) -> str:
+        """Clear the definition of a term, and describe the outcome."""
+
+        await self._ensure_index()
+        key = self.partitions.route(term)
+        if term in self.index:
+            self.write_behind.delete(self.definitions, key, {"Term": term})
+            self.index.remove(term)
+            return f"The definition of '{term}' has been removed."
+
+        return f"{term} was not defined!"
+
+    async def _whatis(self, term: str) -> str:
+        """Look up the definition of a term, or suggest where else to look."""
+
+        await self._ensure_index()
+        row = self.index.get(term)
+        if row is not None:
+            return f"**{term}**: '{row['Definition']}'" \
+                   f"\n    *({row['Author']}, {row['Date']})*."
+
+        suggestions = self.index.search.suggest(term, kind=KIND_TERM) \
+            if self.index.search is not None else []
+        hint = f"\nDid you mean: {', '.join(suggestions)}?" if suggestions else ""
+        return f"'{term}' is not defined, but this might help:{hint}" \
+               f"\nhttps://duckduckgo.com/?q=%22{term}%22+USD497+KSDE+Kansas"
 
     @commands.command("define")
     async def save_definition(self,
@@ -45,23 +188,8 @@ class DefinitionCog(commands.Cog, name="\n\nGlossary"):
         message: Message = ctx.message
         if message.author.id != self.bot.user.id:
             try:
-                idx = ALPHAS.index(term[0].upper())
-                key = SHEETS[floor(idx / 5)]
-                async with ctx.typing():
-                    spreadsheet = self.sheets_service.open_by_key(self.definitions)
-                    sheet = spreadsheet.worksheet(key)
-                    rows = sheet.get_all_records()
-
-                    for row in rows:
-                        if len(row) > 0 and row["Term"].lower() == term.lower():
-                            await message.reply(f"{term} is already defined!")
-                            return
-
-                    sheet.append_row(
-                        [term, definition, message.author.display_name, dt.now().strftime("%x")])
-                    sheet.sort((1, 'asc'), range=f"A2:D{len(rows) + 2}")
-
-                await message.reply(f"'{term}' is now defined as '{definition}'")
+                await message.reply(
+                    await self._define(term, definition, message.author.display_name))
             # pylint: disable=broad-except
             except Exception as error:
                 print(error)
@@ -82,24 +210,7 @@ class DefinitionCog(commands.Cog, name="\n\nGlossary"):
 
         if ctx.author.id != self.bot.user.id:
             try:
-                idx = ALPHAS.index(term[0].upper())
-                key = SHEETS[floor(idx / 5)]
-                term_index = -1
-                async with ctx.typing():
-                    spreadsheet = self.sheets_service.open_by_key(self.definitions)
-                    sheet = spreadsheet.worksheet(key)
-                    rows = sheet.get_all_records()
-
-                    for idx, row in enumerate(rows):
-                        if len(row) > 0 and row["Term"].lower() == term.lower():
-                            term_index = idx
-                            break
-
-                if term_index > -1:
-                    sheet.delete_row(term_index + 2)
-                    await ctx.reply(f"The definition of '{term}' has been removed.")
-                else:
-                    await ctx.reply(f"{term} was not defined!")
+                await ctx.reply(await self._undefine(term))
             # pylint: disable=broad-except
             except Exception as error:
                 print(error)
@@ -119,27 +230,7 @@ class DefinitionCog(commands.Cog, name="\n\nGlossary"):
         """
         if ctx.author.id != self.bot.user.id:
             try:
-                idx = ALPHAS.index(term[0].upper())
-                key = SHEETS[floor(idx / 5)]
-                response = None
-                async with ctx.typing():
-                    spreadsheet = self.sheets_service.open_by_key(self.definitions)
-                    sheet = spreadsheet.worksheet(key)
-                    rows = sheet.get_all_records()
-
-                    for row in rows:
-                        if len(row) > 0 and row["Term"].lower() == term.lower():
-                            response = f"**{term}**: '{row['Definition']}'" \
-                                       f"\n    *({row['Author']}, {row['Date']})*."
-                            break
-
-                if response is None:
-                    await ctx.reply(
-                        f"'{term}' is not defined, but this might help:"
-                        f"\nhttps://duckduckgo.com/?q=%22{term}%22+USD497+KSDE+Kansas"
-                    )
-                else:
-                    await ctx.reply(response)
+                await ctx.reply(await self._whatis(term))
             # pylint: disable=broad-except
             except Exception as error:
                 print(error)
@@ -148,3 +239,50 @@ class DefinitionCog(commands.Cog, name="\n\nGlossary"):
                 # pylint: disable=broad-except
                 except Exception as safe_error:
                     print(safe_error)
+
+    @commands.slash_command(name="define")
+    async def slash_define(self, inter: ApplicationCommandInteraction, term: str,
+                           definition: str):
+        """
+        Set the definition of a term
+
+        Parameters
+        ----------
+        term: The term to define
+        definition: What it means
+        """
+
+        await respond(inter, self._define(term, definition, inter.author.display_name),
+                      slow=not self.index.loaded)
+
+    @commands.slash_command(name="undefine")
+    async def slash_undefine(self, inter: ApplicationCommandInteraction, term: str):
+        """
+        Clear the definition of a term
+
+        Parameters
+        ----------
+        term: The term to clear
+        """
+
+        await respond(inter, self._undefine(term), slow=not self.index.loaded)
+
+    @commands.slash_command(name="whatis")
+    async def slash_whatis(self, inter: ApplicationCommandInteraction, term: str):
+        """
+        Retrieve the definition of a term
+
+        Parameters
+        ----------
+        term: The term to look up
+        """
+
+        await respond(inter, self._whatis(term), slow=not self.index.loaded)
+
+    @slash_undefine.autocomplete("term")
+    @slash_whatis.autocomplete("term")
+    async def complete_term(self, _inter: ApplicationCommandInteraction, prefix: str):
+        """Suggest defined terms starting with what's been typed so far, from the in-memory
+        index (which is empty until the first load)."""
+
+        return self.index.complete(prefix)
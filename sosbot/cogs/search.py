@@ -0,0 +1,69 @@
+"""Commands to search across the glossary and datasets"""
+import logging
+
+from disnake.ext import commands
+
+from sosbot.bot import SOSBot
+from sosbot.pages import fit_lines
+from sosbot.search import KIND_TERM
+
+logging.basicConfig(level=logging.INFO)
+
+MAX_RESULTS = 10
+MAX_SNIPPET = 120
+
+
+class SearchCog(commands.Cog, name="\n\nSearch"):
+    """Cog containing logic for searching the glossary and datasets"""
+
+    def __init__(self, bot: SOSBot):
+        """Initialize the cog, using the search index the glossary and dataset cogs maintain"""
+
+        self.bot = bot.discord.bot
+        self.search = bot.search
+
+    @commands.command("search")
+    async def search_all(self, ctx: commands.Context, *, query: str):
+        """
+        Search glossary terms, definitions, dataset names and descriptions.
+
+        Usage: !search <words>
+        """
+        if ctx.author.id != self.bot.user.id:
+            try:
+                hits = self.search.search(query, limit=MAX_RESULTS)
+                if len(hits) < 1:
+                    await ctx.reply(f"Nothing found for '{query}'.")
+                    return
+
+                lines = []
+                for hit in hits:
+                    document = hit.document
+                    if document.kind == KIND_TERM:
+                        lines.append(f"* **{document.title}** (term): {snippet(document.text)}")
+                    else:
+                        lines.append(
+                            f"* **{document.title}** (dataset): "
+                            f"{snippet(document.data.get('Description', ''))}\n"
+                            f"  {document.data.get('URL', '')}"
+                        )
+
+                await ctx.reply(fit_lines(
+                    f"{len(hits)} matches for '{query}':", lines,
+                    "Use !whatis <term> or !dataset <name> for more information"
+                ))
+            # pylint: disable=broad-except
+            except Exception as error:
+                print(error)
+                try:
+                    await ctx.reply("Sorry, an error has occurred.")
+                # pylint: disable=broad-except
+                except Exception as safe_error:
+                    print(safe_error)
+
+
+def snippet(text: str) -> str:
+    """Shorten text for display in a list of search results."""
+
+    text = str(text).strip()
+    return text if len(text) <= MAX_SNIPPET else text[:MAX_SNIPPET - 3].rstrip() + "..."
@@ -0,0 +1,96 @@
+"""Commands to report on the bot's own performance"""
+import logging
+
+from disnake.ext import commands
+
+from sosbot.bot import SOSBot, CONFIG_DISCORD_METRICS_HOST, CONFIG_DISCORD_METRICS_PORT
+from sosbot.metrics import (MetricsServer, COMMAND_SECONDS, GOOGLE_CALLS, DISCORD_REQUESTS,
+                            RATE_LIMITED, DEFAULT_METRICS_HOST)
+
+logging.basicConfig(level=logging.INFO)
+
+
+class StatsCog(commands.Cog, name="\n\nStatistics"):
+    """Cog containing logic for reporting metrics, and serving them to Prometheus"""
+
+    def __init__(self, bot: SOSBot):
+        """Initialize the cog, including the metrics endpoint if a port is configured (offset by
+        the first shard, when this process runs only some of them)"""
+
+        self.bot = bot.discord.bot
+        self.metrics = bot.metrics
+        self.google = bot.google
+        self.server = None
+        port = bot.discord.config.get(CONFIG_DISCORD_METRICS_PORT)
+        if port:
+            self.server = MetricsServer(
+                self.metrics,
+                host=bot.discord.config.get(CONFIG_DISCORD_METRICS_HOST) or DEFAULT_METRICS_HOST,
+                port=bot.discord.sharding.port(int(port))
+            )
+
+    async def cog_load(self):
+        """Start serving metrics, if a port is configured."""
+
+        if self.server is not None:
+            await self.server.start()
+
+    def cog_unload(self):
+        """Stop serving metrics."""
+
+        if self.server is not None:
+            self.bot.loop.create_task(self.server.stop())
+
+    @commands.command("stats")
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx: commands.Context):
+        """
+        Show command latency, API call counts, rate limiting and cache hit ratios (admins only).
+
+        Usage: !stats
+        """
+        if ctx.author.id != self.bot.user.id:
+            try:
+                lines = ["**Commands**"]
+                for key, histogram in sorted(self.metrics.histograms(COMMAND_SECONDS).items()):
+                    labels = dict(key)
+                    lines.append(
+                        f"* !{labels['command']} ({labels['status']}): {histogram.count} runs, "
+                        f"mean {histogram.sum / histogram.count:.2f}s, "
+                        f"p50 <= {histogram.quantile(0.5)}s, p95 <= {histogram.quantile(0.95)}s"
+                    )
+
+                google_calls = self.metrics.total(GOOGLE_CALLS)
+                google_ok = self.metrics.total(GOOGLE_CALLS, status="ok")
+                depth = self.google.get_sheets().queue_depth()
+                lines += [
+                    "",
+                    f"**Google**: {google_calls:.0f} calls, {google_calls - google_ok:.0f} failed, "
+                    f"{self.metrics.total(RATE_LIMITED, api='google'):.0f} rate limited; "
+                    f"queued: {depth}",
+                ]
+
+                discord_requests = self.metrics.total(DISCORD_REQUESTS)
+                discord_ok = self.metrics.total(DISCORD_REQUESTS, status="ok")
+                lines.append(
+                    f"**Discord**: {discord_requests:.0f} requests, "
+                    f"{discord_requests - discord_ok:.0f} failed, "
+                    f"{self.metrics.total(RATE_LIMITED, api='discord'):.0f} rate limited"
+                )
+
+                ratios = self.metrics.hit_ratios()
+                if len(ratios) > 0:
+                    lines += ["", "**Caches**"] + [
+                        f"* {cache}: {hits / lookups:.0%} hits ({hits:.0f} of {lookups:.0f})"
+                        for cache, (hits, lookups) in sorted(ratios.items())
+                    ]
+
+                await ctx.reply("\n".join(lines))
+            # pylint: disable=broad-except
+            except Exception as error:
+                print(error)
+                try:
+                    await ctx.reply("Sorry, an error has occurred.")
+                # pylint: disable=broad-except
+                except Exception as safe_error:
+                    print(safe_error)
@@ -1,32 +1,102 @@
 """
 Commands to handle saving, retrieving, and managing conversations (replies and threads).
 """
+import asyncio
+import io
 import logging
 import os
+import time
+from datetime import date, datetime, timezone
 # pylint: disable=no-name-in-module
-from typing import Dict, Iterable
-import pytz
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from disnake import Thread, Message, MessageReference, AllowedMentions, File
+from disnake import (Thread, Message, MessageReference, AllowedMentions, File, NotFound,
+                     Object)
+from disnake.abc import Messageable
+from disnake.ext import tasks
 from disnake.ext.commands import command, Cog, Context, Command
+from disnake.utils import time_snowflake
 
-from sosbot.bot import (SOSBot, CONFIG_DISCORD_SAVEDIR)
+from sosbot.archive import ArchiveIndex, ArchiveWriter, Checkpoint, excerpt, is_sidecar
+from sosbot.bot import (SOSBot, CONFIG_DISCORD_SAVEDIR, CONFIG_DISCORD_REPLY_GRAPH_SIZE,
+                        CONFIG_DISCORD_REPLY_GRAPH_FILE, CONFIG_DISCORD_ARCHIVE_INDEX)
+from sosbot.pages import fit_lines
+from sosbot.prefetch import AttachmentPrefetcher
+from sosbot.replies import ReplyGraph, DEFAULT_MAX_MESSAGES
+from sosbot.scheduler import TokenBucket
 
 logging.basicConfig(level=logging.INFO)
 
-ALPHAS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-SHEETS = [
-    "A-E", "F-J", "K-O", "P-T", "U-Z"
-]
+PROGRESS_INTERVAL = 2000
+
+# Discord allows 5 messages per 5 seconds in a channel; pace thread posts to stay under it
+SEND_RATE_PER_MINUTE = 60
+SEND_BURST = 5
+LARGE_FORK = 25
+FORK_PROGRESS_INTERVAL = 25
+MAX_SEARCH_RESULTS = 10
+
+# channel history comes in pages of this many messages
+HISTORY_PAGE_SIZE = 100
+
+# Excerpts up to this size are posted inline, and larger ones attached, up to Discord's upload limit
+INLINE_LIMIT = 1800
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%x")
 
 
 class Conversations(Cog, name="\n\nConversation Management"):
     """Cog containing logic for scraping and saving information from threads"""
 
     def __init__(self, bot: SOSBot):
-        """Initialize the cog, including the gspread service used to access the Sheet"""
+        """Initialize the cog, including the reply graph used to find conversations"""
 
         self.bot = bot
+        self.replies = ReplyGraph(
+            time_snowflake(datetime.now(timezone.utc)),
+            max_messages=int(
+                bot.discord.config.get(CONFIG_DISCORD_REPLY_GRAPH_SIZE) or DEFAULT_MAX_MESSAGES)
+        )
+        self._replies_path = bot.discord.config.get(CONFIG_DISCORD_REPLY_GRAPH_FILE)
+        if self._replies_path:
+            self._replies_path = bot.discord.sharding.path(self._replies_path)
+            self.replies.load(self._replies_path)
+
+        self.archive_index = ArchiveIndex(
+            bot.discord.config.get(CONFIG_DISCORD_ARCHIVE_INDEX)
+            or os.path.join(self._storage_root(), "archive-index.db")
+        )
+
+    async def cog_load(self):
+        """Start saving the reply graph periodically, if it's meant to be persisted."""
+
+        if self._replies_path:
+            self.save_replies.start()
+
+    def cog_unload(self):
+        """Save the reply graph one last time, if it's meant to be persisted."""
+
+        if self._replies_path:
+            self.save_replies.cancel()
+            self.replies.save(self._replies_path)
+
+        self.archive_index.close()
+
+    @tasks.loop(minutes=5)
+    async def save_replies(self):
+        """Periodically save the reply graph, so a restart doesn't lose it."""
+
+        try:
+            self.replies.save(self._replies_path)
+        # pylint: disable=broad-except
+        except Exception as error:
+            print(f"Failed to save the reply graph: {error}")
+
+    @Cog.listener()
+    async def on_message(self, message: Message):
+        """Record every message we see in the reply graph."""
+
+        self.replies.add(message.channel.id, message.id, parent_of(message))
 
     @command(name="save-convo")
     async def save_convo(self, ctx: Context, *, title: str):
@@ -38,7 +108,8 @@ class Conversations(Cog, name="\n\nConversation Management"):
         Given that starting point, look through the message history from that point forward and
         track any messages that are replies to this original message (or one of its own replies).
         Then, save this set of messages to a file with the given title for later reference. The
-        file will also be attached as a reply to this command message.
+        file will also be attached as a reply to this command message. Saving the same
+        conversation under the same title again only appends the messages posted since.
 
         USAGE: !save-convo CONVERSATION TITLE
         """
@@ -49,19 +120,27 @@ class Conversations(Cog, name="\n\nConversation Management"):
             await command_message.reply(f"Usage: !{cmd.name} CONVERSATION TITLE")
             return
 
-        starting_point, in_thread = await self._find_thread(command_message, ctx)
+        starting_point, in_thread = await self._find_root(command_message, ctx)
         if starting_point is not None:
             with ctx.typing():
                 storage_path = self._format_storage_path(ctx, ctx.channel.name, title)
-                file = self._write_messages(
+                checkpoint = Checkpoint.load(storage_path, starting_point.message_id)
+                resumed = not checkpoint.empty
+                await self._find_replies(
+                    ctx.channel, starting_point.message_id, in_thread, since=checkpoint)
+                self._write_messages(
                     sorted(in_thread.values(), key=lambda x: x.created_at),
                     storage_path,
                     title,
-                    ctx
+                    ctx,
+                    checkpoint
                 )
 
+                added = f" ({len(in_thread)} new messages)" if resumed else ""
+                file, note = self._saved_file(storage_path, title)
                 await command_message.reply(
-                    f"Saved conversation to: {ctx.guild.name}/{ctx.channel.name}/{title}",
+                    f"Saved conversation to: {ctx.guild.name}/{ctx.channel.name}/{title}{added}"
+                    f"{note}",
                     file=file
                 )
         else:
@@ -78,7 +157,8 @@ class Conversations(Cog, name="\n\nConversation Management"):
         Given that starting point, look through the message history from that point forward and
         track any messages that are replies to this original message (or one of its own replies).
         Then, use this set of messages to construct attachment new Discord thread with the given
-        title.
+        title. Attachments are downloaded ahead of time while earlier messages are posted, and
+        posts are paced to stay within Discord's rate limits.
 
         USAGE: !make-thread THREAD TITLE
         """
@@ -103,36 +183,79 @@ class Conversations(Cog, name="\n\nConversation Management"):
                     name=title, message=fork_point
                 )
 
-                sent = {}
-                for msg in sorted(in_thread.values(), key=lambda x: x.created_at):
-                    ref = msg.reference
-                    if ref is not None:
-                        ref = sent[ref.message_id]
-
-                    files = []
-                    for attachment in msg.attachments:
-                        files.append(await attachment.to_file())
+                messages = sorted(in_thread.values(), key=lambda x: x.created_at)
+                progress = None
+                if len(messages) >= LARGE_FORK:
+                    progress = await command_message.reply(
+                        f"Copying {len(messages)} messages into the thread...")
 
-                    thread_msg = await thread.send(
-                        f"<@{msg.author.id}> said: {msg.content}",
-                        files=files,
-                        reference=ref,
-                        allowed_mentions=allowed_mentions
-                    )
-
-                    sent[msg.id] = thread_msg.to_reference()
+                summary = await self._copy_messages(thread, messages, allowed_mentions, progress)
+                if progress is not None:
+                    await progress.edit(content=summary)
         else:
             await command_message.reply(
                 "This message is not attachment response! "
                 "Try responding to attachment message with this command."
             )
 
+    @staticmethod
+    async def _copy_messages(thread: Thread, messages: List[Message],
+                             allowed_mentions: AllowedMentions,
+                             progress: Optional[Message]) -> str:
+        """Post copies of messages into a thread, in order, each replying to the copy of the
+        message it replied to. Attachments are downloaded ahead of the post that needs them,
+        and posts are paced to stay within Discord's rate limits; a progress message, if given,
+        is updated along the way. Returns a summary of where the time went."""
+
+        started = time.monotonic()
+        pacing = TokenBucket(SEND_RATE_PER_MINUTE, burst=SEND_BURST)
+        waited = {"attachments": 0.0, "pacing": 0.0, "sending": 0.0}
+        sent = {}
+        async with AttachmentPrefetcher(messages) as prefetcher:
+            for count, msg in enumerate(messages, start=1):
+                ref = msg.reference
+                if ref is not None:
+                    ref = sent[ref.message_id]
+
+                mark = time.monotonic()
+                files = await prefetcher.files(msg)
+                waited["attachments"] += time.monotonic() - mark
+
+                mark = time.monotonic()
+                await pacing.acquire()
+                waited["pacing"] += time.monotonic() - mark
+
+                mark = time.monotonic()
+                thread_msg = await thread.send(
+                    f"<@{msg.author.id}> said: {msg.content}",
+                    files=files,
+                    reference=ref,
+                    allowed_mentions=allowed_mentions
+                )
+                waited["sending"] += time.monotonic() - mark
+                await prefetcher.release(msg)
+
+                sent[msg.id] = thread_msg.to_reference()
+                if progress is not None and count % FORK_PROGRESS_INTERVAL == 0:
+                    await progress.edit(content=f"Copied {count} of {len(messages)} messages...")
+
+        return (
+            f"Copied {len(messages)} messages "
+            f"({prefetcher.downloaded / 1024 / 1024:.1f} MB of attachments) in "
+            f"{time.monotonic() - started:.1f}s: "
+            f"{waited['attachments']:.1f}s waiting on attachments "
+            f"({prefetcher.download_time:.1f}s downloading in total), "
+            f"{waited['pacing']:.1f}s pacing, {waited['sending']:.1f}s posting."
+        )
+
     @command(name="save-thread")
     async def save_thread(self, ctx: Context):
         """Save contents of a thread.
 
         Retrieve the message contents of a Discord thread, and save it to a file with the
-        thread's title.
+        thread's title. Saving the same thread again only appends the messages posted since.
+        Messages are written out as they're read, so threads of any length can be saved; long
+        ones get progress updates along the way.
 
         Usage: !save-thread
         """
@@ -140,13 +263,32 @@ class Conversations(Cog, name="\n\nConversation Management"):
         channel = command_message.channel
 
         if isinstance(channel, Thread):
-            messages = await channel.history(limit=500, oldest_first=True).flatten()
             storage_path = self._format_storage_path(ctx, channel.parent.name, channel.name)
-
-            file = self._write_messages(messages, storage_path, channel.name, ctx)
-
+            checkpoint = Checkpoint.load(storage_path)
+            after = None if checkpoint.empty else Object(checkpoint.last_id)
+
+            progress: Optional[Message] = None
+            location = (ctx.guild.name, channel.parent.name, channel.name)
+            with ArchiveWriter(storage_path, checkpoint, index=self.archive_index,
+                               location=location) as writer:
+                writer.header(channel.name, channel.name, ctx.guild.name)
+                async for message in channel.history(limit=None, after=after,
+                                                     oldest_first=True):
+                    writer.write(message)
+                    if writer.written % PROGRESS_INTERVAL == 0:
+                        status = f"Saving thread... {writer.written} messages so far"
+                        if progress is None:
+                            progress = await command_message.reply(status)
+                        else:
+                            await progress.edit(content=status)
+
+            if progress is not None:
+                await progress.edit(content=f"Saved {writer.written} messages.")
+
+            file, note = self._saved_file(storage_path, channel.name)
             await command_message.reply(
-                f"Saved conversation to: {ctx.guild.name}/{channel.parent.name}/{channel.name}",
+                f"Saved conversation to: {ctx.guild.name}/{channel.parent.name}/{channel.name}"
+                f"{note}",
                 file=file
             )
         else:
@@ -161,22 +303,65 @@ class Conversations(Cog, name="\n\nConversation Management"):
         Usage: !list-convos
         """
         storage_dir = self._format_storage_dir(ctx, ctx.channel.name)
-        fnames = os.listdir(storage_dir)
+        fnames = [f for f in os.listdir(storage_dir) if not is_sidecar(f)]
         response = "\n".join([f"* {os.path.splitext(f)[0]}" for f in fnames])
 
         await ctx.reply(f"The following conversations have been saved:\n\n{response}")
 
+    @command(name="search-convos")
+    async def search_convos(self, ctx: Context, *, query: str):
+        """Search saved conversations & threads.
+
+        Search the messages of every conversation and thread saved on the current server, in
+        any channel, and list the best matches.
+
+        Usage: !search-convos <words>
+        """
+        if ctx.author.id != self.bot.discord.bot.user.id:
+            try:
+                hits = self.archive_index.search(ctx.guild.name, query, limit=MAX_SEARCH_RESULTS)
+                if len(hits) < 1:
+                    await ctx.reply(f"No saved conversations mention '{query}'.")
+                    return
+
+                lines = [
+                    f"* **{hit.title}** in #{hit.channel}, {hit.timestamp[:16].replace('T', ' ')} "
+                    f"@{hit.author}: {hit.snippet}"
+                    for hit in hits
+                ]
+                await ctx.reply(fit_lines(
+                    f"{len(hits)} matches for '{query}':", lines,
+                    "Use !load-convo <title> in that channel to retrieve one"
+                ))
+            # pylint: disable=broad-except
+            except Exception as error:
+                print(error)
+                try:
+                    await ctx.reply("Sorry, an error has occurred.")
+                # pylint: disable=broad-except
+                except Exception as safe_error:
+                    print(safe_error)
+
     @command(name="load-convo")
     async def load_convo(self, ctx: Context, *, title: str):
         """Retrieve a conversation or thread for download.
 
-        Retrieve the list of threads for the current channel on the current server.
+        Retrieve a saved conversation or thread for the current channel on the current server.
+        With --date, or --from and/or --to, only the messages from those days are retrieved:
+        inline if they're short enough, otherwise as an attachment. Dates look like 2024-01-31.
 
-        Usage: !load-convo TITLE
+        Usage: !load-convo TITLE [--date DATE | --from DATE --to DATE]
         """
         command_message: Message = ctx.message
         cmd: Command = ctx.command
         # convo_path = command_message.content[len(cmd.name) + 2:].strip()
+        try:
+            title, start, end = parse_range(title)
+        except ValueError as error:
+            await command_message.reply(f"{error}\nUsage: !{cmd.name} TITLE "
+                                        f"[--date DATE | --from DATE --to DATE]")
+            return
+
         if len(title) < 1:
             await command_message.reply(f"Usage: !{cmd.name} CHANNEL/TITLE\n"
                                         f"Try !list-convos for more.")
@@ -184,88 +369,242 @@ class Conversations(Cog, name="\n\nConversation Management"):
 
         docpath = self._format_storage_path(ctx, ctx.channel.name, title)
 
-        if os.path.exists(docpath):
+        if not os.path.exists(docpath):
+            await ctx.reply("No conversation found for that channel/title")
+        elif start is None and end is None and os.path.getsize(docpath) <= MAX_UPLOAD_BYTES:
             file = File(docpath)
             await ctx.reply(file=file)
         else:
-            await ctx.reply("No conversation found for that channel/title")
+            data, trimmed = excerpt(docpath, start, end, MAX_UPLOAD_BYTES)
+            span = f"{start or 'start'} to {end or 'end'}"
+            if len(data) < 1:
+                await ctx.reply(f"Nothing was saved in '{title}' from {span}.")
+            elif len(data) <= INLINE_LIMIT:
+                await ctx.reply(f"**{title}** ({span}):\n{data.decode('utf-8').strip()}")
+            else:
+                note = " (trimmed to fit Discord's upload limit)" if trimmed else ""
+                await ctx.reply(
+                    f"**{title}** ({span}){note}",
+                    file=File(io.BytesIO(data), filename=f"{title}.md")
+                )
 
-    def _format_storage_dir(self, ctx: Context, channel_subpath: str) -> str:
-        """Format an appropriate storage directory based on server name and channel name.
-        """
-        storage_root = self.bot.discord.config.get(CONFIG_DISCORD_SAVEDIR) or os.path.join(
+    def _storage_root(self) -> str:
+        """Retrieve the directory conversations are saved under."""
+
+        return self.bot.discord.config.get(CONFIG_DISCORD_SAVEDIR) or os.path.join(
             os.environ['HOME'], 'sosbot-saved'
         )
 
-        return os.path.join(storage_root, ctx.guild.name, channel_subpath)
+    def _format_storage_dir(self, ctx: Context, channel_subpath: str) -> str:
+        """Format an appropriate storage directory based on server name and channel name.
+        """
+        return os.path.join(self._storage_root(), ctx.guild.name, channel_subpath)
 
     def _format_storage_path(self, ctx: Context, channel_subpath: str, title: str) -> str:
         """Format an appropriate storage path based on server name, channel name, and a
         title given by the user. The result will be a path to a Markdown file.
         """
-        storage_root = self.bot.discord.config.get(CONFIG_DISCORD_SAVEDIR) or os.path.join(
-            os.environ['HOME'], 'sosbot-saved'
-        )
-
         return os.path.join(
-            storage_root, ctx.guild.name, channel_subpath, title + ".md"
+            self._storage_root(), ctx.guild.name, channel_subpath, title + ".md"
         )
 
-    @staticmethod
     def _write_messages(
-            messages: Iterable[Message], storage_path: str, title: str,
-            ctx: Context
-    ) -> File:
-        """Write a list of messages to a Markdown-formatted file, and return a File object
-        suitable to post in a Discord message.
+            self, messages: Iterable[Message], storage_path: str, title: str,
+            ctx: Context, checkpoint: Checkpoint
+    ):
+        """Write a list of messages to a Markdown-formatted file. If the checkpoint says part
+        of the conversation was saved already, the messages are appended after it; either way,
+        the checkpoint is advanced past them and saved alongside the file. The messages are also
+        added to the archive's search index.
         """
-        if not os.path.isdir(os.path.dirname(storage_path)):
-            os.makedirs(os.path.dirname(storage_path))
-
-        last_date = None
-        with open(storage_path, 'w', encoding="utf-8") as filestore:
-            filestore.write(
-                f"# {title}\n\n"
-                f"**NOTE:** This conversation was recorded in {ctx.channel.name}, "
-                f"on server {ctx.guild.name}.\n"
-            )
-
+        location = (ctx.guild.name, ctx.channel.name, title)
+        with ArchiveWriter(storage_path, checkpoint, index=self.archive_index,
+                           location=location) as writer:
+            writer.header(title, ctx.channel.name, ctx.guild.name)
             for message in messages:
-                msg_date = message.created_at.replace(tzinfo=pytz.timezone("US/Central"))
-                datestr = msg_date.strftime("%x")
-                timestr = msg_date.strftime("%X")
-                if datestr != last_date:
-                    filestore.write(f"\n## {datestr}\n")
-                    last_date = datestr
-
-                filestore.write(
-                    f"* {timestr} @{message.author.display_name}: {message.clean_content}\n"
-                )
-
-        return File(storage_path, description=title)
+                writer.write(message)
 
     @staticmethod
-    async def _find_thread(command_message: Message, ctx: Context):
-        message: Message = command_message
-        starting_point: MessageReference = message.reference
-        print(f"Message: `{message.content}` in reply to: {starting_point.message_id}")
+    def _saved_file(storage_path: str, title: str) -> Tuple[Optional[File], str]:
+        """Build the File to post a saved conversation as, unless it's over Discord's upload
+        limit; then there's no File, but a note to add to the reply saying why."""
 
-        in_thread: Dict[int, Message] = {}
+        size = os.path.getsize(storage_path)
+        if size <= MAX_UPLOAD_BYTES:
+            return File(storage_path, description=title), ""
+
+        return None, f"\nAt {size / 1024 / 1024:.1f} MiB, it's too large to attach here."
+
+    async def _find_thread(self, command_message: Message, ctx: Context):
+        """Find the conversation a command message replies to: the root of its reply chain, and
+        every message replying to that root (directly or indirectly), keyed by message id.
+        """
+        starting_point, in_thread = await self._find_root(command_message, ctx)
         if starting_point is not None:
-            last_start_point = starting_point
-            while starting_point is not None:
-                message = await ctx.channel.fetch_message(starting_point.message_id)
-                in_thread[starting_point.message_id] = message
-                last_start_point = starting_point
-                starting_point = message.reference
+            await self._find_replies(ctx.channel, starting_point.message_id, in_thread)
 
-            starting_point = last_start_point
+        return starting_point, in_thread
 
+    async def _find_root(self, command_message: Message, ctx: Context):
+        """Walk up the reply chain from a command message to the root of its conversation.
+        Returns a reference to the root, and the messages fetched along the way (including the
+        command message), keyed by id. The reply graph saves fetching ancestors it knows.
+        """
+        starting_point: MessageReference = command_message.reference
+        if starting_point is None:
+            return None, {}
+
+        print(f"Message: `{command_message.content}` in reply to: {starting_point.message_id}")
+        channel = ctx.channel
+        self.replies.add(channel.id, command_message.id, starting_point.message_id)
+
+        in_thread: Dict[int, Message] = {command_message.id: command_message}
+        root_id = starting_point.message_id
+        while True:
+            known, parent_id = self.replies.parent(root_id)
+            self.bot.metrics.cache("reply_graph", known)
+            if not known:
+                message = await channel.fetch_message(root_id)
+                in_thread[root_id] = message
+                parent_id = parent_of(message)
+                self.replies.add(channel.id, root_id, parent_id)
+
+            if parent_id is None:
+                break
+            root_id = parent_id
+
+        root = MessageReference(message_id=root_id, channel_id=channel.id,
+                                guild_id=ctx.guild.id if ctx.guild else None)
+        return root, in_thread
+
+    async def _find_replies(self, channel: Messageable, root_id: int,
+                            in_thread: Dict[int, Message], since: Optional[Checkpoint] = None):
+        """Add every message replying to the root (directly or indirectly) to in_thread.
+
+        The reply graph answers this without any API calls, unless parts of the conversation
+        are older than what the graph remembers; then we fall back to scanning channel history
+        from the root onward. Given a non-empty checkpoint, only messages posted after it are
+        looked for (and kept), using the reply set it recorded to recognize replies.
+        """
+        if since is not None and since.empty:
+            since = None
+
+        if not self.replies.covers(channel.id, root_id) and self.replies.gap(channel.id):
+            await self._fill_gap(channel)
+
+        if self.replies.covers(channel.id, root_id):
+            wanted = {root_id} | self.replies.descendants(root_id)
+            if since is not None:
+                wanted = {message_id for message_id in wanted if message_id > since.last_id}
+            await self._load_messages(channel, wanted, in_thread)
+        elif since is not None:
+            parents = set(in_thread) | since.members
+            async for msg in channel.history(limit=None, after=Object(since.last_id),
+                                             oldest_first=True):
+                self.replies.add(channel.id, msg.id, parent_of(msg))
+                if msg.id in parents or parent_of(msg) in parents:
+                    in_thread[msg.id] = msg
+                    parents.add(msg.id)
         else:
-            in_thread[message.id] = message
+            await self._load_messages(channel, {root_id}, in_thread)
+            async for msg in channel.history(after=in_thread[root_id].created_at,
+                                             oldest_first=True):
+                self.replies.add(channel.id, msg.id, parent_of(msg))
+                if msg.reference is not None and msg.reference.message_id in in_thread:
+                    in_thread[msg.id] = msg
+
+        if since is not None:
+            for message_id in [message_id for message_id in in_thread
+                               if message_id <= since.last_id]:
+                del in_thread[message_id]
+
+    async def _load_messages(self, channel: Messageable, message_ids: Set[int],
+                             in_thread: Dict[int, Message]):
+        """Add the messages with the given ids to in_thread, preferring the client's message
+        cache. Any that aren't cached are fetched one by one, unless they're dense enough (as
+        far as the reply graph can tell) that a history scan, spanning only from the oldest to
+        the newest missing message, takes fewer calls."""
+
+        missing = set()
+        for message_id in message_ids - set(in_thread):
+            message = self.bot.discord.bot.get_message(message_id)
+            self.bot.metrics.cache("messages", message is not None)
+            if message is not None:
+                in_thread[message_id] = message
+            else:
+                missing.add(message_id)
+
+        if len(missing) < 1:
+            return
 
-        async for msg in ctx.channel.history(after=message.created_at, oldest_first=True):
-            if msg.reference is not None and msg.reference.message_id in in_thread:
+        span = self.replies.count_between(channel.id, min(missing), max(missing))
+        if len(missing) <= -(-max(span, len(missing)) // HISTORY_PAGE_SIZE):
+            async def fetch(message_id: int) -> Optional[Message]:
+                try:
+                    return await channel.fetch_message(message_id)
+                except NotFound:
+                    return None
+
+            for msg in await asyncio.gather(*(fetch(message_id) for message_id in missing)):
+                if msg is not None:
+                    in_thread[msg.id] = msg
+            return
+
+        async for msg in channel.history(limit=None, after=Object(min(missing) - 1),
+                                         before=Object(max(missing) + 1), oldest_first=True):
+            if msg.id in missing:
                 in_thread[msg.id] = msg
+                missing.discard(msg.id)
+                if len(missing) < 1:
+                    break
+
+    async def _fill_gap(self, channel: Messageable):
+        """Scan the channel history posted while the bot was down, to bring the reply graph
+        up to date for that channel."""
+
+        after, before = self.replies.gap(channel.id)
+        self.replies.fill_gap(channel.id, [
+            (msg.id, parent_of(msg))
+            async for msg in channel.history(limit=None, after=Object(after),
+                                             before=Object(before), oldest_first=True)
+        ])
+
+
+def parent_of(message: Message) -> Optional[int]:
+    """Retrieve the id of the message this message replies to, if any."""
+
+    return message.reference.message_id if message.reference is not None else None
+
+
+def parse_range(text: str) -> Tuple[str, Optional[date], Optional[date]]:
+    """Split a !load-convo argument into the title and the --date or --from/--to range after
+    it. Raises ValueError for unknown options or dates that can't be read."""
+
+    title, *options = text.split(" --")
+    start: Optional[date] = None
+    end: Optional[date] = None
+    for option in options:
+        name, _, value = option.strip().partition(" ")
+        when = parse_date(value.strip())
+        if name == "date":
+            start = end = when
+        elif name == "from":
+            start = when
+        elif name == "to":
+            end = when
+        else:
+            raise ValueError(f"Unknown option: --{name}")
 
-        return starting_point, in_thread
+    return title.strip(), start, end
+
+
+def parse_date(text: str) -> date:
+    """Read a date in any of the accepted formats."""
+
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            pass
+
+    raise ValueError(f"Can't read '{text}' as a date (try YYYY-MM-DD)")
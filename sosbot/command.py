@@ -1,23 +1,147 @@
-"""Basic startup script for the SOSBot Discord bot"""
+"""Basic startup script for the SOSBot Discord bot, and command line tools for its spreadsheets"""
+import asyncio
+import multiprocessing
+from typing import IO, Optional
 
 import click
 
-from sosbot.bot import load_bot
+from sosbot import bulk
+from sosbot.bot import (load_bot, load_google, read_config, CONFIG_DISCORD_SECTION,
+                        CONFIG_DISCORD_SHARD_COUNT, CONFIG_DEFINITION_GSHEET, CONFIG_DATASET_GSHEET)
+from sosbot.cogs.datasets import COLUMNS as DATASET_COLUMNS, KEYS as DATASET_KEYS
+from sosbot.cogs.definitions import COLUMNS as DEFINITION_COLUMNS, KEYS as DEFINITION_KEYS
 from sosbot.cogs.definitions import DefinitionCog
 from sosbot.cogs.datasets import DatasetCog
+from sosbot.cogs.search import SearchCog
+from sosbot.cogs.stats import StatsCog
 from sosbot.cogs.threads import Conversations
+from sosbot.shards import Sharding, parse_shard_ids, split_shards
+from sosbot.startup import STARTUP
 # from sosbot.cogs.hello import HelloCommand
 
+COLLECTIONS = {
+    "glossary": bulk.Collection(CONFIG_DEFINITION_GSHEET, DEFINITION_COLUMNS, DEFINITION_KEYS),
+    "datasets": bulk.Collection(CONFIG_DATASET_GSHEET, DATASET_COLUMNS, DATASET_KEYS),
+}
 
-@click.command()
-def start():
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def cli(ctx: click.Context):
+    """Run the bot (the default), or import and export its spreadsheets"""
+
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(start)
+
+
+@cli.command()
+@click.option("--shards", type=int, default=None,
+              help="Total number of shards (defaults to the shard-count config, if any).")
+@click.option("--shard-ids", default=None,
+              help="Run only these shards in this process, e.g. 0-3,8 (requires a shard count).")
+@click.option("--processes", type=int, default=1,
+              help="Launch this many processes, splitting the shards evenly between them.")
+def start(shards: Optional[int], shard_ids: Optional[str], processes: int):
     """Startup the bot"""
 
-    bot = load_bot()
+    if processes > 1:
+        if shard_ids is not None:
+            raise click.BadParameter("can't be combined with --processes", param_hint="--shard-ids")
+
+        shard_count = shards or int(
+            read_config()[CONFIG_DISCORD_SECTION].get(CONFIG_DISCORD_SHARD_COUNT) or processes)
+        launch([Sharding(shard_count, ids) for ids in split_shards(shard_count, processes)])
+        return
+
+    sharding = Sharding(shards)
+    if shard_ids is not None:
+        ids = parse_shard_ids(shard_ids)
+        if shards is None or len(ids) < 1 or ids[-1] >= shards:
+            raise click.BadParameter(
+                "must be within 0 and --shards - 1 (and --shards is required)",
+                param_hint="--shard-ids")
+
+        sharding = Sharding(shards, ids)
+
+    run(sharding)
+
+
+def launch(shardings):
+    """Run each set of shards in its own process, and wait for them all to stop."""
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run, args=(sharding,), name=f"sosbot-shard-{sharding.first}")
+        for sharding in shardings
+    ]
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+
+def run(sharding: Sharding = Sharding()):
+    """Setup the bot and its cogs, and run the given shards until stopped"""
+
+    STARTUP.mark("imports")
+    bot = load_bot(sharding=sharding)
+    STARTUP.mark("config")
     # bot.discord.add_cog(HelloCommand(bot))
     bot.discord.add_cog(DefinitionCog(bot))
     bot.discord.add_cog(DatasetCog(bot))
+    bot.discord.add_cog(SearchCog(bot))
+    bot.discord.add_cog(StatsCog(bot))
     bot.discord.add_cog(Conversations(bot))
+    STARTUP.mark("cogs")
 
-    print("Starting sosbot for Discord.")
+    print(f"Starting sosbot for Discord ({bot.sharding.describe()}).")
     bot.discord.start()
+
+
+@cli.command("import")
+@click.argument("collection", type=click.Choice(sorted(COLLECTIONS)))
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("--format", "fmt", type=click.Choice(bulk.FORMATS), default=None,
+              help="Format of the rows (defaults to the file's extension, or csv).")
+@click.option("--author", default="bulk import",
+              help="Author recorded for rows that don't name one.")
+@click.option("--dry-run", is_flag=True, help="Report what would be added, without writing.")
+def import_command(collection: str, source: IO[str], fmt: Optional[str], author: str,
+                   dry_run: bool):
+    """Add the rows of a CSV or JSON lines file to the glossary or datasets, skipping the ones
+    already there"""
+
+    google = load_google()
+    spec = COLLECTIONS[collection]
+    try:
+        result = asyncio.run(bulk.import_rows(
+            google.get_partitions(google.config.get(spec.config_key)), spec,
+            bulk.read_rows(source, fmt or bulk.format_of(source.name)), author, dry_run=dry_run))
+    finally:
+        google.get_sheets().shutdown()
+
+    added = ", ".join(f"{partition}: {count}" for partition, count in result.added.items())
+    click.echo(f"{'Would add' if dry_run else 'Added'} {sum(result.added.values())} rows "
+               f"({added}) in {result.calls} batch updates; skipped {result.duplicates} "
+               f"duplicates and {result.rejected} rows without a {spec.columns[0]}.")
+
+
+@cli.command("export")
+@click.argument("collection", type=click.Choice(sorted(COLLECTIONS)))
+@click.argument("target", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", "fmt", type=click.Choice(bulk.FORMATS), default=None,
+              help="Format of the rows (defaults to the file's extension, or csv).")
+def export_command(collection: str, target: IO[str], fmt: Optional[str]):
+    """Write every row of the glossary or datasets to a CSV or JSON lines file"""
+
+    google = load_google()
+    spec = COLLECTIONS[collection]
+    try:
+        rows = asyncio.run(
+            bulk.export_rows(google.get_partitions(google.config.get(spec.config_key)), spec))
+    finally:
+        google.get_sheets().shutdown()
+
+    count = bulk.write_rows(target, fmt or bulk.format_of(target.name), spec.columns, rows)
+    click.echo(f"Exported {count} rows.", err=True)
@@ -0,0 +1,276 @@
+"""In-memory indexes over the rows of the bot's Google Sheets, so read commands can be answered
+without a Sheets round-trip."""
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sosbot.search import SearchIndex, Document, KIND_TERM, KIND_DATASET
+
+Row = Dict[str, Any]
+
+DEFAULT_REFRESH_INTERVAL = 300.0
+MAX_COMPLETIONS = 25
+MAX_COMPLETION_LENGTH = 100
+
+
+def fold(key: str) -> str:
+    """Normalize a term or dataset name for case-insensitive lookup."""
+
+    return str(key).strip().casefold()
+
+
+class PrefixIndex:
+    """Sorted array of case-folded names, for completing a prefix with a binary search (slash
+    command autocomplete has to answer within Discord's 3 second deadline)."""
+
+    def __init__(self, names: Iterable[str] = ()):
+        """Index the given names."""
+
+        self._names: List[Tuple[str, str]] = sorted({fold(name): name for name in names}.items())
+
+    def add(self, name: str):
+        """Add a name, replacing any that's the same but for case."""
+
+        key = fold(name)
+        idx = bisect_left(self._names, (key,))
+        if idx < len(self._names) and self._names[idx][0] == key:
+            self._names[idx] = (key, name)
+        else:
+            self._names.insert(idx, (key, name))
+
+    def remove(self, name: str):
+        """Remove a name (ignoring case), if it's there."""
+
+        key = fold(name)
+        idx = bisect_left(self._names, (key,))
+        if idx < len(self._names) and self._names[idx][0] == key:
+            del self._names[idx]
+
+    def complete(self, prefix: str, limit: int = MAX_COMPLETIONS) -> List[str]:
+        """List the names starting with a prefix (ignoring case), in order. Names too long to be
+        offered as a choice in Discord are skipped."""
+
+        key = fold(prefix)
+        completions: List[str] = []
+        idx = bisect_left(self._names, (key,))
+        while idx < len(self._names) and len(completions) < limit:
+            folded, name = self._names[idx]
+            if not folded.startswith(key):
+                break
+
+            if len(name) <= MAX_COMPLETION_LENGTH:
+                completions.append(name)
+            idx += 1
+
+        return completions
+
+    def slice(self, start: int, count: int) -> List[str]:
+        """List count names in order, from the start'th."""
+
+        return [name for _, name in self._names[start:start + count]]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class GlossaryIndex:
+    """Case-folded term -> row index over the glossary (definitions) partitions. Changes are
+    also passed along to the full-text search index, if one is given."""
+
+    def __init__(self, search: Optional[SearchIndex] = None):
+        """Start with an empty index, which is not considered loaded until the first refresh."""
+
+        self._terms: Dict[str, Row] = {}
+        self._prefixes = PrefixIndex()
+        self.search = search
+        self.loaded = False
+
+    def load(self, partitions: Dict[str, Iterable[Row]]):
+        """Replace the index contents with the rows of all partitions, keyed by partition name."""
+
+        terms = {}
+        for partition, rows in partitions.items():
+            for row in rows:
+                if len(row) > 0 and str(row.get("Term", "")).strip():
+                    terms[fold(row["Term"])] = dict(row, Partition=partition)
+
+        self._terms = terms
+        self._prefixes = PrefixIndex(str(row["Term"]).strip() for row in terms.values())
+        self.loaded = True
+        if self.search is not None:
+            self.search.replace(KIND_TERM, {
+                (KIND_TERM, key): term_document(row) for key, row in terms.items()
+            })
+
+    def get(self, term: str) -> Optional[Row]:
+        """Retrieve the row defining a term, or None if it isn't defined."""
+
+        return self._terms.get(fold(term))
+
+    def put(self, partition: str, row: Row):
+        """Add or replace the row defining a term (write-through from the define command)."""
+
+        key = fold(row["Term"])
+        self._terms[key] = dict(row, Partition=partition)
+        self._prefixes.add(str(row["Term"]).strip())
+        if self.search is not None:
+            self.search.add((KIND_TERM, key), term_document(self._terms[key]))
+
+    def remove(self, term: str) -> Optional[Row]:
+        """Remove a term from the index, returning the row that defined it (if any)."""
+
+        if self.search is not None:
+            self.search.remove((KIND_TERM, fold(term)))
+
+        self._prefixes.remove(term)
+        return self._terms.pop(fold(term), None)
+
+    def terms(self) -> List[str]:
+        """List the indexed terms, as they were originally written."""
+
+        return [row["Term"] for row in self._terms.values()]
+
+    def complete(self, prefix: str, limit: int = MAX_COMPLETIONS) -> List[str]:
+        """List the terms starting with a prefix (ignoring case), for autocomplete."""
+
+        return self._prefixes.complete(prefix, limit)
+
+    def __contains__(self, term: str) -> bool:
+        return fold(term) in self._terms
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+
+class DatasetIndex:
+    """Case-folded dataset name -> entries index over all of the dataset partitions. Changes
+    are also passed along to the full-text search index, if one is given."""
+
+    def __init__(self, search: Optional[SearchIndex] = None):
+        """Start with an empty index, which is not considered loaded until the first refresh."""
+
+        self._datasets: Dict[str, List[Row]] = {}
+        self._names: Dict[str, str] = {}
+        self._prefixes = PrefixIndex()
+        self.search = search
+        self.loaded = False
+
+    def load(self, partitions: Dict[str, Iterable[Row]]):
+        """Replace the index contents with the rows of all partitions, keyed by partition name."""
+
+        datasets: Dict[str, List[Row]] = {}
+        names: Dict[str, str] = {}
+        for partition, rows in partitions.items():
+            for row in rows:
+                if len(row) > 0 and str(row.get("Dataset", "")).strip():
+                    key = fold(row["Dataset"])
+                    datasets.setdefault(key, []).append(dict(row, Partition=partition))
+                    names.setdefault(key, str(row["Dataset"]).strip())
+
+        self._datasets = datasets
+        self._names = names
+        self._prefixes = PrefixIndex(names.values())
+        self.loaded = True
+        if self.search is not None:
+            self.search.replace(KIND_DATASET, {
+                entry_id(row): entry_document(row) for rows in datasets.values() for row in rows
+            })
+
+    def add(self, partition: str, row: Row) -> bool:
+        """Add an entry to a dataset (write-through from the set-dataset command). Returns False
+        if the dataset already contains the entry's URL."""
+
+        key = fold(row["Dataset"])
+        if self.find(row["Dataset"], row["URL"]) is not None:
+            return False
+
+        entry = dict(row, Partition=partition)
+        self._datasets.setdefault(key, []).append(entry)
+        if key not in self._names:
+            self._names[key] = str(row["Dataset"]).strip()
+            self._prefixes.add(self._names[key])
+        if self.search is not None:
+            self.search.add(entry_id(entry), entry_document(entry))
+
+        return True
+
+    def find(self, dataset: str, url: str) -> Optional[Row]:
+        """Retrieve the entry for a URL within a dataset, or None if it isn't there."""
+
+        for row in self._datasets.get(fold(dataset), []):
+            if fold(row["URL"]) == fold(url):
+                return row
+
+        return None
+
+    def remove(self, dataset: str, url: str) -> Optional[Row]:
+        """Remove the entry for a URL from a dataset, returning it (if it was there)."""
+
+        key = fold(dataset)
+        row = self.find(dataset, url)
+        if row is not None:
+            self._datasets[key].remove(row)
+            if self.search is not None:
+                self.search.remove(entry_id(row))
+            if len(self._datasets[key]) < 1:
+                del self._datasets[key]
+                self._prefixes.remove(self._names.pop(key))
+
+        return row
+
+    def entries(self, dataset: str) -> List[Row]:
+        """Retrieve the entries (rows) associated with a dataset."""
+
+        return list(self._datasets.get(fold(dataset), []))
+
+    def page(self, dataset: str, start: int, count: int) -> List[Row]:
+        """Retrieve count of the entries associated with a dataset, from the start'th."""
+
+        return self._datasets.get(fold(dataset), [])[start:start + count]
+
+    def size(self, dataset: str) -> int:
+        """Count the entries associated with a dataset."""
+
+        return len(self._datasets.get(fold(dataset), []))
+
+    def datasets(self, start: int, count: int) -> List[Tuple[str, int]]:
+        """List count dataset names with their number of entries, in order of name, from the
+        start'th."""
+
+        return [(name, self.size(name)) for name in self._prefixes.slice(start, count)]
+
+    def complete(self, prefix: str, limit: int = MAX_COMPLETIONS) -> List[str]:
+        """List the dataset names starting with a prefix (ignoring case), for autocomplete."""
+
+        return self._prefixes.complete(prefix, limit)
+
+    def counts(self) -> Dict[str, int]:
+        """Retrieve the number of entries in each dataset, keyed by dataset name."""
+
+        return {self._names[key]: len(rows) for key, rows in sorted(self._datasets.items())}
+
+    def __contains__(self, dataset: str) -> bool:
+        return fold(dataset) in self._datasets
+
+    def __len__(self) -> int:
+        return len(self._datasets)
+
+
+def term_document(row: Row) -> Document:
+    """Describe a glossary row for the search index."""
+
+    return Document(KIND_TERM, str(row["Term"]), str(row.get("Definition", "")), row)
+
+
+def entry_id(row: Row) -> tuple:
+    """Identify a dataset entry (a URL within a dataset) in the search index."""
+
+    return KIND_DATASET, fold(row["Dataset"]), fold(row["URL"])
+
+
+def entry_document(row: Row) -> Document:
+    """Describe a dataset entry for the search index."""
+
+    return Document(
+        KIND_DATASET, str(row["Dataset"]).strip(),
+        f"{row.get('Description', '')} {row.get('URL', '')}", row
+    )
@@ -0,0 +1,31 @@
+"""Shared handling of slash command responses."""
+from typing import Awaitable, Union
+
+from disnake import ApplicationCommandInteraction
+
+from sosbot.pages import Pager
+
+
+async def respond(inter: ApplicationCommandInteraction, reply: Awaitable[Union[str, Pager]],
+                  slow: bool = False):
+    """Answer a slash command with the text (or pages) produced by reply. Discord only waits 3
+    seconds for a response, so if producing it may be slow (e.g. the index has to be loaded from
+    the Sheet first), the response is deferred, and the text sent as a follow-up."""
+
+    try:
+        if slow:
+            await inter.response.defer()
+
+        response = await reply
+        if isinstance(response, Pager):
+            await response.respond(inter)
+        else:
+            await inter.send(response)
+    # pylint: disable=broad-except
+    except Exception as error:
+        print(error)
+        try:
+            await inter.send("Sorry, an error has occurred.")
+        # pylint: disable=broad-except
+        except Exception as safe_error:
+            print(safe_error)
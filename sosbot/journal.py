@@ -0,0 +1,394 @@
+"""Write-behind support for Sheet updates.
+
+Commands record their writes in a local, append-only journal and acknowledge the user right away.
+A background flusher then coalesces the pending writes for each worksheet into a single
+batch_update call. Anything not yet flushed when the bot stops is replayed on the next start.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_right
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from disnake.ext import tasks
+
+from sosbot.index import fold
+from sosbot.scheduler import priority, PRIORITY_WRITE
+from sosbot.sheets import SheetsAccess
+
+if TYPE_CHECKING:
+    import gspread
+
+DEFAULT_FLUSH_INTERVAL = 10.0
+KEY_COLUMN_TTL = 300.0
+
+OP_APPEND = "append"
+OP_DELETE = "delete"
+
+Entry = Dict[str, Any]
+Key = Tuple[str, ...]
+
+
+class WriteJournal:
+    """Durable, append-only log of pending Sheet writes, stored as one JSON object per line."""
+
+    def __init__(self, path: str):
+        """Open (or create) the journal file, and load any entries that were never flushed."""
+
+        self.path = path
+        self._pending: Dict[int, Entry] = {}
+        self._next_seq = 1
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        if os.path.exists(path):
+            self._replay()
+
+    def append(self, spreadsheet_id: str, worksheet: str, operation: str,
+               values: Optional[List[Any]] = None,
+               match: Optional[Dict[str, str]] = None) -> Entry:
+        """Durably record a pending write. Appends carry the row values; deletes carry a map of
+        column header -> value identifying the row to remove."""
+
+        entry = {
+            "seq": self._next_seq,
+            "spreadsheet": spreadsheet_id,
+            "worksheet": worksheet,
+            "op": operation,
+            "values": values,
+            "match": match,
+        }
+        self._next_seq += 1
+
+        self._write(entry)
+        self._pending[entry["seq"]] = entry
+        return entry
+
+    def pending(self, spreadsheet_id: Optional[str] = None) -> List[Entry]:
+        """List the entries which haven't been flushed yet, in the order they were written."""
+
+        return [
+            entry for _, entry in sorted(self._pending.items())
+            if spreadsheet_id is None or entry["spreadsheet"] == spreadsheet_id
+        ]
+
+    def commit(self, seqs: List[int]):
+        """Mark entries as flushed. Once nothing is pending, the journal file is truncated."""
+
+        for seq in seqs:
+            self._pending.pop(seq, None)
+
+        if len(self._pending) < 1:
+            with open(self.path, 'w', encoding="utf-8") as journal:
+                journal.flush()
+                os.fsync(journal.fileno())
+        elif len(seqs) > 0:
+            self._write({"flushed": list(seqs)})
+
+    def _write(self, record: dict):
+        """Append one record to the journal file, and make sure it reaches the disk."""
+
+        with open(self.path, 'a', encoding="utf-8") as journal:
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _replay(self):
+        """Rebuild the pending set from the journal file. A torn final line (from a crash
+        mid-write) is ignored."""
+
+        with open(self.path, 'r', encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                if "seq" in record:
+                    self._pending[record["seq"]] = record
+                    self._next_seq = max(self._next_seq, record["seq"] + 1)
+                else:
+                    for seq in record.get("flushed", []):
+                        self._pending.pop(seq, None)
+
+
+class WriteBehind:
+    """Flush the pending writes recorded in a WriteJournal to Google Sheets in the background."""
+
+    def __init__(self, journal: WriteJournal, sheets: SheetsAccess,
+                 interval: float = DEFAULT_FLUSH_INTERVAL, key_column_ttl: float = KEY_COLUMN_TTL):
+        """Setup the flusher task, which isn't started until start() is called. When other
+        processes write to the same spreadsheets, key_column_ttl should be 0, so the key
+        columns are read afresh on every flush."""
+
+        self.journal = journal
+        self.sheets = sheets
+        self.key_column_ttl = key_column_ttl
+        self._key_columns: Dict[Tuple[str, str], Tuple[float, int, List[Key]]] = {}
+        self._key_counts: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._flusher = tasks.loop(seconds=interval)(self.flush)
+
+    def start(self):
+        """Start the background flusher, if it isn't already running. Any entries left over
+        from a previous run are flushed on its first pass."""
+
+        if not self._flusher.is_running():
+            self._flusher.start()
+
+    def stop(self):
+        """Stop the background flusher."""
+
+        self._flusher.cancel()
+
+    def set_key_columns(self, spreadsheet_id: str, count: int):
+        """Declare how many leading columns identify a row in the spreadsheet's worksheets (one,
+        unless declared). A queued row matching one already in its worksheet on those columns
+        (case-insensitively) is dropped when flushed, once a fresh read of them confirms it."""
+
+        self._key_counts[spreadsheet_id] = count
+
+    def queued(self, spreadsheet_id: str, worksheet: str, values: List[Any]) -> bool:
+        """Check whether a row matching the given one on its key columns (case-insensitively)
+        is queued for a worksheet, and not cancelled by a queued delete. This only looks at the
+        journal, so it answers right away, whether or not Google can be reached."""
+
+        width = self._key_counts.get(spreadsheet_id, 1)
+        key = row_key(values, width)
+        appends, _ = coalesce([
+            entry for entry in self.journal.pending(spreadsheet_id)
+            if entry["worksheet"] == worksheet
+        ])
+        return any(row_key(row, width) == key for row in appends)
+
+    def append(self, spreadsheet_id: str, worksheet: str, values: List[Any]) -> Entry:
+        """Queue a new row to be added to a worksheet."""
+
+        return self.journal.append(spreadsheet_id, worksheet, OP_APPEND, values=values)
+
+    def delete(self, spreadsheet_id: str, worksheet: str, match: Dict[str, str]) -> Entry:
+        """Queue the removal of the first row whose columns match the given values
+        (case-insensitively)."""
+
+        return self.journal.append(spreadsheet_id, worksheet, OP_DELETE, match=match)
+
+    def pending(self, spreadsheet_id: Optional[str] = None) -> List[Entry]:
+        """List the writes which haven't reached the Sheet yet."""
+
+        return self.journal.pending(spreadsheet_id)
+
+    def reroute(self, spreadsheet_id: str, route: Callable[[str], str]) -> int:
+        """Move the pending writes whose worksheet no longer holds their key (after a partition
+        split) to the one that does, keeping their order. Returns how many were moved."""
+
+        moved = 0
+        for entry in self.journal.pending(spreadsheet_id):
+            key = entry["values"][0] if entry["op"] == OP_APPEND \
+                else next(iter(entry["match"].values()))
+            worksheet = route(key)
+            if worksheet != entry["worksheet"]:
+                self.journal.append(spreadsheet_id, worksheet, entry["op"],
+                                    values=entry["values"], match=entry["match"])
+                self.journal.commit([entry["seq"]])
+                moved += 1
+
+        return moved
+
+    async def flush(self):
+        """Send all pending writes to Google, using one batch_update per worksheet. Worksheets
+        whose update fails stay pending, and are retried on the next pass."""
+
+        async with self._lock:
+            await self._flush_pending()
+
+    async def drained(self, spreadsheet_id: str, operation: Callable[[], Awaitable[Any]]) -> Any:
+        """Flush the pending writes, then run an operation that moves rows between a
+        spreadsheet's worksheets, with no flush in progress to have its row positions shifted.
+        The cached key columns of the spreadsheet's worksheets are dropped afterwards."""
+
+        async with self._lock:
+            await self._flush_pending()
+            try:
+                return await operation()
+            finally:
+                for key in [key for key in self._key_columns if key[0] == spreadsheet_id]:
+                    del self._key_columns[key]
+
+    async def _flush_pending(self):
+        """Flush every pending write, one worksheet at a time (with the flush lock held)."""
+
+        groups: Dict[Tuple[str, str], List[Entry]] = {}
+        for entry in self.journal.pending():
+            groups.setdefault((entry["spreadsheet"], entry["worksheet"]), []).append(entry)
+
+        for (spreadsheet_id, title), entries in groups.items():
+            try:
+                # the reads done while flushing wait behind interactive reads, like the writes
+                with priority(PRIORITY_WRITE):
+                    await self._flush_worksheet(spreadsheet_id, title, entries)
+                self.journal.commit([entry["seq"] for entry in entries])
+            # pylint: disable=broad-except
+            except Exception as error:
+                # we can't tell how much of the worksheet changed, so re-read its keys next time
+                # (a stale worksheet handle has already been dropped by SheetsAccess)
+                self._key_columns.pop((spreadsheet_id, title), None)
+                print(f"Failed to flush {len(entries)} writes to {title}: {error}")
+
+    # pylint: disable=too-many-locals
+    async def _flush_worksheet(self, spreadsheet_id: str, title: str, entries: List[Entry]):
+        """Coalesce the pending writes for one worksheet and apply them in a single call."""
+
+        appends, deletes = coalesce(entries)
+        if len(appends) < 1 and len(deletes) < 1:
+            return
+
+        sheet = await self.sheets.worksheet(spreadsheet_id, title)
+        width = max([self._key_counts.get(spreadsheet_id, 1)] + [len(match) for match in deletes])
+        requests = []
+
+        if len(deletes) > 0:
+            # only the key columns are needed to find the rows, not the rest of each one
+            if self.key_column_ttl <= 0:
+                self.sheets.forget(spreadsheet_id)
+            values = await self.sheets.get_columns(sheet, width)
+            keys = [row_key(row, width) for row in values[1:]]
+            rows = locate_rows(values, deletes)
+            # delete bottom-up, so earlier deletions don't shift the later row indexes
+            for row in sorted(rows, reverse=True):
+                requests.append({"deleteDimension": {"range": {
+                    "sheetId": sheet.id, "dimension": "ROWS",
+                    "startIndex": row, "endIndex": row + 1,
+                }}})
+                del keys[row - 1]
+        else:
+            keys = await self._key_rows(spreadsheet_id, sheet, width)
+            if self.key_column_ttl > 0 and \
+                    not set(keys).isdisjoint(row_key(values, width) for values in appends):
+                # only drop a write for duplicating a row that's there now, not one cached
+                keys = await self._key_rows(spreadsheet_id, sheet, width, fresh=True)
+
+        # the worksheet is kept sorted by its first column, so each new row can go straight into
+        # its place instead of being appended and then re-sorting the whole worksheet
+        firsts = [key[0] for key in keys]
+        existing = set(keys)
+        for values in appends:
+            key = row_key(values, width)
+            if key in existing:
+                print(f"Dropped a write duplicating a row already in {title}: {values[:width]}")
+                continue
+
+            existing.add(key)
+            position = bisect_right(firsts, key[0])
+            firsts.insert(position, key[0])
+            keys.insert(position, key)
+            requests.append({"insertDimension": {"range": {
+                "sheetId": sheet.id, "dimension": "ROWS",
+                "startIndex": position + 1, "endIndex": position + 2,
+            }}})
+            requests.append({"updateCells": {
+                "start": {"sheetId": sheet.id, "rowIndex": position + 1, "columnIndex": 0},
+                "rows": [{"values": [cell(value) for value in values]}],
+                "fields": "userEnteredValue",
+            }})
+
+        if len(requests) > 0:
+            await self.sheets.batch_update(sheet, requests)
+
+        self._key_columns[(spreadsheet_id, title)] = (time.monotonic(), width, keys)
+
+    async def _key_rows(self, spreadsheet_id: str, sheet: gspread.Worksheet, width: int,
+                        fresh: bool = False) -> List[Key]:
+        """Retrieve the case-folded key columns of each row of a worksheet (excluding the
+        header), in sheet order. This is cached between flushes, and re-read once it's older
+        than key_column_ttl (or covers a different number of columns), or when a fresh read
+        is asked for."""
+
+        if not fresh and self.key_column_ttl > 0:
+            cached = self._key_columns.get((spreadsheet_id, sheet.title))
+            hit = cached is not None and time.monotonic() - cached[0] < self.key_column_ttl \
+                and cached[1] == width
+            self.sheets.metrics.cache("key_column", hit)
+            if hit:
+                return list(cached[2])
+        else:
+            self.sheets.forget(spreadsheet_id)
+
+        return [row_key(row, width) for row in (await self.sheets.get_columns(sheet, width))[1:]]
+
+
+def row_key(row: List[Any], width: int) -> Key:
+    """Case-fold the first width columns of a row, the ones identifying it."""
+
+    return tuple(fold(row[idx]) if idx < len(row) else "" for idx in range(width))
+
+
+def coalesce(entries: List[Entry]) -> Tuple[List[List[Any]], List[Dict[str, str]]]:
+    """Reduce a worksheet's pending entries to the rows to append and the rows to delete. A
+    delete that matches a row appended earlier in the same batch cancels that append, so
+    neither call reaches the Sheet."""
+
+    appends: List[List[Any]] = []
+    deletes: List[Dict[str, str]] = []
+    for entry in entries:
+        if entry["op"] == OP_APPEND:
+            appends.append(entry["values"])
+        elif entry["op"] == OP_DELETE:
+            cancelled = False
+            for idx, values in enumerate(appends):
+                if matches_values(values, entry["match"]):
+                    del appends[idx]
+                    cancelled = True
+                    break
+
+            if not cancelled:
+                deletes.append(entry["match"])
+
+    return appends, deletes
+
+
+def matches_values(values: List[Any], match: Dict[str, str]) -> bool:
+    """Check whether a pending append matches a delete. Deletes list their columns in sheet
+    order, starting from the first column."""
+
+    return all(
+        idx < len(values) and fold(values[idx]) == fold(expected)
+        for idx, expected in enumerate(match.values())
+    )
+
+
+def locate_rows(values: List[List[Any]], deletes: List[Dict[str, str]]) -> List[int]:
+    """Find the (0-based, header included) indexes of the rows to delete in a worksheet's
+    values. Each delete removes at most one row, and deletes that match nothing are dropped, as
+    are those naming a column the values don't have (with a warning)."""
+
+    if len(values) < 1:
+        return []
+
+    header = values[0]
+    found = set()
+    for match in deletes:
+        missing = [name for name in match if name not in header]
+        if len(missing) > 0:
+            print(f"Dropped a delete matching on columns not found ({', '.join(missing)}): "
+                  f"{match}")
+            continue
+
+        columns = [(header.index(name), fold(value)) for name, value in match.items()]
+        for idx, row in enumerate(values[1:], start=1):
+            if idx not in found and all(
+                    col < len(row) and fold(row[col]) == value for col, value in columns
+            ):
+                found.add(idx)
+                break
+
+    return list(found)
+
+
+def cell(value: Any) -> dict:
+    """Format a value as a CellData object for the Sheets batchUpdate API."""
+
+    return {"userEnteredValue": {"stringValue": str(value)}}
@@ -0,0 +1,283 @@
+"""In-process metrics: command latency, Google and Discord API calls, rate limiting and caches.
+
+Counters and latency histograms are kept in memory, labelled the way Prometheus expects, and can
+be served in its text format from a small local HTTP endpoint (MetricsServer) or summarized in
+Discord with !stats.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+from disnake.errors import HTTPException
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+COMMAND_SECONDS = "sosbot_command_seconds"
+GOOGLE_CALLS = "sosbot_google_calls_total"
+GOOGLE_SECONDS = "sosbot_google_call_seconds"
+DISCORD_REQUESTS = "sosbot_discord_requests_total"
+DISCORD_SECONDS = "sosbot_discord_request_seconds"
+RATE_LIMITED = "sosbot_rate_limited_total"
+CACHE_REQUESTS = "sosbot_cache_requests_total"
+
+HELP = {
+    COMMAND_SECONDS: "Time taken to handle each bot command.",
+    GOOGLE_CALLS: "Google API call attempts, by call and outcome.",
+    GOOGLE_SECONDS: "Time taken by each Google API call attempt.",
+    DISCORD_REQUESTS: "Discord REST requests, by route and outcome.",
+    DISCORD_SECONDS: "Time taken by each Discord REST request (including rate limit waits).",
+    RATE_LIMITED: "Responses telling us we hit a rate limit (HTTP 429).",
+    CACHE_REQUESTS: "Cache lookups, by cache and whether they hit.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus represents them."""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        """Setup an empty histogram with the given bucket upper bounds."""
+
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Record one measurement."""
+
+        self.count += 1
+        self.sum += value
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+
+    def quantile(self, fraction: float) -> float:
+        """Estimate a quantile, as the upper bound of the bucket it falls in (infinity if it's
+        past the last bucket)."""
+
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+
+        return float("inf")
+
+
+class Metrics:
+    """Registry of labelled counters and histograms, safe to update from worker threads."""
+
+    def __init__(self):
+        """Start with nothing recorded."""
+
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._gauges: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+
+    def count(self, name: str, amount: float = 1, **labels: str):
+        """Add to a counter."""
+
+        key = labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        """Record a measurement in a histogram."""
+
+        key = labels_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def cache(self, cache: str, hit: bool):
+        """Record a cache lookup."""
+
+        self.count(CACHE_REQUESTS, cache=cache, result="hit" if hit else "miss")
+
+    def gauge(self, name: str, read: Callable[[], Dict[Labels, float]]):
+        """Register a value that's read when metrics are exported, rather than recorded."""
+
+        self._gauges[name] = read
+
+    def counters(self, name: str) -> Dict[Labels, float]:
+        """Retrieve a copy of a counter's values, by labels."""
+
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def histograms(self, name: str) -> Dict[Labels, Histogram]:
+        """Retrieve a histogram's series, by labels."""
+
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def total(self, name: str, **labels: str) -> float:
+        """Sum a counter over every series whose labels include the given ones."""
+
+        wanted = set(labels.items())
+        return sum(value for key, value in self.counters(name).items() if wanted <= set(key))
+
+    def hit_ratios(self) -> Dict[str, Tuple[float, float]]:
+        """Retrieve the (hits, lookups) of each cache."""
+
+        ratios: Dict[str, Tuple[float, float]] = {}
+        for key, value in self.counters(CACHE_REQUESTS).items():
+            labels = dict(key)
+            hits, lookups = ratios.get(labels["cache"], (0, 0))
+            ratios[labels["cache"]] = (
+                hits + (value if labels["result"] == "hit" else 0), lookups + value)
+
+        return ratios
+
+    def render(self) -> str:
+        """Export everything in the Prometheus text format."""
+
+        lines: List[str] = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+
+        for name, series in sorted(counters.items()):
+            lines += header(name, "counter")
+            lines += [
+                f"{name}{format_labels(key)} {value}" for key, value in sorted(series.items())
+            ]
+
+        for name, series in sorted(histograms.items()):
+            lines += header(name, "histogram")
+            for key, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{format_labels(key + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} "
+                             f"{histogram.count}")
+                lines.append(f"{name}_sum{format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+
+        for name, read in sorted(self._gauges.items()):
+            lines += header(name, "gauge")
+            lines += [f"{name}{format_labels(key)} {value}" for key, value in read().items()]
+
+        return "\n".join(lines) + "\n"
+
+
+class RateLimitCounter(logging.Handler):
+    """Count the 429s disnake handles (and retries) internally, which it only reports by
+    logging them."""
+
+    def __init__(self, metrics: Metrics):
+        """Setup the handler; attach it to the disnake.http logger."""
+
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord):
+        """Count rate limit warnings."""
+
+        if "rate limit" in str(record.msg):
+            self.metrics.count(RATE_LIMITED, api="discord")
+
+
+def instrument_http(http, metrics: Metrics):
+    """Wrap a disnake HTTPClient's request method to count and time every REST call."""
+
+    request = http.request
+
+    async def instrumented(route, **kwargs):
+        status = "ok"
+        started = time.monotonic()
+        try:
+            return await request(route, **kwargs)
+        except HTTPException as error:
+            status = str(error.status)
+            raise
+        finally:
+            metrics.count(DISCORD_REQUESTS, method=route.method, route=route.path, status=status)
+            metrics.observe(DISCORD_SECONDS, time.monotonic() - started,
+                            method=route.method, route=route.path)
+
+    http.request = instrumented
+    logging.getLogger("disnake.http").addHandler(RateLimitCounter(metrics))
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving metrics in the Prometheus text format at /metrics."""
+
+    def __init__(self, metrics: Metrics, host: str = DEFAULT_METRICS_HOST, port: int = 9090):
+        """Setup the endpoint; it starts listening on start()."""
+
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        """Start listening."""
+
+        # Only imported when the endpoint is enabled, since it isn't needed otherwise.
+        # pylint: disable=import-outside-toplevel
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._serve)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """Stop listening."""
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _serve(self, _request: web.Request) -> web.Response:
+        """Render the metrics."""
+
+        # pylint: disable=import-outside-toplevel
+        from aiohttp import web
+
+        return web.Response(text=self.metrics.render(), content_type="text/plain")
+
+
+def labels_key(labels: Dict[str, str]) -> Labels:
+    """Turn labels into a hashable, ordered key."""
+
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: Labels) -> str:
+    """Format labels the way Prometheus expects them."""
+
+    if len(key) < 1:
+        return ""
+
+    escaped = [
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in key
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def header(name: str, kind: str) -> List[str]:
+    """Format the HELP and TYPE lines for a metric."""
+
+    return [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} {kind}"]
@@ -0,0 +1,160 @@
+"""Paginated embed responses, for lists too long to fit in one Discord message.
+
+Only the page being shown is ever rendered: a Pager holds a cursor (the page number) and reads
+that page's rows from the in-memory index when a button is clicked, so a dataset with thousands of
+links costs one page of formatting per click, however large it is. Pagers stop responding (and
+their buttons are removed) once they've been idle for a while. Short lists, like search results,
+are sent as plain messages instead, cut down by fit_lines() to Discord's message length limit.
+"""
+from typing import Any, Callable, List, Optional
+
+from disnake import ApplicationCommandInteraction, ButtonStyle, Embed, Message, MessageInteraction
+from disnake.errors import HTTPException
+from disnake.ui import Button, View, button
+
+PAGE_SIZE = 10
+VIEW_TIMEOUT = 300.0
+MAX_DESCRIPTION = 4096
+MAX_MESSAGE = 2000
+
+
+# pylint: disable=too-many-instance-attributes
+class Pager(View):
+    """Embed showing one page of a list at a time, with buttons to move between pages."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, title: str, total: Callable[[], int],
+                 fetch: Callable[[int, int], List[Any]], render: Callable[[Any], str], *,
+                 separator: str = "\n", footer: str = "", owner_id: Optional[int] = None,
+                 per_page: int = PAGE_SIZE, timeout: float = VIEW_TIMEOUT):
+        """Setup the pager on its first page. total() counts the rows, fetch(start, count)
+        reads a page of them, and render() formats each one. Only the owner (if given) may turn
+        the pages."""
+
+        super().__init__(timeout=timeout)
+        self.title = title
+        self.total = total
+        self.fetch = fetch
+        self.render = render
+        self.separator = separator
+        self.footer = footer
+        self.owner_id = owner_id
+        self.per_page = per_page
+        self.page = 0
+        self.message: Optional[Message] = None
+
+    @property
+    def pages(self) -> int:
+        """Count the pages, as of now (the rows may change while the pager is open)."""
+
+        return max(1, -(-self.total() // self.per_page))
+
+    def embed(self) -> Embed:
+        """Render the current page."""
+
+        self.page = min(self.page, self.pages - 1)
+        rows = self.fetch(self.page * self.per_page, self.per_page)
+        description = self.separator.join(self.render(row) for row in rows)
+        if len(description) > MAX_DESCRIPTION:
+            description = description[:MAX_DESCRIPTION - 3].rstrip() + "..."
+
+        footer = f"Page {self.page + 1} of {self.pages} ({self.total()} in all)"
+        embed = Embed(title=self.title, description=description)
+        embed.set_footer(text=f"{footer}. {self.footer}" if self.footer else footer)
+        return embed
+
+    async def reply(self, message: Message):
+        """Reply to a message with the first page (and buttons, if there's more than one)."""
+
+        self.message = await message.reply(**self._contents())
+
+    async def respond(self, inter: ApplicationCommandInteraction):
+        """Answer a slash command with the first page (and buttons, if there's more than one)."""
+
+        await inter.send(**self._contents())
+        self.message = await inter.original_response()
+
+    async def interaction_check(self, interaction: MessageInteraction) -> bool:
+        """Only let the person who asked turn the pages."""
+
+        if self.owner_id is None or interaction.author.id == self.owner_id:
+            return True
+
+        await interaction.response.send_message(
+            "Only the person who asked can turn these pages.", ephemeral=True)
+        return False
+
+    async def on_timeout(self):
+        """Remove the buttons once the pager expires."""
+
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except HTTPException as error:
+                print(f"Couldn't remove expired page buttons: {error}")
+
+    @button(label="Previous", style=ButtonStyle.secondary)
+    async def previous_page(self, _button: Button, interaction: MessageInteraction):
+        """Show the previous page."""
+
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @button(label="Next", style=ButtonStyle.secondary)
+    async def next_page(self, _button: Button, interaction: MessageInteraction):
+        """Show the next page."""
+
+        self.page = min(self.pages - 1, self.page + 1)
+        await self._show(interaction)
+
+    async def _show(self, interaction: MessageInteraction):
+        """Replace the page shown in the message the buttons belong to."""
+
+        embed = self.embed()
+        self._update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    def _update_buttons(self):
+        """Disable the buttons that would go past the first or last page."""
+
+        self.previous_page.disabled = self.page < 1
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    def _contents(self) -> dict:
+        """Render the first page, with buttons only if there's more than one."""
+
+        contents: dict = {"embed": self.embed()}
+        if self.pages > 1:
+            self._update_buttons()
+            contents["view"] = self
+        else:
+            self.stop()
+
+        return contents
+
+
+def fit_lines(header: str, lines: List[str], footer: str, limit: int = MAX_MESSAGE) -> str:
+    """Build a message from a header, as many of the lines as fit in limit characters, and a
+    footer, noting how many lines were left out. The header is shortened if it's long (it may
+    quote what someone typed), and so is the first line if not even it fits whole."""
+
+    if len(header) > limit // 4:
+        header = header[:limit // 4 - 3].rstrip() + "..."
+
+    omitted = f"...and {len(lines)} more"
+    room = limit - len(header) - len(footer) - len(omitted) - 5
+    kept: List[str] = []
+    for line in lines:
+        if len(line) + 1 > room:
+            if len(kept) < 1:
+                kept.append(line[:max(0, room - 3)].rstrip() + "...")
+            break
+
+        kept.append(line)
+        room -= len(line) + 1
+
+    body = "\n".join(kept)
+    if len(kept) < len(lines):
+        body += f"\n...and {len(lines) - len(kept)} more"
+
+    return f"{header}\n\n{body}\n\n{footer}"
@@ -0,0 +1,322 @@
+"""Route glossary and dataset rows to worksheets (partitions) by key range.
+
+Each spreadsheet keeps its partition map in a worksheet of its own: one row per partition, giving
+the worksheet's title and the lowest (case-folded) key it holds. A key belongs to the partition
+with the greatest start at or before it, so any key has a home, whether it starts with a letter, a
+digit or something else entirely. A spreadsheet without a map is given one matching the original
+first-letter split (A-E, F-J, K-O, P-T and U-Z), so existing worksheets keep their rows.
+
+Once a partition has grown past the configured number of rows it's split: the rows beyond a key
+boundary are copied to new worksheets, each left about half full, and deleted from the old one,
+and the map gains their starts. A split is a single batchUpdate (adding the worksheets, moving the
+rows and extending the map together), so readers see either the old layout or the new one. Rows
+are only ever deleted by the keys read just before, never rewritten by position, and the split is
+abandoned if the spreadsheet changed meanwhile (e.g. someone edited it by hand). Only a bot
+running every shard splits partitions: processes sharing a spreadsheet would keep writing to the
+old partitions until they next read the map.
+"""
+import random
+import re
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sosbot.index import fold
+from sosbot.journal import cell
+from sosbot.scheduler import is_api_error
+from sosbot.sheets import SheetsAccess
+
+PARTITIONS_SHEET = "Partitions"
+PARTITION_COLUMNS = ("Partition", "Starts At")
+DEFAULT_PARTITIONS = (("A-E", ""), ("F-J", "f"), ("K-O", "k"), ("P-T", "p"), ("U-Z", "u"))
+DEFAULT_MAX_PARTITION_ROWS = 5000
+
+MAX_SHEET_ID = 2 ** 31 - 1
+TITLE_LABEL = 3
+TITLE_UNSAFE = re.compile(r"[\[\]:*?/\\'\s]")
+
+Row = Dict[str, Any]
+
+
+class PartitionMap:
+    """Sorted partition starts, routing each key to the partition whose range holds it."""
+
+    def __init__(self, partitions: Iterable[Tuple[str, str]] = DEFAULT_PARTITIONS):
+        """Setup the map from (title, start) pairs, in any order."""
+
+        ordered = sorted((fold(start), title) for title, start in partitions)
+        self._starts = [start for start, _ in ordered]
+        self._titles = [title for _, title in ordered]
+
+    @classmethod
+    def from_records(cls, records: Iterable[Row]) -> "PartitionMap":
+        """Read a map from the rows of its worksheet, falling back to the default if it's empty.
+        """
+
+        partitions = [
+            (str(record.get("Partition", "")).strip(), str(record.get("Starts At", "")))
+            for record in records
+        ]
+        return cls([partition for partition in partitions if partition[0]] or DEFAULT_PARTITIONS)
+
+    @property
+    def titles(self) -> List[str]:
+        """List the partitions' worksheet titles, in key order."""
+
+        return list(self._titles)
+
+    def partitions(self) -> List[Tuple[str, str]]:
+        """List the (title, start) pairs, in key order."""
+
+        return list(zip(self._titles, self._starts))
+
+    def route(self, key: str) -> str:
+        """Pick the partition holding a key. Keys before the first start go in the first one."""
+
+        return self._titles[max(0, bisect_right(self._starts, fold(key)) - 1)]
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+
+class Partitions:
+    """The partition map of one spreadsheet, kept in step with the worksheet it's stored in."""
+
+    def __init__(self, sheets: SheetsAccess, spreadsheet_id: str,
+                 max_rows: int = DEFAULT_MAX_PARTITION_ROWS):
+        """Start from the default map, until the spreadsheet's own is read. Partitions are only
+        split when max_rows is above zero."""
+
+        self.sheets = sheets
+        self.spreadsheet_id = spreadsheet_id
+        self.max_rows = max_rows
+        self.map = PartitionMap()
+        self.stored = False
+
+    def route(self, key: str) -> str:
+        """Pick the partition holding a key."""
+
+        return self.map.route(key)
+
+    def worksheets(self) -> List[str]:
+        """List the worksheets to read: the map (once it's known to be stored) and every
+        partition."""
+
+        return ([PARTITIONS_SHEET] if self.stored else []) + self.map.titles
+
+    async def ensure(self, store: bool = True):
+        """Read the spreadsheet's map, or if it doesn't have one, store the default (unless told
+        not to, in which case the default is just used). This costs a metadata call and a read
+        the first time, and nothing after: from then on, the map is read along with the
+        partitions."""
+
+        if self.stored:
+            return
+
+        worksheets = await self.sheets.worksheets(self.spreadsheet_id)
+        if PARTITIONS_SHEET not in worksheets:
+            if not store:
+                return
+
+            try:
+                await self.sheets.update_spreadsheet(
+                    self.spreadsheet_id,
+                    add_sheet(new_sheet_id(worksheets), PARTITIONS_SHEET,
+                              [list(PARTITION_COLUMNS)] + map_rows(self.map.partitions())))
+                print(f"Stored the partition map of {self.spreadsheet_id}.")
+                self.stored = True
+                return
+            except Exception as error:
+                # another process sharing the spreadsheet may have just stored one
+                if not is_api_error(error):
+                    raise
+
+                self.sheets.invalidate(self.spreadsheet_id)
+                if PARTITIONS_SHEET not in await self.sheets.worksheets(self.spreadsheet_id):
+                    raise
+
+        records = await self.sheets.batch_get_records(self.spreadsheet_id, [PARTITIONS_SHEET])
+        self.map = PartitionMap.from_records(records.get(PARTITIONS_SHEET, []))
+        self.stored = True
+
+    def load(self, partitions: Dict[str, List[Row]]) -> Dict[str, List[Row]]:
+        """Adopt the map read along with the partitions (picking up splits made elsewhere),
+        returning the partitions themselves."""
+
+        partitions = dict(partitions)
+        records = partitions.pop(PARTITIONS_SHEET, None)
+        if records is not None:
+            self.map = PartitionMap.from_records(records)
+
+        return partitions
+
+    def oversized(self, partitions: Dict[str, List[Row]]) -> List[str]:
+        """List the partitions holding more than max_rows rows (none, if splitting is off)."""
+
+        if self.max_rows < 1:
+            return []
+
+        return [
+            title for title in self.map.titles if len(partitions.get(title, [])) > self.max_rows
+        ]
+
+    # pylint: disable=too-many-locals
+    async def rebalance(self, titles: Iterable[str]) -> List[str]:
+        """Split the given partitions, each into pieces of about half of max_rows, so they all
+        have room to grow. Each partition is re-read first, and the split is applied (along with
+        the new map entries) in one batchUpdate, unless the spreadsheet's modifiedTime shows it
+        changed after it was read. Returns the titles of the new partitions."""
+
+        titles = list(titles)
+        if len(titles) < 1 or self.max_rows < 1:
+            return []
+
+        await self.ensure()
+        worksheets = await self.sheets.worksheets(self.spreadsheet_id)
+        self.sheets.forget(self.spreadsheet_id)
+        modified = await self.sheets.modified_time(self.spreadsheet_id)
+        taken = set(worksheets)
+        partitions = self.map.partitions()
+        requests: List[dict] = []
+        added: List[Tuple[str, str]] = []
+        for title in titles:
+            sheet = worksheets[title]
+            values = await self.sheets.get_all_values(sheet)
+            rows = [row for row in values[1:] if any(str(value).strip() for value in row)]
+            pieces = split_rows(rows, self.max_rows) if len(rows) > self.max_rows else []
+            if len(pieces) < 2:
+                continue
+
+            # the first piece stays put; the rest are copied to new worksheets...
+            for start, piece in pieces[1:]:
+                new_title = piece_title(piece, taken)
+                taken.add(new_title)
+                requests.extend(add_sheet(new_sheet_id(worksheets, requests), new_title,
+                                          [values[0]] + piece))
+                added.append((new_title, start))
+
+            # ...and deleted from this one, wherever they are in it
+            boundary = pieces[1][0]
+            requests.extend(delete_rows(sheet.id, [
+                idx for idx, row in enumerate(values[1:], start=1)
+                if len(row) > 0 and fold(row[0]) >= boundary
+            ]))
+
+            print(f"Splitting partition {title} ({len(rows)} rows) into {len(pieces)}.")
+
+        if len(added) < 1:
+            return []
+
+        self.sheets.forget(self.spreadsheet_id)
+        if await self.sheets.modified_time(self.spreadsheet_id) != modified:
+            print(f"Not splitting partitions of {self.spreadsheet_id}: it changed while they "
+                  f"were read. Trying again at the next refresh.")
+            return []
+
+        requests.append(append_rows(worksheets[PARTITIONS_SHEET].id, map_rows(added)))
+        await self.sheets.update_spreadsheet(self.spreadsheet_id, requests)
+        self.map = PartitionMap(partitions + added)
+        return [title for title, _ in added]
+
+
+def split_rows(rows: List[List[Any]], max_rows: int) -> List[Tuple[str, List[List[Any]]]]:
+    """Cut a partition's rows, in key order, into evenly sized pieces of at most about half of
+    max_rows, only ever cutting between different keys (so all the rows for a key stay
+    together). Returns each piece's first key, with its rows."""
+
+    def key(row: List[Any]) -> str:
+        return fold(row[0]) if len(row) > 0 else ""
+
+    ordered = sorted(rows, key=key)
+    count = -(-len(ordered) // max(1, max_rows // 2))
+    size = max(1, -(-len(ordered) // max(1, count)))
+    pieces: List[Tuple[str, List[List[Any]]]] = []
+    start = 0
+    while start < len(ordered):
+        end = min(start + size, len(ordered))
+        while end < len(ordered) and key(ordered[end]) == key(ordered[end - 1]):
+            end += 1
+
+        pieces.append((key(ordered[start]), ordered[start:end]))
+        start = end
+
+    return pieces
+
+
+def piece_title(rows: List[List[Any]], taken: Set[str]) -> str:
+    """Name a new partition after the range of keys it starts with, e.g. 'SAL-SMI', adding a
+    number if that's taken."""
+
+    def label(row: List[Any]) -> str:
+        return TITLE_UNSAFE.sub("", str(row[0]).upper())[:TITLE_LABEL] if len(row) > 0 else ""
+
+    title = "-".join(part for part in (label(rows[0]), label(rows[-1])) if part) or "Partition"
+    candidate = title
+    suffix = 2
+    while candidate in taken:
+        candidate = f"{title} {suffix}"
+        suffix += 1
+
+    return candidate
+
+
+def new_sheet_id(worksheets: Dict[str, Any], requests: Optional[List[dict]] = None) -> int:
+    """Pick an id for a new worksheet, unused by the existing ones and those about to be added.
+    """
+
+    used = {sheet.id for sheet in worksheets.values()} | {
+        request["addSheet"]["properties"]["sheetId"]
+        for request in requests or [] if "addSheet" in request
+    }
+    sheet_id = random.randint(1, MAX_SHEET_ID)
+    while sheet_id in used:
+        sheet_id = random.randint(1, MAX_SHEET_ID)
+
+    return sheet_id
+
+
+def add_sheet(sheet_id: int, title: str, values: List[List[Any]]) -> List[dict]:
+    """Build the batchUpdate requests adding a worksheet with the given values (header first).
+    """
+
+    return [
+        {"addSheet": {"properties": {
+            "sheetId": sheet_id, "title": title, "gridProperties": {"frozenRowCount": 1},
+        }}},
+        append_rows(sheet_id, values),
+    ]
+
+
+def append_rows(sheet_id: int, values: List[List[Any]]) -> dict:
+    """Build the batchUpdate request adding rows after the last one in a worksheet."""
+
+    return {"appendCells": {
+        "sheetId": sheet_id,
+        "rows": [{"values": [cell(value) for value in row]} for row in values],
+        "fields": "userEnteredValue",
+    }}
+
+
+def delete_rows(sheet_id: int, rows: Iterable[int]) -> List[dict]:
+    """Build the batchUpdate requests deleting rows from a worksheet, given their (0-based)
+    indexes. Runs of adjacent rows go in one request, and the runs are deleted bottom-up, so
+    earlier deletions don't shift the later ones."""
+
+    runs: List[List[int]] = []
+    for row in sorted(set(rows)):
+        if len(runs) > 0 and runs[-1][1] == row:
+            runs[-1][1] = row + 1
+        else:
+            runs.append([row, row + 1])
+
+    return [
+        {"deleteDimension": {"range": {
+            "sheetId": sheet_id, "dimension": "ROWS", "startIndex": start, "endIndex": end,
+        }}}
+        for start, end in reversed(runs)
+    ]
+
+
+def map_rows(partitions: Iterable[Tuple[str, str]]) -> List[List[str]]:
+    """Lay (title, start) pairs out as rows of the map worksheet."""
+
+    return [[title, start] for title, start in partitions]
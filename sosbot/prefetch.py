@@ -0,0 +1,118 @@
+"""Download message attachments ahead of the messages that need them.
+
+Copying a conversation into a thread has to post messages in order, since each reply references
+one posted before it. Downloading each message's attachments only when it's its turn to be posted
+leaves the bot idle for most of the copy, so AttachmentPrefetcher downloads them concurrently,
+ahead of the send cursor, within a limit on simultaneous downloads and on the bytes held in memory.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Sequence
+
+from disnake import Attachment, File, Message
+
+DEFAULT_MAX_DOWNLOADS = 4
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class ByteBudget:
+    """Bound the bytes held at once. A single item larger than the whole budget is still let
+    through, once nothing else is held."""
+
+    def __init__(self, max_bytes: int):
+        """Setup an unused budget."""
+
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        """Wait until size bytes fit in the budget, and take them."""
+
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self.used == 0 or self.used + size <= self.max_bytes)
+            self.used += size
+
+    async def release(self, size: int):
+        """Give back bytes taken with acquire()."""
+
+        async with self._changed:
+            self.used -= size
+            self._changed.notify_all()
+
+
+class AttachmentPrefetcher:
+    """Download the attachments of a sequence of messages in the background, in message order.
+
+    Use as an async context manager, and call files() for each message in the same order.
+    """
+
+    def __init__(self, messages: Sequence[Message], max_downloads: int = DEFAULT_MAX_DOWNLOADS,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        """Setup the prefetcher; downloads start when the context is entered."""
+
+        self.messages = messages
+        self.budget = ByteBudget(max_bytes)
+        self.downloaded = 0
+        self.download_time = 0.0
+        self._downloads = asyncio.Semaphore(max(1, max_downloads))
+        self._ready: Dict[int, asyncio.Future] = {}
+        self._producer: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "AttachmentPrefetcher":
+        loop = asyncio.get_running_loop()
+        self._ready = {message.id: loop.create_future() for message in self.messages}
+        self._producer = asyncio.create_task(self._prefetch())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._producer.cancel()
+        for ready in self._ready.values():
+            if ready.done() and not ready.cancelled() and ready.exception() is None:
+                for download in ready.result():
+                    download.cancel()
+            else:
+                ready.cancel()
+
+    async def files(self, message: Message) -> List[File]:
+        """Wait for a message's attachments to be downloaded. The caller owns the returned
+        files, and should call release() once they've been sent."""
+
+        downloads = await self._ready[message.id]
+        return [await download for download in downloads]
+
+    async def release(self, message: Message):
+        """Free the budget held by a message's attachments."""
+
+        await self.budget.release(sum(attachment.size for attachment in message.attachments))
+
+    async def _prefetch(self):
+        """Start downloads message by message, as the budget allows."""
+
+        for message in self.messages:
+            # a message's attachments are taken from the budget all at once, so that a message
+            # larger than the whole budget is let through as one item, instead of waiting forever
+            # for its own first attachments to be released
+            size = sum(attachment.size for attachment in message.attachments)
+            try:
+                await self.budget.acquire(size)
+            # pylint: disable=broad-except
+            except Exception as error:
+                self._ready[message.id].set_exception(error)
+                return
+
+            self._ready[message.id].set_result([
+                asyncio.create_task(self._download(attachment))
+                for attachment in message.attachments
+            ])
+
+    async def _download(self, attachment: Attachment) -> File:
+        """Download one attachment, within the limit on simultaneous downloads."""
+
+        async with self._downloads:
+            started = time.monotonic()
+            file = await attachment.to_file()
+            self.download_time += time.monotonic() - started
+            self.downloaded += attachment.size
+            return file
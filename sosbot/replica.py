@@ -0,0 +1,221 @@
+"""Optional local SQLite mirror of the definitions and datasets spreadsheets.
+
+The in-memory indexes are loaded from the replica, so reads keep working when Google is down or
+out of quota, and a restart doesn't need to pull every partition again. Syncing polls the
+spreadsheet's Drive modifiedTime (one cheap call), and only re-pulls when that changes. Even then,
+only the partitions whose contents actually changed are rewritten locally.
+
+Several bot processes can share one replica. Given a max_age, whichever process syncs first claims
+the sync for that long, and the others just read what it stored.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from sosbot.index import fold
+
+Row = Dict[str, Any]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spreadsheets (
+    spreadsheet TEXT PRIMARY KEY,
+    modified TEXT
+);
+CREATE TABLE IF NOT EXISTS partitions (
+    spreadsheet TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (spreadsheet, partition)
+);
+CREATE TABLE IF NOT EXISTS rows (
+    spreadsheet TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rows_by_key ON rows (spreadsheet, key);
+CREATE INDEX IF NOT EXISTS rows_by_partition ON rows (spreadsheet, partition, position);
+CREATE TABLE IF NOT EXISTS checks (
+    spreadsheet TEXT PRIMARY KEY,
+    checked REAL NOT NULL
+);
+"""
+
+
+class SheetReplica:
+    """SQLite copy of the rows in one or more spreadsheets, keyed by their (case-folded) first
+    column: the term for the glossary, or the dataset name for datasets."""
+
+    def __init__(self, path: str, max_age: float = 0.0):
+        """Open (or create) the replica database at the given path. With a max_age (in seconds),
+        a spreadsheet that any process sharing the replica checked more recently isn't synced."""
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def has(self, spreadsheet_id: str) -> bool:
+        """Check whether the spreadsheet has been synced at least once."""
+
+        return self.modified_time(spreadsheet_id) is not None
+
+    def modified_time(self, spreadsheet_id: str) -> Optional[str]:
+        """Retrieve the Drive modifiedTime the spreadsheet had when it was last synced."""
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT modified FROM spreadsheets WHERE spreadsheet = ?", (spreadsheet_id,)
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def digests(self, spreadsheet_id: str) -> Dict[str, str]:
+        """Retrieve the content digest of each synced partition of the spreadsheet."""
+
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT partition, digest FROM partitions WHERE spreadsheet = ?",
+                (spreadsheet_id,)
+            ).fetchall())
+
+    def load(self, spreadsheet_id: str) -> Dict[str, List[Row]]:
+        """Read back every partition of the spreadsheet, with rows in sheet order."""
+
+        partitions: Dict[str, List[Row]] = {}
+        with self._lock:
+            for partition, data in self._db.execute(
+                    "SELECT partition, data FROM rows WHERE spreadsheet = ? "
+                    "ORDER BY partition, position", (spreadsheet_id,)
+            ):
+                partitions.setdefault(partition, []).append(json.loads(data))
+
+        return partitions
+
+    def lookup(self, spreadsheet_id: str, key: str) -> List[Row]:
+        """Retrieve the rows whose first column matches the key (case-insensitively)."""
+
+        with self._lock:
+            return [json.loads(data) for (data,) in self._db.execute(
+                "SELECT data FROM rows WHERE spreadsheet = ? AND key = ? ORDER BY position",
+                (spreadsheet_id, fold(key))
+            )]
+
+    def claim(self, spreadsheet_id: str) -> bool:
+        """Claim the next sync of the spreadsheet, unless a process sharing the replica checked
+        it less than max_age seconds ago."""
+
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute(
+                "SELECT checked FROM checks WHERE spreadsheet = ?", (spreadsheet_id,)
+            ).fetchone()
+            if row is not None and now - row[0] < self.max_age:
+                return False
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO checks (spreadsheet, checked) VALUES (?, ?)",
+                (spreadsheet_id, now)
+            )
+
+        return True
+
+    def update(self, spreadsheet_id: str, modified: str, partitions: Dict[str, List[Row]]):
+        """Replace the contents of the partitions that changed since the last sync, and record
+        the spreadsheet's new modifiedTime. Returns the names of the partitions rewritten."""
+
+        existing = self.digests(spreadsheet_id)
+        changed = []
+        with self._lock, self._db:
+            for partition, rows in partitions.items():
+                digest = partition_digest(rows)
+                if existing.get(partition) == digest:
+                    continue
+
+                changed.append(partition)
+                self._db.execute(
+                    "DELETE FROM rows WHERE spreadsheet = ? AND partition = ?",
+                    (spreadsheet_id, partition)
+                )
+                self._db.executemany(
+                    "INSERT INTO rows (spreadsheet, partition, position, key, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (spreadsheet_id, partition, position,
+                         fold(next(iter(row.values()), "")), json.dumps(row))
+                        for position, row in enumerate(rows)
+                    ]
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO partitions (spreadsheet, partition, digest) "
+                    "VALUES (?, ?, ?)", (spreadsheet_id, partition, digest)
+                )
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO spreadsheets (spreadsheet, modified) VALUES (?, ?)",
+                (spreadsheet_id, modified)
+            )
+
+        return changed
+
+    async def sync(self, sheets, spreadsheet_id: str, partitions: Iterable[str]) -> List[str]:
+        """Bring the replica up to date with the spreadsheet, using any object that provides
+        SheetsAccess's modified_time() and batch_get_records(). Returns the names of the
+        partitions that changed. Once populated, the sync is skipped if another process sharing
+        the replica has claimed it recently."""
+
+        if self.max_age > 0 and self.has(spreadsheet_id) and not self.claim(spreadsheet_id):
+            return []
+
+        modified = await sheets.modified_time(spreadsheet_id)
+        if modified == self.modified_time(spreadsheet_id):
+            return []
+
+        fetched = await sheets.batch_get_records(spreadsheet_id, partitions)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.update, spreadsheet_id, modified, fetched)
+
+    def close(self):
+        """Close the database."""
+
+        with self._lock:
+            self._db.close()
+
+
+def partition_digest(rows: List[Row]) -> str:
+    """Fingerprint a partition's contents, to tell whether it changed between syncs."""
+
+    return hashlib.sha256(json.dumps(rows, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+async def fetch_partitions(sheets, replica, spreadsheet_id: str,
+                           partitions: List[str]) -> Dict[str, List[Row]]:
+    """Read every partition of a spreadsheet. Without a replica, this is a single batch read
+    from Google. With one, the replica is synced and then read; if the sync fails but the replica
+    has been populated before, its (possibly stale) contents are used rather than failing."""
+
+    if replica is None:
+        return await sheets.batch_get_records(spreadsheet_id, partitions)
+
+    try:
+        await replica.sync(sheets, spreadsheet_id, partitions)
+    # pylint: disable=broad-except
+    except Exception as error:
+        if not replica.has(spreadsheet_id):
+            raise
+
+        print(f"Sync of {spreadsheet_id} failed, serving from the local replica: {error}")
+
+    return replica.load(spreadsheet_id)
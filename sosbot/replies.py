@@ -0,0 +1,166 @@
+"""Live index of which message replies to which, per channel.
+
+The conversation commands need the whole reply tree around a message. Walking it through the
+Discord API costs one fetch per ancestor, plus a scan of all channel history after the root. This
+graph is fed by the on_message listener instead, so a tree can usually be resolved without any
+API calls. It is bounded: the least recently used messages are evicted once it reaches its size
+limit, and the per-channel horizon tracks below which point the graph may be missing replies.
+"""
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+DEFAULT_MAX_MESSAGES = 100000
+
+
+class ReplyGraph:
+    """LRU-bounded map of message id -> (channel id, parent message id), with the reverse
+    (parent -> replies) links needed to find a message's descendants."""
+
+    def __init__(self, started_at: int, max_messages: int = DEFAULT_MAX_MESSAGES):
+        """Start an empty graph. started_at is the snowflake id of the moment we started
+        listening: replies to older messages may have been posted without us seeing them."""
+
+        self.max_messages = max_messages
+        self.started_at = started_at
+        self._messages: "OrderedDict[int, Tuple[int, Optional[int]]]" = OrderedDict()
+        self._replies: Dict[int, Set[int]] = {}
+        self._horizons: Dict[int, int] = {}
+        self._gaps: Dict[int, Tuple[int, int]] = {}
+
+    def add(self, channel_id: int, message_id: int, parent_id: Optional[int] = None):
+        """Record a message, along with the message it replies to (if any)."""
+
+        if message_id in self._messages:
+            self._messages.move_to_end(message_id)
+            return
+
+        self._messages[message_id] = (channel_id, parent_id)
+        if parent_id is not None:
+            self._replies.setdefault(parent_id, set()).add(message_id)
+
+        while len(self._messages) > self.max_messages:
+            self._evict()
+
+    def parent(self, message_id: int) -> Tuple[bool, Optional[int]]:
+        """Look up the message a message replies to. The first value says whether the message is
+        in the graph at all; if it isn't, the second value is meaningless."""
+
+        if message_id not in self._messages:
+            return False, None
+
+        self._messages.move_to_end(message_id)
+        return True, self._messages[message_id][1]
+
+    def descendants(self, message_id: int) -> Set[int]:
+        """Find all the (known) replies to a message, replies to those replies, and so on."""
+
+        found: Set[int] = set()
+        pending = [message_id]
+        while len(pending) > 0:
+            for reply in self._replies.get(pending.pop(), ()):
+                if reply not in found:
+                    found.add(reply)
+                    pending.append(reply)
+
+        for reply in found:
+            self._messages.move_to_end(reply)
+
+        return found
+
+    def horizon(self, channel_id: int) -> int:
+        """Retrieve the id after which the graph has seen every message in the channel, apart
+        from any gap (see gap()). Replies to messages older than this may be missing."""
+
+        return self._horizons.get(channel_id, self.started_at)
+
+    def gap(self, channel_id: int) -> Optional[Tuple[int, int]]:
+        """Retrieve the (after, before) ids of the period the bot was down, between the graph
+        being saved and loaded again, if it hasn't been filled in yet."""
+
+        return self._gaps.get(channel_id)
+
+    def fill_gap(self, channel_id: int, messages: Iterable[Tuple[int, Optional[int]]]):
+        """Add the (message id, parent id) pairs posted during a channel's gap, closing it."""
+
+        for message_id, parent_id in messages:
+            self.add(channel_id, message_id, parent_id)
+
+        self._gaps.pop(channel_id, None)
+
+    def count_between(self, channel_id: int, first: int, last: int) -> int:
+        """Count the messages the graph knows of in a channel, from the first id through the
+        last. This looks at every message in the graph, so it's meant for occasional use."""
+
+        return sum(
+            1 for message_id, (channel, _) in self._messages.items()
+            if channel == channel_id and first <= message_id <= last
+        )
+
+    def covers(self, channel_id: int, message_id: int) -> bool:
+        """Check whether every reply to the given message should be in the graph."""
+
+        return channel_id not in self._gaps and message_id > self.horizon(channel_id)
+
+    def save(self, path: str):
+        """Write the graph to disk, so it survives a restart."""
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        data = {
+            "saved_at": max(self._messages, default=self.started_at),
+            "horizons": {str(channel): self.horizon(channel) for channel in self._channels()},
+            "messages": [
+                [message_id, channel_id, parent_id]
+                for message_id, (channel_id, parent_id) in self._messages.items()
+            ],
+        }
+        with open(path + ".tmp", 'w', encoding="utf-8") as graph_file:
+            json.dump(data, graph_file)
+
+        os.replace(path + ".tmp", path)
+
+    def load(self, path: str):
+        """Read back a graph saved by a previous run. The time we weren't listening becomes a
+        gap in each channel, to be filled from channel history the first time it's needed."""
+
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'r', encoding="utf-8") as graph_file:
+            data = json.load(graph_file)
+
+        for channel, horizon in data.get("horizons", {}).items():
+            channel_id = int(channel)
+            if channel_id not in self._horizons:
+                self._horizons[channel_id] = horizon
+                self._gaps[channel_id] = (data["saved_at"], self.started_at)
+
+        for message_id, channel_id, parent_id in data.get("messages", []):
+            self.add(channel_id, message_id, parent_id)
+
+    def _channels(self) -> Set[int]:
+        """List the channels with messages in the graph."""
+
+        return {channel_id for channel_id, _ in self._messages.values()}
+
+    def _evict(self):
+        """Drop the least recently used message, raising its channel's horizon past it."""
+
+        message_id, (channel_id, parent_id) = self._messages.popitem(last=False)
+        if parent_id is not None:
+            siblings = self._replies.get(parent_id)
+            if siblings is not None:
+                siblings.discard(message_id)
+                if len(siblings) < 1:
+                    del self._replies[parent_id]
+
+        self._horizons[channel_id] = max(self.horizon(channel_id), message_id)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._messages
+
+    def __len__(self) -> int:
+        return len(self._messages)
@@ -0,0 +1,297 @@
+"""Quota-aware scheduling of Google API calls.
+
+Google Sheets enforces per-minute read and write quotas. Every call goes through a token bucket
+for its kind, so we pace ourselves instead of running into 429s. When callers have to wait,
+interactive reads (someone is waiting on a reply in Discord) go ahead of background work like
+index refreshes. Reads that fail with 429 or a 5xx error are retried with jittered exponential
+backoff; writes only on 429, since after a timeout or a 5xx error the write may still have been
+applied, and sending it again would duplicate its rows. Those are left to the caller (the
+write-behind flusher keeps them pending, and re-checks the worksheet before re-applying them).
+
+When the bot runs as several processes, they share the quota through a QuotaStore: a small SQLite
+database holding the level of each bucket, which every process takes its tokens from. Taking a
+token runs on the event loop, so it never waits on another process's lock: if the database is
+busy, the caller is told to try again shortly, just as if the bucket were empty.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_READ_QUOTA = 60
+DEFAULT_WRITE_QUOTA = 60
+DEFAULT_BURST = 10
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 64.0
+# how long to wait before retrying when another process holds the quota database's lock
+STORE_BUSY_DELAY = 0.005
+
+KIND_READ = "read"
+KIND_WRITE = "write"
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_WRITE = 1
+PRIORITY_BACKGROUND = 2
+
+RETRYABLE_CODES = (429, 500, 502, 503, 504)
+RETRYABLE_WRITE_CODES = (429,)
+
+current_priority = ContextVar("current_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority(level: int):
+    """Run the enclosed Google calls (in the current task) at the given priority."""
+
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a per-minute rate. Waiters are served in priority
+    order (lowest number first), then first-come first-served."""
+
+    def __init__(self, per_minute: float, burst: int = DEFAULT_BURST):
+        """Setup a full bucket, holding up to `burst` tokens."""
+
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, level: int = PRIORITY_INTERACTIVE):
+        """Wait until a token is available for a caller at the given priority, and take it."""
+
+        if not self._waiters and self._take() == 0:
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._order), future))
+        self._schedule()
+        await future
+
+    def waiting(self) -> int:
+        """Count the callers waiting for a token."""
+
+        return len([waiter for waiter in self._waiters if not waiter[2].done()])
+
+    def _take(self) -> float:
+        """Take a token if one is available, returning 0; otherwise, return how long until the
+        next one will be."""
+
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+
+        return (1 - self._tokens) / self.rate
+
+    def _schedule(self):
+        """Hand out whatever tokens are available, and arrange to wake up when the next one
+        will be."""
+
+        delay = 0.0
+        while len(self._waiters) > 0:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+
+            delay = self._take()
+            if delay > 0:
+                break
+
+            heapq.heappop(self._waiters)[2].set_result(None)
+
+        if len(self._waiters) > 0 and self._wakeup is None:
+            self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        """Timer callback: the next token should be available now."""
+
+        self._wakeup = None
+        self._schedule()
+
+
+class QuotaStore:
+    """Token bucket levels kept in SQLite, so several processes can share one quota."""
+
+    def __init__(self, path: str):
+        """Open (or create) the quota database at the given path."""
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        # in WAL mode, this skips the fsync on every commit; losing the latest levels in a crash
+        # only hands out a few extra tokens
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=0")
+
+    def take(self, name: str, rate: float, capacity: int) -> float:
+        """Take a token from the named bucket if one is available, returning 0; otherwise,
+        return how long until the next one will be. The bucket starts full. If another process
+        has the database locked, this doesn't wait for it, but returns a short delay instead."""
+
+        now = time.time()
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as error:
+            if not is_busy(error):
+                raise
+            return STORE_BUSY_DELAY * (1 + random.random())
+
+        try:
+            row = self._db.execute(
+                "SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = capacity if row is None else min(
+                capacity, row[0] + max(0.0, now - row[1]) * rate)
+            delay = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if delay == 0:
+                tokens -= 1
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                (name, tokens, now))
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+        return delay
+
+    def close(self):
+        """Close the database."""
+
+        self._db.close()
+
+
+def is_busy(error: sqlite3.OperationalError) -> bool:
+    """Check whether an SQLite error means another connection holds the lock."""
+
+    return "locked" in str(error) or "busy" in str(error)
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket whose tokens are held in a QuotaStore, shared with other processes. Waiters
+    are still queued (by priority) in this process."""
+
+    def __init__(self, store: QuotaStore, name: str, per_minute: float,
+                 burst: int = DEFAULT_BURST):
+        """Setup a bucket backed by the named bucket in the store."""
+
+        super().__init__(per_minute, burst)
+        self.store = store
+        self.name = name
+
+    def _take(self) -> float:
+        """Take a token from the shared bucket if one is available, returning 0; otherwise,
+        return how long until the next one will be (another process may still take it first)."""
+
+        return self.store.take(self.name, self.rate, self.capacity)
+
+
+class Scheduler:
+    """Pace Google calls against separate read and write budgets, retrying transient errors."""
+
+    def __init__(self, read_quota: float = DEFAULT_READ_QUOTA,
+                 write_quota: float = DEFAULT_WRITE_QUOTA,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 store: Optional[QuotaStore] = None):
+        """Setup the token buckets for each kind of call, shared with other processes through
+        the store, if one is given."""
+
+        self.max_retries = max_retries
+        if store is None:
+            self._buckets = {
+                KIND_READ: TokenBucket(read_quota),
+                KIND_WRITE: TokenBucket(write_quota),
+            }
+        else:
+            self._buckets = {
+                KIND_READ: SharedTokenBucket(store, KIND_READ, read_quota),
+                KIND_WRITE: SharedTokenBucket(store, KIND_WRITE, write_quota),
+            }
+        self._running = {KIND_READ: 0, KIND_WRITE: 0}
+
+    async def submit(self, kind: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a call once its budget allows, at the priority of the current task (writes always
+        run at PRIORITY_WRITE). Retryable failures are retried after a backoff, taking a fresh
+        token each time; for writes, that's only when the quota ran out."""
+
+        level = PRIORITY_WRITE if kind == KIND_WRITE else current_priority.get()
+        attempt = 0
+        while True:
+            await self._buckets[kind].acquire(level)
+            self._running[kind] += 1
+            try:
+                return await call()
+            # pylint: disable=broad-except
+            except Exception as error:
+                if attempt >= self.max_retries or not is_retryable(error, kind):
+                    raise
+
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                print(f"Google {kind} failed ({error}), retrying in {delay:.1f}s")
+                attempt += 1
+            finally:
+                self._running[kind] -= 1
+
+            await asyncio.sleep(delay)
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Count the calls of each kind that are waiting for a token or in progress."""
+
+        return {
+            kind: bucket.waiting() + self._running[kind] for kind, bucket in self._buckets.items()
+        }
+
+
+def is_retryable(error: Exception, kind: str = KIND_READ) -> bool:
+    """Decide whether a failed call is worth retrying: quota exhaustion, server-side errors,
+    timeouts and dropped connections are; anything else is our problem, and isn't. A write is
+    only retried when it was refused for quota (429), since otherwise it may have been applied
+    anyway, and isn't safe to repeat."""
+
+    if is_api_error(error):
+        return error.code in (RETRYABLE_WRITE_CODES if kind == KIND_WRITE else RETRYABLE_CODES)
+
+    if kind == KIND_WRITE:
+        return False
+
+    dropped = loaded_class("requests.exceptions", "ConnectionError")
+    return isinstance(error, (asyncio.TimeoutError, *dropped))
+
+
+def is_api_error(error: BaseException) -> bool:
+    """Check whether an error is an APIError raised by gspread."""
+
+    return isinstance(error, loaded_class("gspread.exceptions", "APIError"))
+
+
+def loaded_class(module: str, name: str) -> tuple:
+    """Look up an exception class for isinstance(), without importing its module: if nothing has
+    imported the module yet, nothing can have raised one of its exceptions, and an empty tuple
+    (which matches nothing) is returned."""
+
+    found = getattr(sys.modules.get(module), name, None)
+    return () if found is None else (found,)
@@ -0,0 +1,193 @@
+"""Full-text search over glossary terms, definitions, dataset names and descriptions.
+
+An inverted index (word -> documents) answers ranked queries, and a trigram index over the
+vocabulary and document titles matches misspelled words and powers "did you mean" suggestions.
+Both are updated incrementally as documents are added or removed, and never touch Google.
+"""
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+WORD_PATTERN = re.compile(r"\w+")
+TITLE_WEIGHT = 3
+MIN_SIMILARITY = 0.3
+FUZZY_EXPANSIONS = 3
+
+KIND_TERM = "term"
+KIND_DATASET = "dataset"
+
+
+class Document(NamedTuple):
+    """A searchable item: a glossary term or a dataset entry."""
+
+    kind: str
+    title: str
+    text: str
+    data: Dict[str, Any]
+
+
+class Hit(NamedTuple):
+    """A search result, with its relevance score."""
+
+    score: float
+    document: Document
+
+
+def words(text: str) -> List[str]:
+    """Split text into case-folded words."""
+
+    return WORD_PATTERN.findall(str(text).casefold())
+
+
+def trigrams(word: str) -> Set[str]:
+    """Break a word into its trigrams, padded so short words and word boundaries count too."""
+
+    padded = f"  {word.casefold()} "
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+def similarity(left: Set[str], right: Set[str]) -> float:
+    """Jaccard similarity of two trigram sets."""
+
+    if len(left) < 1 or len(right) < 1:
+        return 0.0
+
+    return len(left & right) / len(left | right)
+
+
+class SearchIndex:
+    """Incrementally maintained inverted + trigram index over documents keyed by a unique id."""
+
+    def __init__(self):
+        """Start with an empty index."""
+
+        self._documents: Dict[Hashable, Document] = {}
+        self._terms: Dict[Hashable, Counter] = {}
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._word_grams: Dict[str, Set[str]] = {}
+        self._title_grams: Dict[str, Set[Hashable]] = {}
+        self._title_sizes: Dict[Hashable, int] = {}
+
+    def add(self, doc_id: Hashable, document: Document):
+        """Index a document, replacing any previous version with the same id."""
+
+        if self._documents.get(doc_id) == document:
+            return
+
+        self.remove(doc_id)
+
+        counts = Counter()
+        for word in words(document.title):
+            counts[word] += TITLE_WEIGHT
+        for word in words(document.text):
+            counts[word] += 1
+
+        self._documents[doc_id] = document
+        self._terms[doc_id] = counts
+        for word, count in counts.items():
+            if word not in self._postings:
+                self._postings[word] = {}
+                for gram in trigrams(word):
+                    self._word_grams.setdefault(gram, set()).add(word)
+
+            self._postings[word][doc_id] = count
+
+        title_grams = trigrams(document.title)
+        self._title_sizes[doc_id] = len(title_grams)
+        for gram in title_grams:
+            self._title_grams.setdefault(gram, set()).add(doc_id)
+
+    def remove(self, doc_id: Hashable):
+        """Drop a document from the index, if it's there."""
+
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+
+        for word in self._terms.pop(doc_id):
+            postings = self._postings[word]
+            postings.pop(doc_id, None)
+            if len(postings) < 1:
+                del self._postings[word]
+                for gram in trigrams(word):
+                    self._word_grams[gram].discard(word)
+
+        del self._title_sizes[doc_id]
+        for gram in trigrams(document.title):
+            self._title_grams.get(gram, set()).discard(doc_id)
+
+    def replace(self, kind: str, documents: Dict[Hashable, Document]):
+        """Make the indexed documents of one kind match the given set, touching only those that
+        were added, changed or removed since the last time."""
+
+        stale = [
+            doc_id for doc_id, document in self._documents.items()
+            if document.kind == kind and doc_id not in documents
+        ]
+        for doc_id in stale:
+            self.remove(doc_id)
+
+        for doc_id, document in documents.items():
+            self.add(doc_id, document)
+
+    def search(self, query: str, limit: int = 10) -> List[Hit]:
+        """Rank documents against the words in the query (TF-IDF). Words that aren't in the
+        vocabulary are swapped for the closest spellings that are."""
+
+        total = max(len(self._documents), 1)
+        scores: Dict[Hashable, float] = {}
+        for word in words(query):
+            for candidate, weight in self._expand(word):
+                postings = self._postings[candidate]
+                idf = math.log(1 + total / len(postings))
+                for doc_id, count in postings.items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * count * idf
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [Hit(score, self._documents[doc_id]) for doc_id, score in ranked]
+
+    def suggest(self, text: str, kind: Optional[str] = None, limit: int = 5) -> List[str]:
+        """Suggest document titles spelled similarly to the given text ("did you mean")."""
+
+        grams = trigrams(text)
+        overlaps: Counter = Counter()
+        for gram in grams:
+            overlaps.update(self._title_grams.get(gram, ()))
+
+        scored: Dict[str, float] = {}
+        for doc_id, overlap in overlaps.items():
+            document = self._documents[doc_id]
+            if kind is not None and document.kind != kind:
+                continue
+
+            score = overlap / (len(grams) + self._title_sizes[doc_id] - overlap)
+            if score >= MIN_SIMILARITY and score > scored.get(document.title, 0.0):
+                scored[document.title] = score
+
+        ranked = sorted(scored.items(), key=lambda item: item[1], reverse=True)
+        return [title for title, _ in ranked[:limit]]
+
+    def _expand(self, word: str) -> Iterable[Tuple[str, float]]:
+        """Map a query word onto indexed words: itself if it's known, otherwise its closest
+        spellings, weighted by how similar they are."""
+
+        if word in self._postings:
+            return [(word, 1.0)]
+
+        grams = trigrams(word)
+        overlaps: Counter = Counter()
+        for gram in grams:
+            overlaps.update(self._word_grams.get(gram, ()))
+
+        # similarity can't exceed overlap / len(grams), so most candidates are skipped unscored
+        scored = [
+            (candidate, similarity(grams, trigrams(candidate)))
+            for candidate, overlap in overlaps.items()
+            if overlap >= MIN_SIMILARITY * len(grams)
+        ]
+        scored = [item for item in scored if item[1] >= MIN_SIMILARITY]
+        return sorted(scored, key=lambda item: item[1], reverse=True)[:FUZZY_EXPANSIONS]
+
+    def __len__(self) -> int:
+        return len(self._documents)
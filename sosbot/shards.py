@@ -0,0 +1,108 @@
+"""Run the bot's gateway connections as shards, optionally split across several processes.
+
+Given only a shard count, one process runs every shard (AutoShardedBot). Given explicit shard ids,
+a process runs only those, and `sosbot start --processes N` launches N processes with the shards
+split evenly between them. Those processes share the local SQLite stores: the Sheets replica, the
+conversation index and the Sheets quota. Files that a single process has to own, like the write
+journal and the reply graph, get a separate name for each process.
+"""
+import os
+from typing import List, NamedTuple, Optional
+
+
+class Sharding(NamedTuple):
+    """Which shards this process runs, out of how many. Both are None when not sharded."""
+
+    shard_count: Optional[int] = None
+    shard_ids: Optional[List[int]] = None
+
+    @property
+    def enabled(self) -> bool:
+        """Check whether the gateway connection is sharded at all."""
+
+        return self.shard_count is not None or self.shard_ids is not None
+
+    @property
+    def partial(self) -> bool:
+        """Check whether this process runs only some of the shards, so other processes share
+        its stores."""
+
+        return self.shard_ids is not None
+
+    @property
+    def first(self) -> int:
+        """The first shard this process runs, which identifies the process."""
+
+        return self.shard_ids[0] if self.shard_ids else 0
+
+    def path(self, path: str) -> str:
+        """Give a file that only one process may own a name specific to this process (unless
+        this process runs every shard)."""
+
+        if not self.partial:
+            return path
+
+        root, ext = os.path.splitext(path)
+        return f"{root}.shard-{self.first}{ext}"
+
+    def port(self, port: int) -> int:
+        """Offset a listening port by this process' first shard, so processes don't collide."""
+
+        return port + self.first
+
+    def describe(self) -> str:
+        """Summarize the shards run by this process, for logging."""
+
+        if not self.enabled:
+            return "unsharded"
+
+        ids = "all" if self.shard_ids is None else format_shard_ids(self.shard_ids)
+        return f"shards {ids} of {self.shard_count or 'auto'}"
+
+
+def parse_shard_ids(spec: str) -> List[int]:
+    """Parse a list of shard ids and inclusive ranges, like '0-3,8'."""
+
+    ids: List[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-", 1)
+            ids.extend(range(int(first), int(last) + 1))
+        elif part:
+            ids.append(int(part))
+
+    return sorted(set(ids))
+
+
+def format_shard_ids(ids: List[int]) -> str:
+    """Format shard ids as the ranges parse_shard_ids() reads."""
+
+    ranges: List[str] = []
+    start = prev = None
+    for shard in sorted(ids) + [None]:
+        if prev is not None and shard == prev + 1:
+            prev = shard
+            continue
+
+        if start is not None:
+            ranges.append(str(start) if start == prev else f"{start}-{prev}")
+
+        start = prev = shard
+
+    return ",".join(ranges)
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """Split the shards into contiguous, evenly sized ranges, one per process."""
+
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges: List[List[int]] = []
+    start = 0
+    for idx in range(processes):
+        end = start + size + (1 if idx < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+
+    return ranges
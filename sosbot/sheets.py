@@ -0,0 +1,416 @@
+"""Async access layer for Google Sheets.
+
+gspread is a blocking library, so every call made from a command handler would otherwise stall
+the Discord gateway loop for a full Sheets round-trip. This module runs those calls in a bounded
+thread pool, with a per-call timeout, so the cogs can simply ``await`` them.
+
+Opened spreadsheet and worksheet handles are cached, since opening each one costs a metadata
+fetch before any data is read. When a Scheduler is given, every call is paced against its read or
+write quota, and transient failures are retried.
+
+The gspread client can be given as a factory, which is only called (in a worker thread) when the
+first call is made, so neither gspread nor the Google credentials are loaded until they're needed.
+
+Identical reads are coalesced: callers asking for the same range of the same spreadsheet while a
+read of it is in flight all await that one read, and for a short freshness window afterwards they
+get its result without another call. Results are shared between those callers, so mustn't be
+modified. Any write to a spreadsheet through this layer discards its coalesced reads, so nothing
+read before the write is served after it.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import (TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple,
+                    Union)
+
+from sosbot.metrics import Metrics, GOOGLE_CALLS, GOOGLE_SECONDS, RATE_LIMITED
+from sosbot.scheduler import Scheduler, KIND_READ, KIND_WRITE, is_api_error
+
+if TYPE_CHECKING:
+    import gspread
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_CALL_TIMEOUT = 30.0
+DEFAULT_READ_FRESHNESS = 1.0
+
+# the responses suggesting a cached handle is stale, rather than that Google is busy or failing
+STALE_HANDLE_CODES = (400, 404)
+
+
+# pylint: disable=too-many-instance-attributes
+class SheetsAccess:
+    """Run gspread calls off the event loop, through a bounded pool of worker threads."""
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, client: Union[gspread.Client, Callable[[], gspread.Client]],
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 timeout: float = DEFAULT_CALL_TIMEOUT,
+                 scheduler: Optional[Scheduler] = None,
+                 metrics: Optional[Metrics] = None,
+                 freshness: float = DEFAULT_READ_FRESHNESS):
+        """Setup the worker pool used to run gspread calls for the given client, or for the one
+        returned by the given factory on first use. Reads are reused for freshness seconds."""
+
+        self._client = client
+        self.timeout = timeout
+        self.freshness = freshness
+        self.scheduler = scheduler
+        self.metrics = metrics or Metrics()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="sosbot-sheets"
+        )
+        self._client_lock = threading.Lock()
+        self._handles_lock = threading.Lock()
+        self._spreadsheets: Dict[str, gspread.Spreadsheet] = {}
+        self._worksheets: Dict[Tuple[str, str], gspread.Worksheet] = {}
+        self._reads: Dict[tuple, asyncio.Future] = {}
+        self._fresh: Dict[tuple, Tuple[float, Any]] = {}
+        self._generations: Dict[str, int] = {}
+
+    @property
+    def client(self) -> gspread.Client:
+        """Retrieve the gspread client, calling its factory if this is the first use."""
+
+        with self._client_lock:
+            if callable(self._client):
+                self._client = self._client()
+
+            return self._client
+
+    async def run(self, func: Callable, *args, kind: str = KIND_READ, **kwargs) -> Any:
+        """Run a blocking call in the worker pool, raising asyncio.TimeoutError if an attempt
+        takes longer than the configured timeout. With a scheduler, the call waits for its turn
+        against the read or write quota (depending on kind), and is retried if it fails with a
+        transient error."""
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        name = getattr(func, "__name__", "call").lstrip("_")
+
+        async def attempt():
+            status = "ok"
+            started = time.monotonic()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, call), self.timeout)
+            except asyncio.TimeoutError:
+                status = "timeout"
+                raise
+            except Exception as error:
+                status = "error"
+                if is_api_error(error):
+                    status = str(error.code)
+                    if error.code == 429:
+                        self.metrics.count(RATE_LIMITED, api="google")
+                raise
+            finally:
+                self.metrics.count(GOOGLE_CALLS, call=name, kind=kind, status=status)
+                self.metrics.observe(GOOGLE_SECONDS, time.monotonic() - started, call=name)
+
+        if self.scheduler is None:
+            return await attempt()
+
+        return await self.scheduler.submit(kind, attempt)
+
+    async def worksheet(self, spreadsheet_id: str, title: str) -> gspread.Worksheet:
+        """Open a worksheet (tab) by title, within the spreadsheet with the given key."""
+
+        with self._handles_lock:
+            sheet = self._worksheets.get((spreadsheet_id, title))
+
+        self.metrics.cache("worksheet", sheet is not None)
+        return sheet or await self.coalesce(
+            (spreadsheet_id, "worksheet", title),
+            lambda: self.run(self._open_worksheet, spreadsheet_id, title))
+
+    async def get_all_records(self, spreadsheet_id: str, title: str) -> List[Dict[str, Any]]:
+        """Retrieve all rows of a worksheet as a list of dicts keyed by the header row."""
+
+        sheet = await self.worksheet(spreadsheet_id, title)
+        return await self.coalesce((spreadsheet_id, "records", title),
+                                   lambda: self._run_on(sheet, sheet.get_all_records))
+
+    async def batch_get_records(self, spreadsheet_id: str,
+                                titles: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Retrieve all rows of several worksheets with a single values.batchGet call, returning
+        a list of dicts (keyed by each worksheet's header row) per worksheet title."""
+
+        fetched = await self.batch_get_values(spreadsheet_id, titles)
+        return {title: values_to_records(values) for title, values in fetched.items()}
+
+    async def batch_get_values(self, spreadsheet_id: str,
+                               titles: Iterable[str]) -> Dict[str, List[List[Any]]]:
+        """Retrieve the raw values (header row first) of several worksheets with a single
+        values.batchGet call, keyed by worksheet title."""
+
+        titles = list(titles)
+        response = await self.coalesce((spreadsheet_id, "batch", tuple(titles)),
+                                       lambda: self.run(self._batch_get, spreadsheet_id, titles))
+        value_ranges = response.get("valueRanges", [])
+
+        return {
+            title: value_range.get("values", [])
+            for title, value_range in zip(titles, value_ranges)
+        }
+
+    async def modified_time(self, spreadsheet_id: str) -> str:
+        """Retrieve the spreadsheet's last modification time from the Drive API. This is much
+        cheaper than reading the data to see whether anything changed."""
+
+        return await self.coalesce((spreadsheet_id, "modified"),
+                                   lambda: self.run(self._modified_time, spreadsheet_id))
+
+    async def get_all_values(self, sheet: gspread.Worksheet) -> List[List[Any]]:
+        """Retrieve the raw values of a worksheet, including its header row."""
+
+        return await self.coalesce((sheet.spreadsheet.id, "values", sheet.title),
+                                   lambda: self._run_on(sheet, sheet.get_all_values))
+
+    async def col_values(self, sheet: gspread.Worksheet, col: int) -> List[Any]:
+        """Retrieve the values of a single (1-based) column of a worksheet, including its
+        header."""
+
+        return await self.coalesce((sheet.spreadsheet.id, "column", sheet.title, col),
+                                   lambda: self._run_on(sheet, sheet.col_values, col))
+
+    async def get_columns(self, sheet: gspread.Worksheet, count: int) -> List[List[Any]]:
+        """Retrieve the values of the first count columns of a worksheet, including its header
+        row: enough to find a row by its key columns without reading the rest of it."""
+
+        return await self.coalesce(
+            (sheet.spreadsheet.id, "columns", sheet.title, count),
+            lambda: self._run_on(sheet, sheet.get_values, f"A:{column_letter(count)}"))
+
+    async def batch_update(self, sheet: gspread.Worksheet, requests: List[dict]):
+        """Apply a list of spreadsheets.batchUpdate requests in a single call."""
+
+        with self._writing(sheet.spreadsheet.id):
+            return await self._run_on(
+                sheet, sheet.spreadsheet.batch_update, {"requests": requests}, kind=KIND_WRITE)
+
+    async def worksheets(self, spreadsheet_id: str) -> Dict[str, gspread.Worksheet]:
+        """Open every worksheet in a spreadsheet with a single metadata call, keyed by title."""
+
+        return await self.coalesce((spreadsheet_id, "worksheets"),
+                                   lambda: self.run(self._open_worksheets, spreadsheet_id))
+
+    async def update_spreadsheet(self, spreadsheet_id: str, requests: List[dict]):
+        """Apply a list of spreadsheets.batchUpdate requests, which may span any of the
+        spreadsheet's worksheets, in a single call."""
+
+        with self._writing(spreadsheet_id):
+            return await self.run(self._batch_update, spreadsheet_id, requests, kind=KIND_WRITE)
+
+    async def coalesce(self, key: tuple, read: Callable[[], Awaitable[Any]]) -> Any:
+        """Share one read among the callers asking for it (identified by a key starting with
+        the spreadsheet id) while it's in flight, and its result with those asking within the
+        freshness window after it completes. A caller that's cancelled doesn't cancel the read
+        for the others."""
+
+        cached = self._fresh.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.freshness:
+            self.metrics.cache("read", True)
+            return cached[1]
+
+        future = self._reads.get(key)
+        self.metrics.cache("read", future is not None)
+        if future is None:
+            future = asyncio.ensure_future(read())
+            self._reads[key] = future
+            future.add_done_callback(functools.partial(
+                self._read_done, key, self._generations.get(key[0], 0)))
+
+        return await asyncio.shield(future)
+
+    def invalidate(self, spreadsheet_id: str, title: Optional[str] = None):
+        """Drop cached handles, so they are re-opened on next use. Without a title, the
+        spreadsheet and all of its worksheets are dropped."""
+
+        with self._handles_lock:
+            if title is None:
+                self._spreadsheets.pop(spreadsheet_id, None)
+                for key in [key for key in self._worksheets if key[0] == spreadsheet_id]:
+                    del self._worksheets[key]
+            else:
+                self._worksheets.pop((spreadsheet_id, title), None)
+
+    def forget(self, spreadsheet_id: str):
+        """Stop sharing the spreadsheet's earlier reads, so the next ones go to Google, for a
+        caller that must see the spreadsheet as it is now."""
+
+        self._forget_reads(spreadsheet_id)
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Count the reads and writes waiting for their turn or in progress."""
+
+        if self.scheduler is None:
+            return {KIND_READ: 0, KIND_WRITE: 0}
+
+        return self.scheduler.queue_depth()
+
+    def shutdown(self):
+        """Stop accepting new calls and release the worker threads."""
+
+        self._executor.shutdown(wait=False)
+
+    def _read_done(self, key: tuple, generation: int, future: asyncio.Future):
+        """Stop sharing a read that's completed, and keep its result for the freshness window,
+        unless it failed or the spreadsheet was written to meanwhile."""
+
+        if self._reads.get(key) is future:
+            del self._reads[key]
+
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        if self.freshness > 0 and self._generations.get(key[0], 0) == generation:
+            self._fresh[key] = (time.monotonic(), future.result())
+
+    @contextmanager
+    def _writing(self, spreadsheet_id: str):
+        """Discard the spreadsheet's coalesced reads as a write to it starts and again once it's
+        done, so no read that may predate the write is shared after it."""
+
+        self._forget_reads(spreadsheet_id)
+        try:
+            yield
+        finally:
+            self._forget_reads(spreadsheet_id)
+
+    def _forget_reads(self, spreadsheet_id: str):
+        """Drop the spreadsheet's fresh and in-flight reads (the latter still complete for those
+        already waiting on them), and expired reads of any spreadsheet."""
+
+        self._generations[spreadsheet_id] = self._generations.get(spreadsheet_id, 0) + 1
+        now = time.monotonic()
+        for key in [key for key in self._reads if key[0] == spreadsheet_id]:
+            del self._reads[key]
+        for key in [key for key, (read_at, _) in self._fresh.items()
+                    if key[0] == spreadsheet_id or now - read_at >= self.freshness]:
+            del self._fresh[key]
+
+    async def _run_on(self, sheet: gspread.Worksheet, func: Callable, *args,
+                      kind: str = KIND_READ) -> Any:
+        """Run a call against a cached worksheet handle. If Google rejects it as a bad request
+        or not found, the handle may be stale (the worksheet was renamed or deleted), so drop it
+        before re-raising. Quota and server errors leave it alone."""
+
+        try:
+            return await self.run(func, *args, kind=kind)
+        except Exception as error:
+            if is_stale_handle(error):
+                self.invalidate(sheet.spreadsheet.id, sheet.title)
+            raise
+
+    def _batch_get(self, spreadsheet_id: str, titles: List[str]) -> dict:
+        """Fetch the full contents of the named worksheets in the calling (worker) thread."""
+
+        # pylint: disable=import-outside-toplevel
+        from gspread.utils import absolute_range_name
+
+        spreadsheet = self._open_spreadsheet(spreadsheet_id)
+        try:
+            return spreadsheet.values_batch_get([absolute_range_name(title) for title in titles])
+        except Exception as error:
+            if is_stale_handle(error):
+                self.invalidate(spreadsheet_id)
+            raise
+
+    def _batch_update(self, spreadsheet_id: str, requests: List[dict]) -> dict:
+        """Apply batchUpdate requests to a spreadsheet in the calling (worker) thread."""
+
+        try:
+            return self._open_spreadsheet(spreadsheet_id).batch_update({"requests": requests})
+        except Exception as error:
+            if is_stale_handle(error):
+                self.invalidate(spreadsheet_id)
+            raise
+
+    def _open_worksheets(self, spreadsheet_id: str) -> Dict[str, gspread.Worksheet]:
+        """Open (and cache handles for) every worksheet in the calling (worker) thread."""
+
+        spreadsheet = self._open_spreadsheet(spreadsheet_id)
+        sheets = {sheet.title: sheet for sheet in spreadsheet.worksheets()}
+        with self._handles_lock:
+            for title, sheet in sheets.items():
+                self._worksheets[(spreadsheet_id, title)] = sheet
+
+        return sheets
+
+    def _modified_time(self, spreadsheet_id: str) -> str:
+        """Look up the spreadsheet's Drive modifiedTime in the calling (worker) thread."""
+
+        return self._open_spreadsheet(spreadsheet_id).get_lastUpdateTime()
+
+    def _open_spreadsheet(self, spreadsheet_id: str) -> gspread.Spreadsheet:
+        """Open a spreadsheet (or reuse its cached handle) in the calling (worker) thread."""
+
+        with self._handles_lock:
+            spreadsheet = self._spreadsheets.get(spreadsheet_id)
+
+        if spreadsheet is None:
+            spreadsheet = self.client.open_by_key(spreadsheet_id)
+            with self._handles_lock:
+                self._spreadsheets[spreadsheet_id] = spreadsheet
+
+        return spreadsheet
+
+    def _open_worksheet(self, spreadsheet_id: str, title: str) -> gspread.Worksheet:
+        """Open a worksheet (or reuse its cached handle) in the calling (worker) thread. If the
+        worksheet can't be found, the spreadsheet metadata is refreshed once before giving up, in
+        case our handle predates the worksheet being added or renamed."""
+
+        # pylint: disable=import-outside-toplevel
+        from gspread.exceptions import WorksheetNotFound
+
+        with self._handles_lock:
+            sheet = self._worksheets.get((spreadsheet_id, title))
+
+        if sheet is None:
+            try:
+                sheet = self._open_spreadsheet(spreadsheet_id).worksheet(title)
+            except WorksheetNotFound:
+                self.invalidate(spreadsheet_id)
+                sheet = self._open_spreadsheet(spreadsheet_id).worksheet(title)
+
+            with self._handles_lock:
+                self._worksheets[(spreadsheet_id, title)] = sheet
+
+        return sheet
+
+
+def column_letter(col: int) -> str:
+    """Convert a (1-based) column number to its A1 letters, e.g. 1 to A and 28 to AB."""
+
+    letters = ""
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+
+    return letters
+
+
+def is_stale_handle(error: BaseException) -> bool:
+    """Check whether Google rejected a call in a way that suggests the handle it was made
+    through is stale: a bad request or not found, as opposed to a quota or server error."""
+
+    return is_api_error(error) and error.code in STALE_HANDLE_CODES
+
+
+def values_to_records(values: List[List[Any]]) -> List[Dict[str, Any]]:
+    """Convert raw worksheet values (header row first) into a list of dicts keyed by header,
+    padding short rows with empty strings the way gspread's get_all_records() does."""
+
+    if len(values) < 1:
+        return []
+
+    header = values[0]
+    return [
+        dict(zip(header, list(row) + [""] * (len(header) - len(row))))
+        for row in values[1:]
+    ]
@@ -0,0 +1,37 @@
+"""Time the phases of startup: imports, reading config, setting up cogs, and connecting to the
+gateway, so a slow start can be traced to the phase responsible.
+
+The clock starts when this module is first imported, which sosbot/__init__.py does before anything
+else, so the imports phase covers loading all of sosbot and its dependencies.
+"""
+import time
+from typing import List, Tuple
+
+
+class StartupTimer:
+    """Record how long each startup phase took, as the time since the previous one ended."""
+
+    def __init__(self):
+        """Start the clock."""
+
+        self.started = time.monotonic()
+        self.phases: List[Tuple[str, float]] = []
+        self.reported = False
+        self._last = self.started
+
+    def mark(self, phase: str):
+        """Record the end of a phase."""
+
+        now = time.monotonic()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self) -> str:
+        """Summarize the phases recorded so far, and mark the report as done."""
+
+        self.reported = True
+        phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        return f"Started in {self._last - self.started:.2f}s ({phases})"
+
+
+STARTUP = StartupTimer()
@@ -5,10 +5,18 @@
 from sosbot.bot import load_bot
 from sosbot.cogs.definitions import DefinitionCog
 from sosbot.cogs.datasets import DatasetCog
+from sosbot.cogs.search import SearchCog
+from sosbot.cogs.stats import StatsCog
+from sosbot.startup import STARTUP
 
+STARTUP.mark("imports")
 bot = load_bot()
+STARTUP.mark("config")
 bot.discord.add_cog(DefinitionCog(bot))
 bot.discord.add_cog(DatasetCog(bot))
+bot.discord.add_cog(SearchCog(bot))
+bot.discord.add_cog(StatsCog(bot))
+STARTUP.mark("cogs")
 
 print("Starting sosbot for Discord.")
 bot.discord.start()
@@ -0,0 +1 @@
+"""Unit tests for the parts of sosbot that don't need Discord or Google."""
@@ -0,0 +1,116 @@
+"""Tests for sosbot.archive."""
+import os
+import tempfile
+import unittest
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from sosbot.archive import (ArchiveWriter, Checkpoint, excerpt, messages_path, offsets_path,
+                            read_headings)
+
+DAYS = [date(2024, 3, 4), date(2024, 3, 5), date(2024, 3, 6)]
+PER_DAY = 4
+
+
+def message(idx: int) -> SimpleNamespace:
+    """Build the idx-th message of the archive: PER_DAY of them a day, an hour apart."""
+
+    day = DAYS[idx // PER_DAY]
+    return SimpleNamespace(
+        id=1000 + idx,
+        created_at=datetime(day.year, day.month, day.day, 9 + idx % PER_DAY),
+        author=SimpleNamespace(display_name=f"user{idx % 3}"),
+        clean_content=f"message {idx} about the district budget",
+    )
+
+
+def lines_of(data: bytes) -> list:
+    """Split an excerpt into its (non-blank) lines."""
+
+    return [line for line in data.decode("utf-8").split("\n") if len(line) > 0]
+
+
+class ArchiveTest(unittest.TestCase):
+    """Archives are written in chunks, resumed from their checkpoint, and cut into excerpts
+    by date."""
+
+    def setUp(self):
+        """Pick a path for the archive in a scratch directory."""
+
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(directory.name, "guild", "general", "budget.md")
+
+    def save(self, path: str, messages: range, chunk_size: int = 3):
+        """Archive messages to a file, resuming from its checkpoint (if any)."""
+
+        with ArchiveWriter(path, Checkpoint.load(path), chunk_size=chunk_size) as writer:
+            writer.header("budget", "general", "guild")
+            for idx in messages:
+                writer.write(message(idx))
+
+    def test_excerpt_by_date(self):
+        """An excerpt at the start, in the middle or at the end of the archive holds exactly
+        the messages of its days, under their headings."""
+
+        self.save(self.path, range(len(DAYS) * PER_DAY))
+
+        for start, end, first, last in ((None, DAYS[0], 0, 3), (DAYS[1], DAYS[1], 4, 7),
+                                        (DAYS[2], None, 8, 11)):
+            data, trimmed = excerpt(self.path, start, end, 1 << 20)
+            lines = lines_of(data)
+            self.assertFalse(trimmed)
+            self.assertTrue(lines[0].startswith("## "))
+            self.assertEqual([line.split(": ", 1)[1] for line in lines[1:]],
+                             [message(idx).clean_content for idx in range(first, last + 1)])
+
+        self.assertEqual(excerpt(self.path, date(2024, 4, 1), None, 1 << 20), (b"", False))
+
+    def test_trimmed_on_message_boundary(self):
+        """An excerpt too long for max_bytes ends after the last whole message that fits."""
+
+        self.save(self.path, range(len(DAYS) * PER_DAY))
+        whole, _ = excerpt(self.path, DAYS[0], None, 1 << 20)
+
+        data, trimmed = excerpt(self.path, DAYS[0], None, len(whole) // 2)
+        self.assertTrue(trimmed)
+        self.assertLessEqual(len(data), len(whole) // 2)
+        self.assertTrue(whole.startswith(data))
+        self.assertTrue(whole[len(data):].startswith(b"* "))
+        self.assertTrue(data.endswith(b"\n"))
+
+    def test_never_empty(self):
+        """When not even the first message fits, it's cut short rather than dropped."""
+
+        self.save(self.path, range(PER_DAY))
+
+        data, trimmed = excerpt(self.path, None, None, 20)
+        self.assertTrue(trimmed)
+        self.assertEqual(len(data), 20)
+        self.assertTrue(data.startswith(b"## "))
+
+    def test_resume(self):
+        """Saving again from the checkpoint appends only the new messages, with no repeated
+        heading, and leaves the same file (and excerpts) as saving everything at once, even
+        when the offset sidecars have to be rebuilt."""
+
+        self.save(self.path, range(6))
+        checkpoint = Checkpoint.load(self.path)
+        self.assertEqual(checkpoint.last_id, 1005)
+        os.remove(offsets_path(self.path))
+        os.remove(messages_path(self.path))
+        self.save(self.path, range(6, len(DAYS) * PER_DAY))
+
+        whole = os.path.join(self.directory, "whole.md")
+        self.save(whole, range(len(DAYS) * PER_DAY))
+        with open(self.path, 'rb') as resumed_file, open(whole, 'rb') as whole_file:
+            self.assertEqual(resumed_file.read(), whole_file.read())
+
+        self.assertEqual([heading for _, heading in read_headings(self.path)], DAYS)
+        self.assertEqual(excerpt(self.path, DAYS[1], DAYS[1], 1 << 20),
+                         excerpt(whole, DAYS[1], DAYS[1], 1 << 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
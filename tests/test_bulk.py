@@ -0,0 +1,29 @@
+"""Tests for the pure helpers of sosbot.bulk."""
+import unittest
+
+from sosbot.bulk import insertions
+
+
+class InsertionsTest(unittest.TestCase):
+    """insertions() places imported rows among a partition's rows, in case-folded order."""
+
+    def test_runs(self):
+        """New rows are grouped into runs, each at the index it will have once the runs before
+        it are in."""
+
+        rows = [["apple"], ["Cherry"], ["melon"]]
+        runs = insertions(rows, [["zucchini"], ["Banana"], ["avocado"], ["date"]])
+        self.assertEqual(runs, [
+            (1, [["avocado"], ["Banana"]]),
+            (4, [["date"]]),
+            (6, [["zucchini"]]),
+        ])
+
+    def test_after_equal_keys(self):
+        """A new row goes after existing rows with the same key, like the write-behind's."""
+
+        self.assertEqual(insertions([["Apple"], ["apple"]], [["APPLE"]]), [(2, [["APPLE"]])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+"""Tests for sosbot.index."""
+import unittest
+
+from sosbot.index import MAX_COMPLETION_LENGTH, PrefixIndex
+
+
+class PrefixIndexTest(unittest.TestCase):
+    """PrefixIndex completes prefixes from a sorted array of case-folded names."""
+
+    def test_complete(self):
+        """Completions ignore case, come back in order, and stop at the limit."""
+
+        index = PrefixIndex(["Budget", "bond", "Levy", "BOARD"])
+        self.assertEqual(index.complete("b"), ["BOARD", "bond", "Budget"])
+        self.assertEqual(index.complete("BO", limit=1), ["BOARD"])
+        self.assertEqual(index.complete("x"), [])
+
+    def test_add_and_remove(self):
+        """Adding a name that differs only in case replaces it; removing ignores case."""
+
+        index = PrefixIndex(["Budget"])
+        index.add("BUDGET")
+        index.add("Attendance")
+        self.assertEqual(index.slice(0, 5), ["Attendance", "BUDGET"])
+
+        index.remove("budget")
+        self.assertEqual(len(index), 1)
+
+    def test_long_names_skipped(self):
+        """Names too long to offer as a Discord choice aren't completed."""
+
+        index = PrefixIndex(["a" * (MAX_COMPLETION_LENGTH + 1), "ab"])
+        self.assertEqual(index.complete("a"), ["ab"])
+
+
+if __name__ == "__main__":
+    unittest.main()
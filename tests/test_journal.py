@@ -0,0 +1,146 @@
+"""Tests for sosbot.journal."""
+import os
+import tempfile
+import unittest
+
+from benchmarks.fakes import CallLog, FakeGspread, FakeSpreadsheet, Latency
+from sosbot.journal import (OP_APPEND, OP_DELETE, WriteBehind, WriteJournal, coalesce,
+                            locate_rows, row_key)
+from sosbot.sheets import SheetsAccess
+
+
+def entry(operation: str, values=None, match=None) -> dict:
+    """Build a pending journal entry."""
+
+    return {"op": operation, "values": values, "match": match}
+
+
+class CoalesceTest(unittest.TestCase):
+    """coalesce() reduces a worksheet's pending entries to the calls that must reach it."""
+
+    def test_delete_cancels_append(self):
+        """A delete matching a row appended in the same batch cancels it, ignoring case."""
+
+        appends, deletes = coalesce([
+            entry(OP_APPEND, ["Alpha", "one"]),
+            entry(OP_APPEND, ["Beta", "two"]),
+            entry(OP_DELETE, match={"Term": "ALPHA"}),
+        ])
+        self.assertEqual(appends, [["Beta", "two"]])
+        self.assertEqual(deletes, [])
+
+    def test_delete_of_existing_row(self):
+        """A delete matching nothing queued is kept, to find its row in the Sheet."""
+
+        appends, deletes = coalesce([
+            entry(OP_DELETE, match={"Dataset": "Budget", "URL": "https://example.com"}),
+            entry(OP_APPEND, ["Budget", "https://example.org"]),
+        ])
+        self.assertEqual(appends, [["Budget", "https://example.org"]])
+        self.assertEqual(deletes, [{"Dataset": "Budget", "URL": "https://example.com"}])
+
+
+class LocateRowsTest(unittest.TestCase):
+    """locate_rows() finds the rows to delete in a worksheet's (projected) values."""
+
+    VALUES = [["Dataset", "URL"], ["Budget", "a"], ["budget", "b"], ["Levy", "a"]]
+
+    def test_first_match_each(self):
+        """Each delete removes the first row it matches, ignoring case, and no row twice."""
+
+        rows = locate_rows(self.VALUES, [
+            {"Dataset": "BUDGET"}, {"Dataset": "budget"}, {"Dataset": "levy", "URL": "A"},
+        ])
+        self.assertEqual(sorted(rows), [1, 2, 3])
+
+    def test_no_match(self):
+        """A delete that matches nothing is dropped."""
+
+        self.assertEqual(locate_rows(self.VALUES, [{"Dataset": "Bond"}]), [])
+        self.assertEqual(locate_rows([], [{"Dataset": "Bond"}]), [])
+
+    def test_missing_column(self):
+        """A delete naming a column the values don't have is dropped, rather than failing the
+        rest of the batch."""
+
+        rows = locate_rows(self.VALUES, [{"Description": "x"}, {"Dataset": "levy"}])
+        self.assertEqual(rows, [3])
+
+
+class RowKeyTest(unittest.TestCase):
+    """row_key() identifies a row by its leading columns."""
+
+    def test_folds_and_pads(self):
+        """Key columns are case-folded and trimmed, and missing ones read as empty."""
+
+        self.assertEqual(row_key([" Budget ", "URL", "desc"], 2), ("budget", "url"))
+        self.assertEqual(row_key(["Budget"], 2), ("budget", ""))
+
+
+class QueuedTest(unittest.TestCase):
+    """WriteBehind.queued() finds rows waiting in the journal, without asking Google."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.write_behind = WriteBehind(
+            WriteJournal(os.path.join(directory.name, "journal.jsonl")), sheets=None)
+        self.write_behind.set_key_columns("datasets", 2)
+
+    def test_queued_append(self):
+        """A queued row matches on its key columns only, ignoring case, in its own worksheet.
+        """
+
+        self.write_behind.append("datasets", "A-E", ["Budget", "https://a", "first"])
+        self.assertTrue(self.write_behind.queued("datasets", "A-E", ["BUDGET", "https://a", ""]))
+        self.assertFalse(self.write_behind.queued("datasets", "A-E", ["Budget", "https://b"]))
+        self.assertFalse(self.write_behind.queued("datasets", "F-J", ["Budget", "https://a"]))
+
+    def test_cancelled_append(self):
+        """A queued row that a later queued delete cancels doesn't count."""
+
+        self.write_behind.append("datasets", "A-E", ["Budget", "https://a", "first"])
+        self.write_behind.delete("datasets", "A-E", {"Dataset": "budget", "URL": "https://a"})
+        self.assertFalse(self.write_behind.queued("datasets", "A-E", ["Budget", "https://a"]))
+
+
+class SharedSheetTest(unittest.IsolatedAsyncioTestCase):
+    """With no key column cache, processes writing to the same worksheet see each other's
+    rows when flushing."""
+
+    def setUp(self):
+        """Setup a glossary worksheet, written to by two processes."""
+
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.spreadsheet = FakeSpreadsheet(
+            "glossary", {"A-E": [["Term", "Definition"], ["Beta", "b"]]}, Latency(), CallLog())
+        self.processes = []
+        for idx in range(2):
+            sheets = SheetsAccess(FakeGspread({"glossary": self.spreadsheet}))
+            self.addCleanup(sheets.shutdown)
+            self.processes.append(WriteBehind(
+                WriteJournal(os.path.join(directory.name, f"journal{idx}.jsonl")), sheets,
+                key_column_ttl=0))
+
+    async def write(self, process: int, term: str):
+        """Queue a row in one of the processes, and flush it."""
+
+        self.processes[process].append("glossary", "A-E", [term, term.lower()])
+        await self.processes[process].flush()
+
+    async def test_rows_from_other_processes(self):
+        """Rows are placed in order around, and not duplicate, the other process's rows."""
+
+        await self.write(0, "Carrot")
+        await self.write(1, "Apple")
+        await self.write(0, "Banana")
+        await self.write(0, "APPLE")
+
+        self.assertEqual([row[0] for row in self.spreadsheet.tabs["A-E"].values],
+                         ["Term", "Apple", "Banana", "Beta", "Carrot"])
+        self.assertEqual(self.processes[0].pending(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
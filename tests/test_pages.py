@@ -0,0 +1,39 @@
+"""Tests for sosbot.pages."""
+import unittest
+
+from sosbot.pages import MAX_MESSAGE, fit_lines
+
+
+class FitLinesTest(unittest.TestCase):
+    """fit_lines() keeps a list message within Discord's length limit."""
+
+    def test_fits(self):
+        """A short list is sent whole."""
+
+        self.assertEqual(fit_lines("2 matches:", ["* one", "* two"], "Use !more"),
+                         "2 matches:\n\n* one\n* two\n\nUse !more")
+
+    def test_too_many_lines(self):
+        """Lines that don't fit are counted instead."""
+
+        lines = [f"* {idx} " + "x" * 300 for idx in range(10)]
+        message = fit_lines("10 matches:", lines, "Use !more")
+
+        self.assertLessEqual(len(message), MAX_MESSAGE)
+        self.assertIn(lines[4], message)
+        self.assertNotIn(lines[9], message)
+        self.assertIn("...and 4 more", message)
+        self.assertTrue(message.endswith("Use !more"))
+
+    def test_long_header_and_line(self):
+        """A long query in the header is shortened, and so is a first line too long to fit."""
+
+        message = fit_lines("matches for '" + "q" * 3000 + "':", ["x" * 3000], "Use !more")
+
+        self.assertLessEqual(len(message), MAX_MESSAGE)
+        self.assertIn("q...\n\nxxx", message)
+        self.assertTrue(message.endswith("...\n\nUse !more"))
+
+
+if __name__ == "__main__":
+    unittest.main()
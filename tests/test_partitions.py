@@ -0,0 +1,74 @@
+"""Tests for the routing and splitting logic of sosbot.partitions."""
+import unittest
+
+from sosbot.partitions import PartitionMap, delete_rows, piece_title, split_rows
+
+
+class PartitionMapTest(unittest.TestCase):
+    """PartitionMap routes every key to the partition whose range holds it."""
+
+    def test_default_map(self):
+        """The default map matches the original first-letter split, ignoring case."""
+
+        partition_map = PartitionMap()
+        self.assertEqual(partition_map.route("apple"), "A-E")
+        self.assertEqual(partition_map.route("Eel"), "A-E")
+        self.assertEqual(partition_map.route("fig"), "F-J")
+        self.assertEqual(partition_map.route("Zebra"), "U-Z")
+
+    def test_every_key_has_a_home(self):
+        """Keys before the first start, or past the last, still get a partition."""
+
+        partition_map = PartitionMap()
+        self.assertEqual(partition_map.route("42nd street"), "A-E")
+        self.assertEqual(partition_map.route("école"), "U-Z")
+
+    def test_from_records(self):
+        """A stored map is read in any order, and an empty one falls back to the default."""
+
+        partition_map = PartitionMap.from_records([
+            {"Partition": "M-Z", "Starts At": "m"}, {"Partition": "A-L", "Starts At": ""},
+        ])
+        self.assertEqual(partition_map.titles, ["A-L", "M-Z"])
+        self.assertEqual(partition_map.route("Mill"), "M-Z")
+        self.assertEqual(len(PartitionMap.from_records([])), 5)
+
+
+class SplitRowsTest(unittest.TestCase):
+    """split_rows() cuts a partition into evenly sized pieces in key order."""
+
+    def test_even_pieces(self):
+        """Pieces hold at most about half of max_rows, and are about the same size."""
+
+        rows = [[f"term {idx:03d}"] for idx in reversed(range(120))]
+        pieces = split_rows(rows, 100)
+        self.assertEqual([len(piece) for _, piece in pieces], [40, 40, 40])
+        self.assertEqual([start for start, _ in pieces], ["term 000", "term 040", "term 080"])
+
+    def test_keys_stay_together(self):
+        """All the rows for a key go in the same piece, even past the piece size."""
+
+        rows = [["a"], ["b"], ["b"], ["B"], ["c"], ["d"]]
+        pieces = split_rows(rows, 4)
+        self.assertEqual([[row[0] for row in piece] for _, piece in pieces],
+                         [["a", "b", "b", "B"], ["c", "d"]])
+
+    def test_piece_title(self):
+        """New partitions are named after their key range, made unique if need be."""
+
+        rows = [["Salary"], ["Smith"]]
+        self.assertEqual(piece_title(rows, set()), "SAL-SMI")
+        self.assertEqual(piece_title(rows, {"SAL-SMI"}), "SAL-SMI 2")
+
+    def test_delete_rows(self):
+        """Adjacent rows are deleted together, bottom-up."""
+
+        requests = delete_rows(7, [5, 2, 3, 9])
+        self.assertEqual(
+            [(request["deleteDimension"]["range"]["startIndex"],
+              request["deleteDimension"]["range"]["endIndex"]) for request in requests],
+            [(9, 10), (5, 6), (2, 4)])
+
+
+if __name__ == "__main__":
+    unittest.main()
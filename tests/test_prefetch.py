@@ -0,0 +1,85 @@
+"""Tests for sosbot.prefetch."""
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from sosbot.prefetch import DEFAULT_MAX_BYTES, AttachmentPrefetcher, ByteBudget
+
+MB = 1024 * 1024
+
+
+def attachment(size: int) -> SimpleNamespace:
+    """Fake an attachment of the given size, whose download returns its size."""
+
+    async def to_file():
+        return size
+
+    return SimpleNamespace(size=size, to_file=to_file)
+
+
+def message(message_id: int, *sizes: int) -> SimpleNamespace:
+    """Fake a message with attachments of the given sizes."""
+
+    return SimpleNamespace(id=message_id, attachments=[attachment(size) for size in sizes])
+
+
+class ByteBudgetTest(unittest.IsolatedAsyncioTestCase):
+    """ByteBudget holds back items until they fit, but never blocks an oversized one forever."""
+
+    async def test_waits_until_released(self):
+        """An item that doesn't fit waits for enough of the budget to be released."""
+
+        budget = ByteBudget(10)
+        await budget.acquire(6)
+        waiting = asyncio.create_task(budget.acquire(6))
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+
+        await budget.release(6)
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(budget.used, 6)
+
+    async def test_oversized_item_waits_for_empty_budget(self):
+        """An item larger than the budget is let through once nothing else is held."""
+
+        budget = ByteBudget(10)
+        await budget.acquire(4)
+        waiting = asyncio.create_task(budget.acquire(25))
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+
+        await budget.release(4)
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(budget.used, 25)
+
+
+class AttachmentPrefetcherTest(unittest.IsolatedAsyncioTestCase):
+    """AttachmentPrefetcher downloads attachments in message order, within its budget."""
+
+    async def copy(self, messages, max_bytes: int = DEFAULT_MAX_BYTES):
+        """Fetch every message's files the way a thread copy does, releasing each after use."""
+
+        fetched = []
+        async with AttachmentPrefetcher(messages, max_bytes=max_bytes) as prefetcher:
+            for item in messages:
+                fetched.append(await asyncio.wait_for(prefetcher.files(item), 1))
+                await prefetcher.release(item)
+
+        return fetched
+
+    async def test_message_larger_than_budget(self):
+        """A message whose attachments add up to more than the whole budget (4 x 10 MB against
+        32 MB) is still downloaded, rather than waiting on its own attachments."""
+
+        messages = [message(1, *[10 * MB] * 4), message(2, MB)]
+        self.assertEqual(await self.copy(messages), [[10 * MB] * 4, [MB]])
+
+    async def test_messages_share_budget(self):
+        """Messages which don't all fit at once are downloaded as earlier ones are released."""
+
+        messages = [message(idx, 3, 4) for idx in range(5)]
+        self.assertEqual(await self.copy(messages, max_bytes=10), [[3, 4]] * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
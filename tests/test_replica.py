@@ -0,0 +1,97 @@
+"""Tests for sosbot.replica."""
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+
+from benchmarks.fakes import CallLog, FakeGspread, FakeSpreadsheet, Latency
+from sosbot.replica import SheetReplica, fetch_partitions
+from sosbot.sheets import SheetsAccess
+
+PARTITIONS = ["A-E", "F-J"]
+
+
+class Offline:
+    """Stands in for SheetsAccess while Google can't be reached."""
+
+    async def modified_time(self, spreadsheet_id: str) -> str:
+        """Fail, like every other call."""
+
+        raise ConnectionError(f"Can't reach {spreadsheet_id}")
+
+
+class SheetReplicaTest(unittest.IsolatedAsyncioTestCase):
+    """SheetReplica pulls a spreadsheet only when it changed, and serves it when offline."""
+
+    def setUp(self):
+        """Setup a two partition glossary, and an empty replica of it."""
+
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.calls = CallLog()
+        self.spreadsheet = FakeSpreadsheet("glossary", {
+            "A-E": [["Term", "Definition"], ["Alpha", "a"], ["Beta", "b"]],
+            "F-J": [["Term", "Definition"], ["Gamma", "g"]],
+        }, Latency(), self.calls)
+        # no freshness window, so each sync asks the fake again
+        self.sheets = SheetsAccess(FakeGspread({"glossary": self.spreadsheet}), freshness=0)
+        self.addCleanup(self.sheets.shutdown)
+        self.replica = SheetReplica(os.path.join(directory.name, "replica", "replica.db"))
+        self.addCleanup(self.replica.close)
+
+    def change(self, title: str, row: list):
+        """Add a row to a worksheet, moving the spreadsheet's modifiedTime on."""
+
+        self.spreadsheet.tabs[title].values.append(row)
+        self.spreadsheet.modified += timedelta(seconds=1)
+
+    async def test_first_sync(self):
+        """The first sync pulls every partition, and stores their rows in order."""
+
+        self.assertFalse(self.replica.has("glossary"))
+        changed = await self.replica.sync(self.sheets, "glossary", PARTITIONS)
+
+        self.assertEqual(sorted(changed), PARTITIONS)
+        self.assertTrue(self.replica.has("glossary"))
+        self.assertEqual([row["Term"] for row in self.replica.load("glossary")["A-E"]],
+                         ["Alpha", "Beta"])
+        self.assertEqual(self.replica.lookup("glossary", "GAMMA"),
+                         [{"Term": "Gamma", "Definition": "g"}])
+
+    async def test_unchanged(self):
+        """When the modifiedTime hasn't changed, only it is read."""
+
+        await self.replica.sync(self.sheets, "glossary", PARTITIONS)
+        pulls = self.calls.counts["values_batch_get"]
+
+        self.assertEqual(await self.replica.sync(self.sheets, "glossary", PARTITIONS), [])
+        self.assertEqual(self.calls.counts["values_batch_get"], pulls)
+        self.assertEqual(self.calls.counts["get_lastUpdateTime"], 2)
+
+    async def test_changed(self):
+        """After a change, the spreadsheet is pulled again, and only the partitions whose
+        contents differ are rewritten."""
+
+        await self.replica.sync(self.sheets, "glossary", PARTITIONS)
+        self.change("F-J", ["Iota", "i"])
+
+        self.assertEqual(await self.replica.sync(self.sheets, "glossary", PARTITIONS), ["F-J"])
+        self.assertEqual([row["Term"] for row in self.replica.load("glossary")["F-J"]],
+                         ["Gamma", "Iota"])
+
+    async def test_offline(self):
+        """When Google can't be reached, a populated replica is served as it is, and an empty
+        one fails."""
+
+        with self.assertRaises(ConnectionError):
+            await fetch_partitions(Offline(), self.replica, "glossary", PARTITIONS)
+
+        await self.replica.sync(self.sheets, "glossary", PARTITIONS)
+        self.change("A-E", ["Delta", "d"])
+
+        partitions = await fetch_partitions(Offline(), self.replica, "glossary", PARTITIONS)
+        self.assertEqual([row["Term"] for row in partitions["A-E"]], ["Alpha", "Beta"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Tests for sosbot.replies."""
+import os
+import tempfile
+import unittest
+
+from sosbot.replies import ReplyGraph
+
+CHANNEL = 7
+
+
+class ReplyGraphTest(unittest.TestCase):
+    """The graph resolves reply trees, and knows where it may be missing replies."""
+
+    def test_descendants(self):
+        """Replies to replies are found, but not the rest of the channel."""
+
+        graph = ReplyGraph(started_at=0)
+        graph.add(CHANNEL, 1)
+        graph.add(CHANNEL, 2, 1)
+        graph.add(CHANNEL, 3, 2)
+        graph.add(CHANNEL, 4)
+        graph.add(CHANNEL, 5, 1)
+
+        self.assertEqual(graph.descendants(1), {2, 3, 5})
+        self.assertEqual(graph.parent(3), (True, 2))
+        self.assertFalse(graph.parent(9)[0])
+        self.assertEqual(graph.count_between(CHANNEL, 2, 4), 3)
+        self.assertEqual(graph.count_between(CHANNEL + 1, 2, 4), 0)
+
+    def test_eviction_raises_horizon(self):
+        """The least recently used message is dropped once the graph is full, and replies to
+        it are no longer trusted to be complete."""
+
+        graph = ReplyGraph(started_at=0, max_messages=3)
+        graph.add(CHANNEL, 1)
+        graph.add(CHANNEL, 2, 1)
+        graph.parent(1)
+        graph.add(CHANNEL, 3, 1)
+        graph.add(CHANNEL, 4, 3)
+
+        self.assertNotIn(2, graph)
+        self.assertEqual(len(graph), 3)
+        self.assertEqual(graph.descendants(1), {3, 4})
+        self.assertEqual(graph.horizon(CHANNEL), 2)
+        self.assertFalse(graph.covers(CHANNEL, 1))
+        self.assertTrue(graph.covers(CHANNEL, 3))
+
+    def test_gap_after_restart(self):
+        """Loading a saved graph leaves a gap for the time the bot was down, until it's
+        filled in."""
+
+        graph = ReplyGraph(started_at=10)
+        graph.add(CHANNEL, 11)
+        graph.add(CHANNEL, 12, 11)
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "graph", "replies.json")
+            graph.save(path)
+
+            restarted = ReplyGraph(started_at=20)
+            restarted.load(path)
+
+        self.assertEqual(restarted.gap(CHANNEL), (12, 20))
+        self.assertEqual(restarted.horizon(CHANNEL), 10)
+        self.assertFalse(restarted.covers(CHANNEL, 11))
+        self.assertEqual(restarted.descendants(11), {12})
+
+        restarted.fill_gap(CHANNEL, [(15, 11), (16, None)])
+        self.assertIsNone(restarted.gap(CHANNEL))
+        self.assertTrue(restarted.covers(CHANNEL, 11))
+        self.assertEqual(restarted.descendants(11), {12, 15})
+
+
+if __name__ == "__main__":
+    unittest.main()
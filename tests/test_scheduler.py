@@ -0,0 +1,110 @@
+"""Tests for sosbot.scheduler."""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from sosbot.scheduler import (KIND_READ, KIND_WRITE, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE,
+                              STORE_BUSY_DELAY, QuotaStore, TokenBucket, is_retryable)
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    """TokenBucket lets a burst through, then paces callers, most urgent first."""
+
+    async def test_burst_then_paced(self):
+        """The first burst of callers go straight through, and the next waits for a refill."""
+
+        bucket = TokenBucket(6000, burst=3)
+        for _ in range(3):
+            await asyncio.wait_for(bucket.acquire(), 0.01)
+
+        started = time.monotonic()
+        await asyncio.wait_for(bucket.acquire(), 1)
+        self.assertGreater(time.monotonic() - started, 0.005)
+
+    async def test_priority_order(self):
+        """Waiting callers get tokens in priority order, whatever order they arrived in."""
+
+        bucket = TokenBucket(6000, burst=1)
+        await bucket.acquire()
+        served = []
+
+        async def wait(name: str, level: int):
+            await bucket.acquire(level)
+            served.append(name)
+
+        waiters = [
+            asyncio.create_task(wait("background", PRIORITY_BACKGROUND)),
+            asyncio.create_task(wait("interactive", PRIORITY_INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(bucket.waiting(), 2)
+
+        await asyncio.wait_for(asyncio.gather(*waiters), 1)
+        self.assertEqual(served, ["interactive", "background"])
+
+
+class QuotaStoreTest(unittest.TestCase):
+    """QuotaStore shares bucket levels between processes, without blocking on their locks."""
+
+    def setUp(self):
+        """Open a store in a scratch directory."""
+
+        self.workdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.workdir.name, "quota", "quota.db")
+        self.store = QuotaStore(self.path)
+
+    def tearDown(self):
+        """Close the store, and remove its directory."""
+
+        self.store.close()
+        self.workdir.cleanup()
+
+    def test_shared_levels(self):
+        """Tokens taken through one connection are gone for the others."""
+
+        other = QuotaStore(self.path)
+        try:
+            self.assertEqual(self.store.take(KIND_READ, 0.001, 1), 0)
+            self.assertGreater(other.take(KIND_READ, 0.001, 1), 100)
+        finally:
+            other.close()
+
+    def test_busy(self):
+        """While another process holds the lock, taking a token returns a short delay."""
+
+        other = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            other.execute("BEGIN IMMEDIATE")
+            started = time.monotonic()
+            delay = self.store.take(KIND_READ, 1, 1)
+            self.assertLess(time.monotonic() - started, 0.1)
+            self.assertGreaterEqual(delay, STORE_BUSY_DELAY)
+            self.assertLessEqual(delay, 2 * STORE_BUSY_DELAY)
+            other.execute("ROLLBACK")
+        finally:
+            other.close()
+
+        self.assertEqual(self.store.take(KIND_READ, 1, 1), 0)
+
+
+class RetryableTest(unittest.TestCase):
+    """Transient failures are retried for reads, but not for writes that may have landed."""
+
+    def test_timeouts(self):
+        """A timed-out read is retried; a timed-out write may have been applied, and isn't."""
+
+        self.assertTrue(is_retryable(asyncio.TimeoutError(), KIND_READ))
+        self.assertFalse(is_retryable(asyncio.TimeoutError(), KIND_WRITE))
+
+    def test_other_errors(self):
+        """Errors that aren't Google's or the network's are never retried."""
+
+        self.assertFalse(is_retryable(ValueError("bad"), KIND_READ))
+        self.assertFalse(is_retryable(ValueError("bad"), KIND_WRITE))
+
+
+if __name__ == "__main__":
+    unittest.main()
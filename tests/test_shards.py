@@ -0,0 +1,31 @@
+"""Tests for sosbot.shards."""
+import unittest
+
+from sosbot.shards import format_shard_ids, parse_shard_ids, split_shards
+
+
+class ShardIdsTest(unittest.TestCase):
+    """Shard ids are read and written as lists of ids and inclusive ranges."""
+
+    def test_parse(self):
+        """Ranges are expanded, and ids sorted with duplicates removed."""
+
+        self.assertEqual(parse_shard_ids("8, 0-3,2"), [0, 1, 2, 3, 8])
+        self.assertEqual(parse_shard_ids(""), [])
+
+    def test_round_trip(self):
+        """Formatted ids read back as the same ids."""
+
+        ids = [0, 1, 2, 5, 7, 8]
+        self.assertEqual(format_shard_ids(ids), "0-2,5,7-8")
+        self.assertEqual(parse_shard_ids(format_shard_ids(ids)), ids)
+
+    def test_split(self):
+        """Shards are split into contiguous ranges whose sizes differ by at most one."""
+
+        self.assertEqual(split_shards(10, 3), [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        self.assertEqual(split_shards(2, 5), [[0], [1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
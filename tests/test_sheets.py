@@ -0,0 +1,73 @@
+"""Tests for sosbot.sheets."""
+import asyncio
+import unittest
+
+from benchmarks.fakes import CallLog, FakeGspread, FakeSpreadsheet, Latency
+from sosbot.sheets import SheetsAccess
+
+
+class CoalesceTest(unittest.IsolatedAsyncioTestCase):
+    """SheetsAccess shares reads of a spreadsheet until it's written to."""
+
+    def setUp(self):
+        """Setup a one worksheet glossary, slow enough for reads to overlap."""
+
+        self.calls = CallLog()
+        self.spreadsheet = FakeSpreadsheet(
+            "glossary", {"A-E": [["Term", "Definition"], ["Alpha", "a"]]}, Latency(0.05, 0),
+            self.calls)
+
+    def access(self, freshness: float) -> SheetsAccess:
+        """Setup the access layer over the glossary, reusing reads for freshness seconds."""
+
+        sheets = SheetsAccess(FakeGspread({"glossary": self.spreadsheet}), freshness=freshness)
+        self.addCleanup(sheets.shutdown)
+        return sheets
+
+    async def test_concurrent_reads(self):
+        """Identical reads in flight at the same time make one call."""
+
+        sheets = self.access(0)
+        sheet = await sheets.worksheet("glossary", "A-E")
+        results = await asyncio.gather(*(sheets.get_all_values(sheet) for _ in range(5)))
+
+        self.assertEqual(self.calls.counts["get_all_values"], 1)
+        self.assertEqual(results, [[["Term", "Definition"], ["Alpha", "a"]]] * 5)
+
+    async def test_freshness_window(self):
+        """A read soon after an identical one is answered with its result, until the window
+        has passed."""
+
+        sheets = self.access(0.2)
+        sheet = await sheets.worksheet("glossary", "A-E")
+        await sheets.get_all_values(sheet)
+        await sheets.get_all_values(sheet)
+        self.assertEqual(self.calls.counts["get_all_values"], 1)
+
+        await asyncio.sleep(0.2)
+        await sheets.get_all_values(sheet)
+        self.assertEqual(self.calls.counts["get_all_values"], 2)
+
+    async def test_write_forces_read(self):
+        """After a write to the spreadsheet, the next read goes to Google, even if an earlier
+        one was still in flight when the write started."""
+
+        sheets = self.access(60)
+        sheet = await sheets.worksheet("glossary", "A-E")
+        in_flight = asyncio.ensure_future(sheets.get_all_values(sheet))
+        await asyncio.sleep(0)
+
+        await sheets.batch_update(sheet, [{"updateCells": {
+            "start": {"sheetId": sheet.id, "rowIndex": 1, "columnIndex": 0},
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": value}}
+                                 for value in ("Alpha", "changed")]}],
+            "fields": "userEnteredValue",
+        }}])
+        await in_flight
+
+        self.assertEqual((await sheets.get_all_values(sheet))[1], ["Alpha", "changed"])
+        self.assertEqual(self.calls.counts["get_all_values"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
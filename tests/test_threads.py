@@ -0,0 +1,40 @@
+"""Tests for the argument parsing of sosbot.cogs.threads."""
+import unittest
+from datetime import date
+
+from sosbot.cogs.threads import parse_range
+
+
+class ParseRangeTest(unittest.TestCase):
+    """parse_range() splits a !load-convo argument into a title and a date range."""
+
+    def test_title_only(self):
+        """Without options, the whole argument is the title, and the range is open."""
+
+        self.assertEqual(parse_range("budget talk "), ("budget talk", None, None))
+
+    def test_date(self):
+        """--date selects a single day."""
+
+        self.assertEqual(parse_range("budget --date 2024-03-05"),
+                         ("budget", date(2024, 3, 5), date(2024, 3, 5)))
+
+    def test_from_to(self):
+        """--from and --to bound the range, in any accepted format."""
+
+        self.assertEqual(parse_range("budget --from 03/01/2024 --to 2024-03-31"),
+                         ("budget", date(2024, 3, 1), date(2024, 3, 31)))
+        self.assertEqual(parse_range("budget --from 2024-03-01"),
+                         ("budget", date(2024, 3, 1), None))
+
+    def test_errors(self):
+        """Unknown options and unreadable dates are rejected."""
+
+        with self.assertRaises(ValueError):
+            parse_range("budget --since 2024-03-01")
+        with self.assertRaises(ValueError):
+            parse_range("budget --date March")
+
+
+if __name__ == "__main__":
+    unittest.main()